@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Per-invocation endpoint parsing cost as swagger.json grows.
+
+Compares building a FerryParser for every swagger path (what FerryCLI.generate_endpoints used to
+do) with loading the compiled endpoint index and building only the parser for the endpoint that
+is called.  Run from the repository root:
+
+    python3 benchmarks/bench_endpoint_parsing.py [--sizes 200 1000 5000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ferry_cli.helpers.customs import FerryParser
+from ferry_cli.helpers.endpoint_index import (
+    SWAGGER_FILENAME,
+    EndpointParsers,
+    build_endpoint_index,
+    load_endpoint_index,
+)
+
+
+def synthetic_swagger(num_paths: int) -> Dict[str, Any]:
+    paths = {}
+    for i in range(num_paths):
+        paths[f"/endpoint{i}"] = {
+            "get": {
+                "description": f"Returns the attributes of thing number {i}, for a user or group. "
+                * 3,
+                "parameters": [
+                    {
+                        "name": f"param{j}",
+                        "description": f"Parameter {j} of endpoint {i}, used to narrow down the result",
+                        "type": "string",
+                        "required": j == 0,
+                    }
+                    for j in range(4)
+                ],
+            }
+        }
+    return {"info": {"version": "bench"}, "paths": paths}
+
+
+def eager_invocation(swagger_file: str, endpoint: str) -> None:
+    with open(swagger_file, "r") as f:
+        api_data = json.load(f)
+    parsers = {}
+    for path, data in api_data["paths"].items():
+        parser = FerryParser.create_subparser(
+            path.replace("/", ""), method="GET", description=data["get"]["description"]
+        )
+        parser.set_arguments(data["get"]["parameters"])
+        parsers[path.replace("/", "")] = parser
+    parsers[endpoint].parse_known_args(["--param0", "value"])
+
+
+def lazy_invocation(config_dir: str, endpoint: str) -> None:
+    endpoints = EndpointParsers(load_endpoint_index(config_dir))
+    endpoints[endpoint].parse_known_args(["--param0", "value"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[200, 500, 1000, 2000, 5000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'paths':>6} {'eager (ms)':>12} {'index load (ms)':>16} {'lazy total (ms)':>16}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as config_dir:
+            swagger_file = os.path.join(config_dir, SWAGGER_FILENAME)
+            with open(swagger_file, "w") as f:
+                json.dump(synthetic_swagger(size), f)
+            build_endpoint_index(config_dir)
+            endpoint = f"endpoint{size // 2}"
+
+            def best(stmt: Any) -> float:
+                return min(timeit.repeat(stmt, number=1, repeat=args.repeat)) * 1000
+
+            eager = best(lambda: eager_invocation(swagger_file, endpoint))
+            index_load = best(
+                lambda: load_endpoint_index(
+                    config_dir
+                )  # pylint: disable=cell-var-from-loop
+            )
+            lazy = best(lambda: lazy_invocation(config_dir, endpoint))
+        print(f"{size:>6} {eager:>12.2f} {index_load:>16.2f} {lazy:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
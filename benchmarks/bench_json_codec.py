@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""JSON decode and encode throughput on a large synthetic FERRY response, for each backend.
+
+Decoding is what FerryAPI.call_endpoint does with every response.  Encoding is timed both the way
+output is written in compatibility mode (identical to json.dumps(indent=4), streamed) and with each
+fast backend's own pretty-printing (compatible = False).  Backends that aren't installed are
+skipped.  Run from the repository root:
+
+    python3 benchmarks/bench_json_codec.py [--users 20000 100000] [--repeat 5]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import timeit
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from ferry_cli.helpers import jsoncodec
+from ferry_cli.helpers.output import write_json
+
+
+def synthetic_response(num_users: int) -> Dict[str, Any]:
+    """Something shaped like getAllUsers' response"""
+    return {
+        "ferry_status": "success",
+        "ferry_error": [],
+        "ferry_output": [
+            {
+                "username": f"user{i}",
+                "uid": 10000 + i,
+                "full_name": f"Fermilab User Number {i}",
+                "status": i % 7 != 0,
+                "expiration_date": "2038-01-01T00:00:00Z" if i % 3 else None,
+                "groups": [f"group{i % 50}", f"group{i % 13}"],
+                "vopersonid": f"{i:08x}-0000-4000-8000-{i:012x}",
+                "banned": False,
+            }
+            for i in range(num_users)
+        ],
+        "request_url": "https://ferry.example.com/getAllUsers",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = []
+    for name in jsoncodec.BACKENDS:
+        jsoncodec.configure(name)
+        # A backend that isn't installed falls back to the standard library
+        if jsoncodec.backend_name() == name:
+            backends.append(name)
+
+    print(f"{'users':>7} {'MB':>6} {'operation':<28} {'ms':>9} {'MB/s':>8}")
+    for num_users in args.users:
+        response = synthetic_response(num_users)
+        content = json.dumps(response).encode()
+        size_mb = len(content) / 1e6
+
+        def report(operation: str, func: Callable[[], Any]) -> None:
+            seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print(
+                f"{num_users:>7} {size_mb:>6.1f} {operation:<28} {seconds * 1000:>9.1f} "
+                f"{size_mb / seconds:>8.1f}"
+            )
+
+        for name in backends:
+            jsoncodec.configure(name)
+            report(f"decode ({name})", lambda: jsoncodec.loads(content))
+
+        report("encode json.dumps(indent=4)", lambda: json.dumps(response, indent=4))
+        jsoncodec.configure("stdlib")
+        report(
+            "encode streamed (compatible)", lambda: write_json(response, io.StringIO())
+        )
+        for name in backends:
+            if name == "stdlib":
+                continue
+            jsoncodec.configure(name, compatible=False)
+            report(
+                f"encode indented ({name})",
+                lambda: write_json(response, io.StringIO()),
+            )
+        jsoncodec.configure()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+# pylint: disable=too-many-lines
 import argparse
 import configparser
 import json
@@ -5,41 +6,68 @@ import os
 import pathlib
 import sys
 import textwrap
-from typing import Any, Dict, Optional, List, Type
+import time
+from typing import Any, Callable, Dict, Optional, List, Tuple, Type, TYPE_CHECKING
 from urllib.parse import urlsplit, urlunsplit, SplitResult
 
-import validators  # pylint: disable=import-error
-
 # pylint: disable=unused-import
 try:
     # Try package import
-    from ferry_cli.helpers.api import FerryAPI
+    from ferry_cli.helpers.api import FerryAPI, DEFAULT_CONCURRENCY
     from ferry_cli.helpers.auth import (
         Auth,
+        AuthCert,
+        AuthToken,
         DebugLevel,
         get_auth_args,
+        preflight_check,
         set_auth_from_args,
         get_auth_parser,
     )
     from ferry_cli.helpers.customs import FerryParser
+    from ferry_cli.helpers import jsoncodec
+    from ferry_cli.helpers.endpoint_index import (
+        EndpointIndex,
+        EndpointParsers,
+        load_endpoint_index,
+    )
     from ferry_cli.helpers.supported_workflows import SUPPORTED_WORKFLOWS
     from ferry_cli.safeguards.dcs import SafeguardsDCS
     from ferry_cli.config import CONFIG_DIR, config
 except ImportError:
     # Fallback to direct import
-    from helpers.api import FerryAPI  # type: ignore
+    from helpers.api import FerryAPI, DEFAULT_CONCURRENCY  # type: ignore
     from helpers.auth import (  # type: ignore
         Auth,
+        AuthCert,
+        AuthToken,
         DebugLevel,
         get_auth_args,
+        preflight_check,
         set_auth_from_args,
         get_auth_parser,
     )
     from helpers.customs import FerryParser  # type: ignore
+    from helpers import jsoncodec  # type: ignore
+    from helpers.endpoint_index import (  # type: ignore
+        EndpointIndex,
+        EndpointParsers,
+        load_endpoint_index,
+    )
     from helpers.supported_workflows import SUPPORTED_WORKFLOWS  # type: ignore
     from safeguards.dcs import SafeguardsDCS  # type: ignore
     from config import CONFIG_DIR, config  # type: ignore
 
+if TYPE_CHECKING:
+    try:
+        from ferry_cli.helpers.cache import ResponseCache
+        from ferry_cli.helpers.ratelimit import RateLimiter
+        from ferry_cli.helpers.snapshot import Snapshot
+    except ImportError:
+        from helpers.cache import ResponseCache  # type: ignore
+        from helpers.ratelimit import RateLimiter  # type: ignore
+        from helpers.snapshot import Snapshot  # type: ignore
+
 
 class FerryCLI:
     # pylint: disable=too-many-instance-attributes
@@ -62,11 +90,22 @@ class FerryCLI:
             base_url (str): The base URL for the Ferry API.
             dev_url (str): The development URL for the Ferry API.
             safeguards (SafeguardsDCS): An instance of SafeguardsDCS for managing safeguards.
-            endpoints (Dict[str, Any]): A dictionary to store API endpoints.
+            endpoints (EndpointParsers): A mapping of API endpoints to their parsers, which are built on first use.
             ferry_api (Optional[FerryAPI]): An instance of the FerryAPI class, initialized later.
             parser (Optional[FerryParser]): An instance of the FerryParser class, initialized later.
             config_path (pathlib.Path): The path to the configuration file.
             configs (dict): Parsed configuration data from the configuration file.
+            api_options (dict): Connection pool settings for FerryAPI, from the [api] section of the configuration file.
+            cache_enabled (bool): Whether GET responses are cached, from the [cache] section of the configuration file.
+            cache_options (dict): ResponseCache settings, from the [cache] and [cache-ttl] sections of the configuration file.
+            response_cache (Optional[ResponseCache]): The response cache, created on first use.
+            retry_options (dict): RetryPolicy settings, from the [retry] section of the configuration file.
+            circuit_breaker_options (dict): CircuitBreaker settings, from the [retry] section of the configuration file.
+            rate_limit_options (dict): RateLimiter settings, from the [rate-limit] section of the configuration file.
+            rate_limiter (Optional[RateLimiter]): The rate limiter shared by every FerryAPI we make, created on first use.
+            snapshot_options (dict): Snapshot settings, from the [snapshot] section of the configuration file.
+            snapshot (Optional[Snapshot]): The local snapshot of FERRY's collections, created on first use.
+            preflight_options (dict): Credential checks before calling FERRY, from the [authorization] section of the configuration file.
             authorizer (Auth): The authorizer instance used for API authentication.
 
         Raises:
@@ -74,8 +113,19 @@ class FerryCLI:
         """
         self.base_url: str
         self.dev_url: str
+        self.api_options: Dict[str, Any] = {}
+        self.cache_enabled = True
+        self.cache_options: Dict[str, Any] = {}
+        self.response_cache: Optional["ResponseCache"] = None
+        self.retry_options: Dict[str, Any] = {}
+        self.circuit_breaker_options: Dict[str, Any] = {}
+        self.rate_limit_options: Dict[str, Any] = {}
+        self.rate_limiter: Optional["RateLimiter"] = None
+        self.snapshot_options: Dict[str, Any] = {}
+        self.snapshot: Optional["Snapshot"] = None
+        self.preflight_options: Dict[str, Any] = {}
         self.safeguards = SafeguardsDCS()
-        self.endpoints: Dict[str, Any] = {}
+        self.endpoints: EndpointParsers = EndpointParsers(EndpointIndex({}))
         self.ferry_api: Optional["FerryAPI"] = None
         self.parser: Optional["FerryParser"] = None
         if print_help:
@@ -94,13 +144,56 @@ class FerryCLI:
         self.dev_url = self._sanitize_base_url(self.dev_url)
 
     def get_arg_parser(self: "FerryCLI") -> FerryParser:
+        # Only needed to build the parser, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.output import OUTPUT_FORMATS
+            from ferry_cli.helpers.snapshot import COLLECTIONS
+        except ImportError:
+            from helpers.output import OUTPUT_FORMATS  # type: ignore
+            from helpers.snapshot import COLLECTIONS  # type: ignore
+
         parser = FerryParser.create(
-            description="CLI for Ferry API endpoints", parents=[get_auth_parser()]
+            description="CLI for Ferry API endpoints",
+            parents=[get_auth_parser()],
+            epilog="Local snapshot: 'snapshot sync [COLLECTION ...]' downloads FERRY's large collections into a local database, "
+            "'snapshot status' shows when each was synced, and 'query COLLECTION' looks records up in it (with --where, --select and --format).  "
+            f"Collections: {', '.join(COLLECTIONS)}.",
         )
         parser.add_argument(
             "--output",
             default=None,
-            help="(string) Specifies the path to a file where the output will be stored in JSON format. If a file already exists in the specified path, it will be overritten.",
+            help="(string) Specifies the path to a file where the output will be stored, in the format chosen with --format. If a file already exists in the specified path, it will be overritten.",
+        )
+        parser.add_argument(
+            "--format",
+            choices=OUTPUT_FORMATS,
+            default="json",
+            help="Output format for -e and -w.  json (the default) prints the whole response, indented; json-compact prints it on one line.  "
+            "ndjson, csv and tsv print the records in ferry_output one per line.",
+        )
+        parser.add_argument(
+            "--columns",
+            default=None,
+            help="(string) Comma-separated fields to print, in order, with --format csv or tsv.  Defaults to the --select fields, or else the fields of the first record.",
+        )
+        parser.add_argument(
+            "--select",
+            default=None,
+            help="(string) Comma-separated fields to keep in each record of the response (e.g. username,uid).  Other fields are dropped.",
+        )
+        parser.add_argument(
+            "--where",
+            action="append",
+            default=None,
+            help="(string) Only output records matching 'field op value', where op is one of ==, !=, <, <=, >, >=, ~ (contains) or !~ (e.g. 'status == true').  "
+            "May be given more than once, to require every condition.",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Parse the records of -e's response one at a time as they're downloaded, so memory use stays small for large responses (e.g. getAllUsers).  "
+            "Streamed responses aren't cached.",
         )
         parser.add_argument(
             "--filter",
@@ -138,7 +231,49 @@ class FerryCLI:
             help="List parameters for the supported workflow",
         )
         parser.add_argument("-e", "--endpoint", help="API endpoint and parameters")
+
         parser.add_argument("-w", "--workflow", help="Execute supported workflows")
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            default=False,
+            help="Run the workflow against the current state in FERRY: read it once, then make only the writes that are still needed",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            default=False,
+            help="Print the writes --reconcile would make, as --batch lines, without making them",
+        )
+        parser.add_argument(
+            "--resume",
+            default=None,
+            metavar="RUN_ID",
+            help="Resume a workflow run that stopped part way, skipping the steps it completed.  Give the same workflow and arguments",
+        )
+        parser.add_argument(
+            "--batch",
+            default=None,
+            help='(string) Path to a JSONL file (or "-" for stdin) of endpoint calls to make, one per line, as {"endpoint": ..., "params": {...}}. Results are printed as JSONL in the order the calls complete.',
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help=f"(int) Maximum number of --batch calls, or of a workflow's independent steps and bulk updates, to make at once. Defaults to {DEFAULT_CONCURRENCY}",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            default=False,
+            help="Don't use or store cached responses",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            default=False,
+            help="Ignore cached responses, and replace them with fresh ones",
+        )
         parser.add_argument(
             "--show-config-file",
             action="store_true",
@@ -165,12 +300,13 @@ class FerryCLI:
                     Listing all supported endpoints{filter_str}':
                     """
                 )
-                for ep, subparser in endpoints.items():
+                # Descriptions come straight from the endpoint index, so no parsers are built here
+                for ep, description in endpoints.descriptions():
                     if filter_args.filter:
                         if filter_args.filter.lower() in ep.lower():
-                            print(subparser.description)
+                            print(description)
                     else:
-                        print(subparser.description)
+                        print(description)
                 sys.exit(0)
 
         return _ListEndpoints
@@ -258,8 +394,7 @@ class FerryCLI:
               """
             % (self.base_url, endpoint)
         )
-        subparser = self.endpoints.get(endpoint, None)
-        if not subparser:
+        if endpoint not in self.endpoints:
             print(
                 # pylint: disable=consider-using-f-string
                 """
@@ -268,43 +403,93 @@ class FerryCLI:
                 % endpoint
             )
         else:
-            print(subparser.format_help())
+            print(self.endpoints.format_help(endpoint))
             print()
 
-    def execute_endpoint(self: "FerryCLI", endpoint: str, params: List[str]) -> Any:
+    def parse_endpoint_params(
+        self: "FerryCLI", endpoint: str, params: List[str]
+    ) -> Dict[str, Any]:
         try:
             subparser = self.endpoints[endpoint]
         except KeyError:
             raise ValueError(  # pylint: disable=raise-missing-from
                 f"Error: '{endpoint}' is not a valid endpoint. Run 'ferry -l' for a full list of available endpoints."
             )
+        params_args, _ = subparser.parse_known_args(params)
+        return vars(params_args)
+
+    def execute_endpoint(
+        self: "FerryCLI", endpoint: str, params: List[str], stream: bool = False
+    ) -> Any:
+        params_dict = self.parse_endpoint_params(endpoint, params)
+        return self.ferry_api.call_endpoint(  # type: ignore
+            endpoint,
+            method=self.endpoints.method(endpoint),
+            params=params_dict,
+            stream=stream,
+        )
+
+    def execute_batch(
+        self: "FerryCLI",
+        batch_file: str,
+        concurrency: int,
+        output_file: Optional[str] = None,
+        debug_level: DebugLevel = DebugLevel.NORMAL,
+    ) -> None:
+        """Make every call in batch_file (see helpers.batch), up to concurrency at a time, after checking all of them"""
+        # asyncio is slow to import, so only batches pay for it
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.async_api import AsyncFerryAPI
+            from ferry_cli.helpers.batch import prepare_batch, read_batch, run_batch
+        except ImportError:
+            from helpers.async_api import AsyncFerryAPI  # type: ignore
+            from helpers.batch import prepare_batch, read_batch, run_batch  # type: ignore
+
+        if batch_file == "-":
+            calls = read_batch(sys.stdin)
         else:
-            params_args, _ = subparser.parse_known_args(params)
-            return self.ferry_api.call_endpoint(endpoint, params=vars(params_args))  # type: ignore
-
-    def generate_endpoints(self: "FerryCLI") -> Dict[str, FerryParser]:
-        endpoints = {}
-        with open(f"{CONFIG_DIR}/swagger.json", "r") as json_file:
-
-            api_data = json.load(json_file)
-            for path, data in api_data["paths"].items():
-                endpoint = path.replace("/", "")
-                if "get" in data:
-                    method = "get"
-                elif "post" in data:
-                    method = "post"
-                elif "put" in data:
-                    method = "put"
-
-                endpoint_parser = FerryParser.create_subparser(
-                    endpoint,
-                    method=method.upper(),
-                    description=data[method]["description"],
-                )
-                endpoint_parser.set_arguments(data[method].get("parameters", []))
-                endpoints[path.replace("/", "")] = endpoint_parser
+            with open(batch_file, "r") as f:
+                calls = read_batch(f)
+        calls = prepare_batch(
+            calls,
+            self.parse_endpoint_params,
+            self.safeguards.verify,
+            self.endpoints.method,
+        )
 
-        return endpoints
+        async_api = AsyncFerryAPI.from_api(self.ferry_api, concurrency)  # type: ignore
+        # Like single calls, nothing is written in a dry run or quiet mode, unless there's an output file
+        write_results = not async_api.dryrun and (
+            bool(output_file) or debug_level != DebugLevel.QUIET
+        )
+        try:
+            if output_file:
+                with open(output_file, "w") as out:
+                    failures = run_batch(async_api, calls, out, write_results)
+            else:
+                failures = run_batch(async_api, calls, sys.stdout, write_results)
+        finally:
+            async_api.close()
+
+        if debug_level == DebugLevel.DEBUG:
+            print(
+                f"Batch complete: {len(calls) - failures} succeeded, {failures} failed",
+                file=sys.stderr,
+            )
+        if failures:
+            sys.exit(1)
+
+    def generate_endpoints(self: "FerryCLI") -> EndpointParsers:
+        # The index is compiled from swagger.json, and is rebuilt automatically if swagger.json changed.
+        # Parsers for individual endpoints are only built when they are looked up.
+        index = load_endpoint_index()
+        if len(self.endpoints) and (
+            self.endpoints.index.swagger_hash == index.swagger_hash
+        ):
+            # Keep the parsers we've already built (e.g. when running as a daemon)
+            return self.endpoints
+        return EndpointParsers(index)
 
     def parse_description(
         self: "FerryCLI", name: str, desc: str, method: Optional[str] = None
@@ -321,7 +506,7 @@ class FerryCLI:
             endpoint_description += f"{'':<50} | {line}\n"
         return endpoint_description
 
-    def run(
+    def run(  # pylint: disable=too-many-branches,too-many-statements
         self: "FerryCLI",
         debug_level: DebugLevel,
         dryrun: bool,
@@ -342,24 +527,45 @@ class FerryCLI:
             print(f"Using FERRY base url: {self.base_url}")
 
         if not self.ferry_api:
-            self.ferry_api = FerryAPI(
-                base_url=self.base_url,
-                authorizer=self.authorizer,
-                debug_level=debug_level,
-                dryrun=dryrun,
-            )
+            self.ferry_api = self.make_ferry_api(debug_level, dryrun)
+        else:
+            # Reusing an existing FerryAPI (and its session), but these are per-invocation settings
+            self.ferry_api.debug_level = debug_level
+            self.ferry_api.dryrun = dryrun
+
+        # With --no-cache we still keep the cache, so that any writes invalidate it
+        cache = self.get_response_cache()
+        self.ferry_api.cache = cache
+        self.ferry_api.refresh_cache = args.refresh
+        self.ferry_api.bypass_cache = args.no_cache
+        self.ferry_api.endpoint_index = self.endpoints.index
+        self.ferry_api.snapshot = self.get_snapshot()
+        if cache is not None:
+            cache.reset_stats()
+
+        output_options = self._get_output_options(args)
+        if args.plan or args.reconcile:
+            self._check_plan_supported(args.workflow)
+
+        if not dryrun and (
+            args.endpoint
+            or args.workflow
+            or args.batch
+            or endpoint_args[:2] == ["snapshot", "sync"]
+        ):
+            self._check_credentials(debug_level)
 
         if args.endpoint:
             # Prevent DCS from running this endpoint if necessary, and print proper steps to take instead.
             self.safeguards.verify(args.endpoint)
             try:
-                json_result = self.execute_endpoint(args.endpoint, endpoint_args)
+                json_result = self.execute_endpoint(
+                    args.endpoint, endpoint_args, stream=args.stream
+                )
             except Exception as e:
                 raise Exception(f"{e}")
             if not dryrun:
-                self.handle_output(
-                    json.dumps(json_result, indent=4), args.output, debug_level
-                )
+                self._output_result(json_result, args, debug_level, output_options)
 
         elif args.workflow:
             try:
@@ -367,40 +573,405 @@ class FerryCLI:
                 workflow = SUPPORTED_WORKFLOWS[args.workflow]()
                 workflow.init_parser()
                 workflow_params, _ = workflow.parser.parse_known_args(endpoint_args)
-                json_result = workflow.run(self.ferry_api, vars(workflow_params))  # type: ignore
-                if (not dryrun) and json_result:
-                    self.handle_output(
-                        json.dumps(json_result, indent=4), args.output, debug_level
-                    )
+                workflow.concurrency = args.concurrency
+                workflow.plan_only = args.plan
+                json_result = self._run_workflow(
+                    workflow, vars(workflow_params), args, debug_level, dryrun
+                )
+                # An empty plan is still output, so --plan always prints its result
+                if (not dryrun) and (json_result or args.plan):
+                    self._output_result(json_result, args, debug_level, output_options)
+                if workflow.failures:
+                    sys.exit(1)
             except KeyError:
                 raise KeyError(f"Error: '{args.workflow}' is not a supported workflow.")
 
+        elif args.batch:
+            self.execute_batch(args.batch, args.concurrency, args.output, debug_level)
+
+        elif endpoint_args[:1] == ["snapshot"]:
+            self.run_snapshot(endpoint_args[1:], args, debug_level, output_options)
+
+        elif endpoint_args[:1] == ["query"]:
+            self.run_query(endpoint_args[1:], args, debug_level, output_options)
+
         else:
             self.parser.print_help()
 
-    def handle_output(
+        if debug and cache is not None:
+            print(f"Response cache ({cache.cache_dir}): {cache.stats}")
+
+    def _check_credentials(self: "FerryCLI", debug_level: DebugLevel) -> None:
+        """Fail before calling FERRY if our credentials have expired (or are about to), rather than
+        partway through a workflow or batch.  Each credential is only decoded once per process, so in
+        the daemon this is a dictionary lookup.
+
+        Raises:
+            CredentialError: See preflight_check
+        """
+        options = dict(self.preflight_options)
+        if not options.pop("preflight_check", True):
+            return
+        remaining = preflight_check(
+            self.authorizer, quiet=debug_level == DebugLevel.QUIET, **options
+        )
+        if debug_level == DebugLevel.DEBUG and remaining is not None:
+            print(
+                f"{self.authorizer.credential_name} is valid for another {remaining / 60:.0f} minutes"
+            )
+
+    def _get_output_options(
+        self: "FerryCLI", args: argparse.Namespace
+    ) -> Dict[str, Any]:
+        """Parse --select, --where and --columns, exiting with a usage error if they're invalid"""
+        # Only needed to filter responses, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.records import Condition, parse_select
+        except ImportError:
+            from helpers.records import Condition, parse_select  # type: ignore
+
+        assert self.parser is not None
+        columns = None
+        if args.columns:
+            if args.format not in ("csv", "tsv"):
+                self.parser.error("--columns can only be used with --format csv or tsv")
+            columns = [column.strip() for column in args.columns.split(",")]
+        try:
+            select = parse_select(args.select) if args.select else None
+            conditions = [Condition(condition) for condition in args.where or []]
+        except ValueError as e:
+            self.parser.error(str(e))
+        if columns is None and args.format in ("csv", "tsv"):
+            columns = select
+        return {"select": select, "conditions": conditions, "columns": columns}
+
+    def _check_plan_supported(self: "FerryCLI", workflow_name: Optional[str]) -> None:
+        """Exit with a usage error if --reconcile or --plan was given without a workflow that can plan"""
+        assert self.parser is not None
+        if not workflow_name:
+            self.parser.error(
+                "--reconcile and --plan can only be used with -w/--workflow"
+            )
+        # Unknown workflows are reported when they're looked up to be run
+        if (
+            workflow_name in SUPPORTED_WORKFLOWS
+            and not SUPPORTED_WORKFLOWS[workflow_name].supports_plan()
+        ):
+            self.parser.error(
+                f"The {workflow_name} workflow does not support --reconcile or --plan"
+            )
+
+    def _run_workflow(
+        self: "FerryCLI",
+        workflow: Any,
+        params: Dict[str, Any],
+        args: argparse.Namespace,
+        debug_level: DebugLevel,
+        dryrun: bool,
+    ) -> Any:
+        """Run workflow with params, journaling its completed writes (see helpers.journal) unless
+        it makes none, or it's a dry run or only plans, so that a run that stops part way can be resumed"""
+        # Only needed to run workflows, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.journal import WorkflowJournal
+        except ImportError:
+            from helpers.journal import WorkflowJournal  # type: ignore
+
+        if args.resume and not workflow.makes_writes:
+            raise ValueError(
+                f"--resume can't be used with the {workflow.name} workflow, which makes no writes"
+            )
+        if args.resume and (dryrun or args.plan):
+            raise ValueError("--resume can't be used with --dryrun or --plan")
+        if workflow.makes_writes and not (dryrun or args.plan):
+            journal_dir = config.get_cache_dir() / "journal"
+            workflow.journal = (
+                WorkflowJournal.resume(
+                    journal_dir, args.resume, workflow.name, params, self.base_url
+                )
+                if args.resume
+                else WorkflowJournal.create(
+                    journal_dir, workflow.name, params, self.base_url
+                )
+            )
+            if args.resume and debug_level != DebugLevel.QUIET:
+                print(
+                    f"Resuming workflow run {args.resume}: {workflow.journal.resumed} write(s) already made"
+                )
+            elif debug_level == DebugLevel.DEBUG:
+                print(
+                    f"Journaling workflow run {workflow.journal.run_id} to {workflow.journal.path}"
+                )
+        finished = False
+        try:
+            if args.plan or args.reconcile:
+                result = workflow.reconcile(self.ferry_api, params)
+            else:
+                result = workflow.run(self.ferry_api, params)
+            # A run with failed items can be resumed, to retry them
+            finished = not workflow.failures
+        except SystemExit as exit_info:
+            # Some workflows exit when they're done
+            finished = not exit_info.code
+            raise
+        finally:
+            if workflow.journal is not None:
+                workflow.journal.close(finished)
+                if not finished and debug_level != DebugLevel.QUIET:
+                    print(
+                        f"Workflow run {workflow.journal.run_id} stopped before it finished.  "
+                        f"To resume it, run the same command with --resume {workflow.journal.run_id}",
+                        file=sys.stderr,
+                    )
+        return result
+
+    def _output_result(
+        self: "FerryCLI",
+        result: Any,
+        args: argparse.Namespace,
+        debug_level: DebugLevel,
+        output_options: Dict[str, Any],
+    ) -> None:
+        """Filter and project result's records as asked, and output it"""
+        # Only needed to filter responses, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.records import filter_response
+        except ImportError:
+            from helpers.records import filter_response  # type: ignore
+
+        self.handle_output(
+            filter_response(
+                result, output_options["select"], output_options["conditions"]
+            ),
+            args.output,
+            debug_level,
+            args.format,
+            output_options["columns"],
+        )
+
+    def run_snapshot(
+        self: "FerryCLI",
+        command: List[str],
+        args: argparse.Namespace,
+        debug_level: DebugLevel,
+        output_options: Dict[str, Any],
+    ) -> None:
+        """Run 'snapshot sync [COLLECTION ...]' or 'snapshot status'"""
+        # Only needed for the local snapshot, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.snapshot import COLLECTIONS, SnapshotError
+        except ImportError:
+            from helpers.snapshot import COLLECTIONS, SnapshotError  # type: ignore
+
+        assert self.parser is not None and self.ferry_api is not None
+        snapshot = self.get_snapshot()
+        if command[:1] == ["sync"]:
+            names = command[1:] or list(COLLECTIONS)
+            try:
+                for name in names:
+                    snapshot.collection(name)
+            except SnapshotError as e:
+                self.parser.error(str(e))
+            failures = 0
+            for name in names:
+                start = time.monotonic()
+                try:
+                    count = snapshot.sync(self.ferry_api, name)
+                except Exception as e:  # pylint: disable=broad-except
+                    failures += 1
+                    print(f"{name}: sync failed: {e}", file=sys.stderr)
+                    continue
+                if debug_level != DebugLevel.QUIET and not self.ferry_api.dryrun:
+                    print(
+                        f"{name}: stored {count} records from {COLLECTIONS[name].endpoint} "
+                        f"in {time.monotonic() - start:.1f}s"
+                    )
+            if failures:
+                sys.exit(1)
+        elif command == ["status"]:
+            self._output_result(snapshot.status(), args, debug_level, output_options)
+        else:
+            self.parser.error(
+                "Expected 'snapshot sync [COLLECTION ...]' or 'snapshot status'"
+            )
+
+    def run_query(
+        self: "FerryCLI",
+        command: List[str],
+        args: argparse.Namespace,
+        debug_level: DebugLevel,
+        output_options: Dict[str, Any],
+    ) -> None:
+        """Run 'query COLLECTION', answering --where from the local snapshot"""
+        # Only needed for the local snapshot, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.snapshot import COLLECTIONS
+        except ImportError:
+            from helpers.snapshot import COLLECTIONS  # type: ignore
+
+        assert self.parser is not None
+        if len(command) != 1:
+            self.parser.error(
+                f"Expected 'query COLLECTION', where COLLECTION is one of {', '.join(COLLECTIONS)}"
+            )
+        name = command[0]
+        snapshot = self.get_snapshot()
+        records = snapshot.query(name, output_options["conditions"])
+        age = snapshot.age(name)
+        if debug_level != DebugLevel.QUIET and (
+            age is None or 0 < snapshot.max_age < age
+        ):
+            print(
+                f"Note: the snapshot of {name} may be out of date.  Run 'ferry-cli snapshot sync {name}' to update it.",
+                file=sys.stderr,
+            )
+        # The conditions have been applied already
+        self._output_result(
+            records, args, debug_level, {**output_options, "conditions": None}
+        )
+
+    def get_response_cache(self: "FerryCLI") -> Optional["ResponseCache"]:
+        """Return the response cache configured in the config file, or None if caching is disabled"""
+        if not self.cache_enabled:
+            return None
+        if self.response_cache is None:
+            # Only needed once FERRY is called, so keep it off the import path
+            # pylint: disable=import-outside-toplevel
+            try:
+                from ferry_cli.helpers.cache import ResponseCache
+            except ImportError:
+                from helpers.cache import ResponseCache  # type: ignore
+
+            cache_options = dict(self.cache_options)
+            cache_dir = cache_options.pop("cache_dir", None) or config.get_cache_dir()
+            self.response_cache = ResponseCache(
+                cache_dir, identity=self.authorizer.identity(), **cache_options
+            )
+        return self.response_cache
+
+    def get_rate_limiter(self: "FerryCLI") -> Optional["RateLimiter"]:
+        """Return the rate limiter configured in the config file, or None if no limits are set"""
+        # Only needed once FERRY is called, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.ratelimit import RateLimiter, READ, WRITE
+        except ImportError:
+            from helpers.ratelimit import RateLimiter, READ, WRITE  # type: ignore
+
+        limits = {
+            kind: (
+                self.rate_limit_options.get(f"{kind}_rate", 0.0),
+                self.rate_limit_options.get(f"{kind}_burst", 1.0),
+            )
+            for kind in (READ, WRITE)
+        }
+        if not any(rate > 0 for rate, _ in limits.values()):
+            return None
+        if self.rate_limiter is None:
+            state_file = None
+            if self.rate_limit_options.get("shared", True):
+                # One state file per FERRY server, so that limits for one don't hold up another
+                state_file = str(
+                    config.get_runtime_dir() / f"ratelimit-{self._server_name()}.json"
+                )
+            self.rate_limiter = RateLimiter(limits, state_file)
+        return self.rate_limiter
+
+    def get_snapshot(self: "FerryCLI") -> "Snapshot":
+        """Return the local snapshot of FERRY's collections, configured in the config file"""
+        if self.snapshot is None:
+            # Only needed for the local snapshot, so keep it off the import path
+            # pylint: disable=import-outside-toplevel
+            try:
+                from ferry_cli.helpers.snapshot import Snapshot
+            except ImportError:
+                from helpers.snapshot import Snapshot  # type: ignore
+
+            snapshot_options = dict(self.snapshot_options)
+            # One snapshot per FERRY server
+            path = snapshot_options.pop("path", None) or (
+                config.get_cache_dir() / f"snapshot-{self._server_name()}.sqlite3"
+            )
+            self.snapshot = Snapshot(
+                path, identity=self.authorizer.identity(), **snapshot_options
+            )
+        return self.snapshot
+
+    def _server_name(self: "FerryCLI") -> str:
+        """Our FERRY server, in a form that can be used in file names"""
+        return urlsplit(self.base_url).netloc.replace(":", "_") or "default"
+
+    def make_ferry_api(
         self: "FerryCLI",
-        output: str,
+        debug_level: DebugLevel = DebugLevel.NORMAL,
+        dryrun: bool = False,
+    ) -> FerryAPI:
+        """Create a FerryAPI for our base_url and authorizer, using the connection settings from the config file"""
+        # Only needed once FERRY is called, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.resilience import CircuitBreaker, RetryPolicy
+        except ImportError:
+            from helpers.resilience import CircuitBreaker, RetryPolicy  # type: ignore
+
+        return FerryAPI(
+            base_url=self.base_url,
+            authorizer=self.authorizer,
+            debug_level=debug_level,
+            dryrun=dryrun,
+            retry_policy=RetryPolicy(**self.retry_options),
+            circuit_breaker=CircuitBreaker(**self.circuit_breaker_options),
+            rate_limiter=self.get_rate_limiter(),
+            **self.api_options,
+        )
+
+    def handle_output(  # pylint: disable=too-many-branches
+        self: "FerryCLI",
+        output: Any,
         output_file: str = "",
         debug_level: DebugLevel = DebugLevel.NORMAL,
+        output_format: str = "json",
+        columns: Optional[List[str]] = None,
     ) -> None:
+        """Write a JSON response to stdout, or to output_file, in output_format (see output.write_output).
+        The default, "json", is formatted as json.dumps(output, indent=4) would.
+
+        The response is serialized as it is written, so that large responses aren't also held in
+        memory as one big string.  output_file is replaced atomically once the response is fully written.
+        """
+
+        # Only needed to write output, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.output import atomic_output, write_output
+        except ImportError:
+            from helpers.output import atomic_output, write_output  # type: ignore
+
         def error_raised(
             exception_type: Type[BaseException],
             message: str,
         ) -> None:
             message = f"{exception_type.__name__}\n" f"{message}"
             if debug_level != DebugLevel.QUIET:
-                message += f"\nPrinting response instead: {output}"
+                message += f"\nPrinting response instead: {json.dumps(output, indent=4, default=str)}"
             raise exception_type(message)
 
         if not output_file:
             if debug_level == DebugLevel.QUIET:
                 return
 
-            print_string = (
-                f"Response: {output}" if (debug_level == DebugLevel.DEBUG) else output
-            )
-            print(print_string)
+            if output_format == "json":
+                if debug_level == DebugLevel.DEBUG:
+                    sys.stdout.write("Response: ")
+                write_output(output, sys.stdout)
+                sys.stdout.write("\n")
+            else:
+                write_output(output, sys.stdout, output_format, columns)
             return
 
         directory = os.path.dirname(output_file)
@@ -415,8 +986,8 @@ class FerryCLI:
             except OSError as e:
                 error_raised(OSError, f"Error creating directory: {e}")
         try:
-            with open(output_file, "w") as file:
-                file.write(output)
+            with atomic_output(output_file) as file:
+                write_output(output, file, output_format, columns)
             if debug_level == DebugLevel.DEBUG:
                 print(f"Output file: {output_file}")
             return
@@ -472,10 +1043,117 @@ class FerryCLI:
         if _dev_url is not None:
             self.dev_url = _dev_url.strip().strip('"')
 
+        # Optional connection pool, retry, circuit breaker and rate limit settings.  Anything not set
+        # falls back to the defaults of FerryAPI, RetryPolicy, CircuitBreaker and get_rate_limiter
+        self.api_options.update(
+            self._get_options(
+                configs,
+                "api",
+                pool_connections=configs.getint,
+                pool_maxsize=configs.getint,
+                max_retries=configs.getint,
+                keep_alive=configs.getboolean,
+            )
+        )
+        self.retry_options.update(
+            self._get_options(
+                configs,
+                "retry",
+                retries=configs.getint,
+                backoff=configs.getfloat,
+                max_backoff=configs.getfloat,
+                connect_timeout=configs.getfloat,
+                read_timeout=configs.getfloat,
+            )
+        )
+        self.circuit_breaker_options.update(
+            self._get_options(
+                configs,
+                "retry",
+                failure_threshold=configs.getint,
+                reset_timeout=configs.getfloat,
+            )
+        )
+        self.rate_limit_options.update(
+            self._get_options(
+                configs,
+                "rate-limit",
+                read_rate=configs.getfloat,
+                read_burst=configs.getfloat,
+                write_rate=configs.getfloat,
+                write_burst=configs.getfloat,
+                shared=configs.getboolean,
+            )
+        )
+
+        # Optional credential pre-flight settings.  Anything not set falls back to preflight_check's defaults
+        self.preflight_options.update(
+            self._get_options(
+                configs,
+                "authorization",
+                preflight_check=configs.getboolean,
+                warn_minutes=configs.getfloat,
+                fail_minutes=configs.getfloat,
+            )
+        )
+
+        # Optional JSON backend settings.  By default the fastest installed backend is used, in
+        # compatibility mode
+        json_options = self._get_options(
+            configs, "json", backend=configs.get, compatible=configs.getboolean
+        )
+        if json_options:
+            jsoncodec.configure(**json_options)
+
+        # Optional response cache settings.  Anything not set falls back to ResponseCache's defaults
+        self.cache_enabled = configs.getboolean("cache", "enabled", fallback=True)
+        if configs.has_option("cache", "directory"):
+            self.cache_options["cache_dir"] = pathlib.Path(
+                os.path.expanduser(configs.get("cache", "directory").strip('"'))
+            )
+        self.cache_options.update(
+            self._get_options(
+                configs,
+                "cache",
+                max_size_mb=configs.getfloat,
+                default_ttl=configs.getfloat,
+            )
+        )
+        if configs.has_section("cache-ttl"):
+            self.cache_options["ttls"] = {
+                endpoint: configs.getfloat("cache-ttl", endpoint)
+                for endpoint in configs.options("cache-ttl")
+            }
+
+        # Optional local snapshot settings.  Anything not set falls back to Snapshot's defaults
+        if configs.has_option("snapshot", "path"):
+            self.snapshot_options["path"] = pathlib.Path(
+                os.path.expanduser(configs.get("snapshot", "path").strip('"'))
+            )
+        self.snapshot_options.update(
+            self._get_options(configs, "snapshot", max_age=configs.getfloat)
+        )
+
         return configs
 
+    @staticmethod
+    def _get_options(
+        configs: configparser.ConfigParser,
+        section: str,
+        **getters: Callable[[str, str], Any],
+    ) -> Dict[str, Any]:
+        """Read the options in section that are set, converting each one with its getter (e.g. configs.getint)"""
+        return {
+            option: getter(section, option)
+            for option, getter in getters.items()
+            if configs.has_option(section, option)
+        }
+
 
 def get_config_info_from_user() -> Dict[str, str]:
+    # validators is only needed here, so don't make every other invocation pay to import it
+    import validators  # pylint: disable=import-error,import-outside-toplevel
+
     print(
         "\nLaunching interactive mode to generate config file with user supplied values..."
     )
@@ -581,6 +1259,9 @@ def handle_no_args(_config_path: Optional[pathlib.Path]) -> bool:
 
 # pylint: disable=too-many-branches
 def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        run_daemon(sys.argv[2:])
+
     _config_path = config.get_configfile_path()
     if len(sys.argv) == 1:
         # User just called python3 ferry-cli or ferry-cli with no arguments
@@ -612,19 +1293,53 @@ def main() -> None:
         FerryCLI(print_help=True)
         sys.exit(0)
 
+    # If a ferry-cli daemon is running, let it handle this invocation.  Our stdin can't be
+    # forwarded, so invocations that read it (--batch - or --file -) always run in-process.
+    if not _reads_stdin(sys.argv[1:]):
+        # Only needed to forward to a daemon, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli import daemon
+        except ImportError:
+            import daemon  # type: ignore
+
+        exit_code = daemon.forward(sys.argv[1:], config_path)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    execute_cli(config_path)
+
+
+def execute_cli(
+    config_path: Optional[pathlib.Path],
+    warm_clis: Optional[Dict[Tuple[Any, ...], FerryCLI]] = None,
+) -> None:
+    """
+    Runs the FERRY CLI for the arguments in sys.argv.
+
+    Args:
+        config_path (Optional[pathlib.Path]): The path to the configuration file.
+        warm_clis (Optional[Dict]): If given, FerryCLI instances are looked up in and added to this
+            dictionary, keyed by the credentials they use, so that they (and their FerryAPI sessions and
+            endpoint parsers) are reused across calls.  This is how the daemon keeps its state warm.
+    """
     try:
         auth_args, other_args = get_auth_args()
-        ferry_cli = FerryCLI(
-            config_path=config_path, authorizer=set_auth_from_args(auth_args)
-        )
+        authorizer = set_auth_from_args(auth_args)
+        if warm_clis is None:
+            ferry_cli = FerryCLI(config_path=config_path, authorizer=authorizer)
+        else:
+            key = _warm_cli_key(authorizer)
+            if key not in warm_clis:
+                warm_clis[key] = FerryCLI(
+                    config_path=config_path, authorizer=authorizer
+                )
+            ferry_cli = warm_clis[key]
+
         if auth_args.update or not os.path.exists(f"{CONFIG_DIR}/swagger.json"):
             if auth_args.debug_level != DebugLevel.QUIET:
                 print("Fetching latest swagger file...")
-            ferry_cli.ferry_api = FerryAPI(
-                ferry_cli.base_url,
-                ferry_cli.authorizer,
-                auth_args.debug_level,
-            )
+            ferry_cli.ferry_api = ferry_cli.make_ferry_api(auth_args.debug_level)
             ferry_cli.ferry_api.get_latest_swagger_file()
             if auth_args.debug_level != DebugLevel.QUIET:
                 print("Successfully stored latest swagger file.\n")
@@ -650,5 +1365,54 @@ def main() -> None:
         sys.exit(1)
 
 
+# Options that read their input from stdin when given "-"
+_STDIN_OPTIONS = ("--batch", "--file")
+
+
+def _reads_stdin(args: List[str]) -> bool:
+    return any(f"{option}=-" in args for option in _STDIN_OPTIONS) or any(
+        arg in _STDIN_OPTIONS and value == "-" for arg, value in zip(args, args[1:])
+    )
+
+
+def _warm_cli_key(authorizer: Auth) -> Tuple[Any, ...]:
+    """Key for a reusable FerryCLI.  A renewed token or proxy gets a fresh FerryCLI (and session)"""
+    if isinstance(authorizer, AuthToken):
+        return ("token", authorizer.token_string)
+    if isinstance(authorizer, AuthCert):
+        return (
+            "cert",
+            authorizer.cert_path,
+            os.stat(authorizer.cert_path).st_mtime_ns,
+            authorizer.ca_path,
+        )
+    return (type(authorizer).__name__,)
+
+
+def run_daemon(args: List[str]) -> None:
+    """Handles `ferry-cli daemon ...`"""
+    # Only needed for daemon mode, so keep socket handling off the import path
+    # pylint: disable=import-outside-toplevel
+    try:
+        from ferry_cli import daemon
+    except ImportError:
+        import daemon  # type: ignore
+
+    config_path = config.get_configfile_path()
+    if config_path is None or not config_path.exists():
+        print(
+            'A configuration file is required to run the Ferry CLI daemon. Please run "ferry-cli" to generate one interactively.'
+        )
+        sys.exit(1)
+
+    warm_clis: Dict[Tuple[Any, ...], FerryCLI] = {}
+
+    def _handler(_: List[str]) -> None:
+        # daemon.run_request has already set sys.argv to the forwarded arguments
+        execute_cli(config_path, warm_clis)
+
+    daemon.main(args, _handler)
+
+
 if __name__ == "__main__":
     main()
@@ -85,3 +85,44 @@ def _write_out_configfile_with_template(
 
 def _get_template_path() -> pathlib.Path:
     return pathlib.Path(CONFIG_DIR) / "config.ini"
+
+
+def get_runtime_dir() -> pathlib.Path:
+    """
+    Return the per-user directory for ferry_cli runtime files (like the daemon socket).
+    If $XDG_RUNTIME_DIR is set, this is $XDG_RUNTIME_DIR/ferry_cli.  Otherwise,
+    /tmp/ferry_cli_u<euid> is used.
+
+    The directory is created, readable only by the current user, if it does not exist.
+    """
+    xdg_runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if xdg_runtime_dir:
+        runtime_dir = pathlib.Path(xdg_runtime_dir) / "ferry_cli"
+    else:
+        runtime_dir = pathlib.Path(f"/tmp/ferry_cli_u{os.geteuid()}")
+    runtime_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if runtime_dir.stat().st_uid != os.geteuid():
+        raise PermissionError(
+            f"Runtime directory {runtime_dir} is not owned by the current user"
+        )
+    return runtime_dir
+
+
+def get_cache_dir() -> pathlib.Path:
+    """
+    Return the per-user directory for cached FERRY responses.  If $XDG_CACHE_HOME is set,
+    this is $XDG_CACHE_HOME/ferry_cli.  Otherwise, $HOME/.cache/ferry_cli is used, or
+    /tmp/ferry_cli_cache_u<euid> if $HOME is not set either.
+
+    The directory is created, readable only by the current user, if it does not exist.
+    """
+    xdg_cache_home = os.getenv("XDG_CACHE_HOME")
+    home = os.getenv("HOME")
+    if xdg_cache_home:
+        cache_dir = pathlib.Path(xdg_cache_home) / "ferry_cli"
+    elif home:
+        cache_dir = pathlib.Path(home) / ".cache" / "ferry_cli"
+    else:
+        cache_dir = pathlib.Path(f"/tmp/ferry_cli_cache_u{os.geteuid()}")
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return cache_dir
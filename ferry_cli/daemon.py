@@ -0,0 +1,418 @@
+"""Resident ferry-cli daemon.
+
+`ferry-cli daemon start` keeps a warm FerryCLI (config, endpoint parsers, FerryAPI session and
+credentials) in memory, and serves ferry-cli invocations over a per-user Unix domain socket.
+When the daemon is running, the ferry-cli entry point forwards its arguments to it instead of
+doing all of that setup again, and falls back to running in-process when it is not.
+
+The protocol is one JSON request line per connection, {"argv": [...], "cwd": "...", "env": {...},
+"config_path": "...", "cache_dir": "..."}, answered by JSON lines: {"stream": "stdout" or
+"stderr", "data": "..."} for output, sent as the invocation writes it, and a last line with its
+exit code, {"exit_code": 0}.  A client whose configuration file or cache directory isn't the
+daemon's is answered with {"refused": "..."} instead, and runs in-process, so it isn't served
+with another configuration's FERRY URL, credentials settings, cache or journals.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+try:
+    from ferry_cli.config import config
+except ImportError:
+    from config import config  # type: ignore
+
+if TYPE_CHECKING:
+    import socket
+
+__all__ = ["FORWARDED_ENV", "get_socket_path", "forward", "serve", "main"]
+
+SOCKET_NAME = "daemon.sock"
+
+# Set this to any value to always run in-process, even if a daemon is running
+NO_DAEMON_ENV = "FERRY_CLI_NO_DAEMON"
+# Overrides the socket location
+SOCKET_ENV = "FERRY_CLI_SOCKET"
+
+# Environment variables that change how a single invocation behaves, and so are passed along
+# from the client to the daemon for the duration of the request.  Those that choose the
+# configuration file and cache directory aren't: a client whose configuration differs is
+# refused, and runs in-process
+FORWARDED_ENV = (
+    "BEARER_TOKEN",
+    "BEARER_TOKEN_FILE",
+    "X509_USER_PROXY",
+    "XDG_RUNTIME_DIR",
+    "COLUMNS",
+)
+
+# How long the client waits for the daemon to accept a connection before running in-process
+CONNECT_TIMEOUT = 0.5
+
+# Handles a single invocation, given its arguments (without the program name)
+Handler = Callable[[List[str]], None]
+
+# Sends one chunk of an invocation's output, given its stream ("stdout" or "stderr") and text
+OutputWriter = Callable[[str, str], None]
+
+
+def get_socket_path() -> str:
+    socket_path = os.getenv(SOCKET_ENV)
+    if socket_path:
+        return socket_path
+    return str(config.get_runtime_dir() / SOCKET_NAME)
+
+
+def _identity(config_path: Optional["os.PathLike[str]"]) -> Dict[str, str]:
+    """What an invocation's configuration depends on beyond its arguments and forwarded
+    environment, which has to be the same for the client and the daemon"""
+    return {
+        "config_path": os.path.abspath(config_path) if config_path else "",
+        "cache_dir": str(config.get_cache_dir()),
+    }
+
+
+def _mismatch(request: Dict[str, Any], identity: Dict[str, str]) -> str:
+    """Why the daemon can't run request for its client, or "" if it can"""
+    for key, value in identity.items():
+        if request.get(key) != value:
+            return f"The client's {key} is {request.get(key)}, not the daemon's {value}"
+    return ""
+
+
+def _output_writer() -> OutputWriter:
+    """Writes output forwarded from the daemon to our stdout or stderr, as they are now"""
+    streams = {"stdout": sys.stdout, "stderr": sys.stderr}
+
+    def write(stream: str, data: str) -> None:
+        f = streams.get(stream, sys.stdout)
+        f.write(data)
+        f.flush()
+
+    return write
+
+
+def _send(
+    socket_path: str,
+    request: Dict[str, Any],
+    on_output: Optional[OutputWriter] = None,
+) -> Optional[Dict[str, Any]]:
+    """Send a request to the daemon, passing its output to on_output (by default, our stdout and
+    stderr) as it arrives, and return its last line.  Returns None if no daemon is listening"""
+    # Only needed when a daemon is running, so keep it off the import path
+    import socket  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    if on_output is None:
+        on_output = _output_writer()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+            return None
+        # Once connected, the request may legitimately take as long as the FERRY calls it makes
+        sock.settimeout(None)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        received = False
+        with sock.makefile("rb") as f:
+            for line in f:
+                received = True
+                message = dict(json.loads(line))
+                if "stream" not in message:
+                    return message
+                on_output(message["stream"], message["data"])
+    finally:
+        sock.close()
+    # The daemon went away part way through.  Its output has been written already, so the
+    # invocation can't be run again in-process
+    return {"exit_code": 1} if received else None
+
+
+def forward(
+    argv: List[str], config_path: Optional["os.PathLike[str]"] = None
+) -> Optional[int]:
+    """Run this invocation on the daemon, if one is running with the same configuration file and
+    cache directory.  Its output is written as the daemon produces it.
+
+    Args:
+        argv (List[str]): ferry-cli arguments, without the program name
+        config_path (Optional[os.PathLike]): The configuration file this invocation would use.
+            Defaults to the one config.get_configfile_path finds
+
+    Returns:
+        Optional[int]: The exit code of the invocation, or None if it was not handled by a daemon
+            and should be run in-process
+    """
+    if os.getenv(NO_DAEMON_ENV):
+        return None
+    try:
+        socket_path = get_socket_path()
+        if not os.path.exists(socket_path):
+            return None
+        identity = _identity(
+            config_path if config_path is not None else config.get_configfile_path()
+        )
+    except OSError:
+        return None
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": {key: os.environ[key] for key in FORWARDED_ENV if key in os.environ},
+        **identity,
+    }
+    try:
+        response = _send(socket_path, request)
+    except OSError:
+        return None
+    if response is None or "refused" in response:
+        return None
+    return int(response.get("exit_code", 1))
+
+
+@contextlib.contextmanager
+def _invocation_context(request: Dict[str, Any]) -> Iterator[None]:
+    """Make the daemon process look like the client's: argv, forwarded environment and cwd"""
+    saved_argv = sys.argv
+    saved_env = {key: os.environ.get(key) for key in FORWARDED_ENV}
+    saved_cwd = os.getcwd()
+    saved_stdin = sys.stdin
+    try:
+        sys.argv = ["ferry-cli"] + list(request.get("argv", []))
+        for key in FORWARDED_ENV:
+            os.environ.pop(key, None)
+        os.environ.update(request.get("env", {}))
+        os.chdir(request.get("cwd", saved_cwd))
+        # There is nobody on the other end to answer a prompt
+        sys.stdin = io.StringIO()
+        yield
+    finally:
+        sys.argv = saved_argv
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        os.chdir(saved_cwd)
+        sys.stdin = saved_stdin
+
+
+class _OutputStream(io.TextIOBase):
+    """A stdout or stderr that passes what is written to it on as it goes: whole lines as they are
+    completed, and anything else when it is flushed"""
+
+    def __init__(self: "_OutputStream", name: str, write: OutputWriter) -> None:
+        super().__init__()
+        self._name = name
+        self._write = write
+        self._buffer = ""
+        # redirect_stdout is process-wide, so workflows' threads all write here at once
+        self._lock = threading.Lock()
+
+    def writable(self: "_OutputStream") -> bool:
+        return True
+
+    def write(self: "_OutputStream", s: str) -> int:
+        with self._lock:
+            self._buffer += s
+            end = self._buffer.rfind("\n") + 1
+            if end:
+                self._write(self._name, self._buffer[:end])
+                self._buffer = self._buffer[end:]
+        return len(s)
+
+    def flush(self: "_OutputStream") -> None:
+        with self._lock:
+            if self._buffer:
+                self._write(self._name, self._buffer)
+                self._buffer = ""
+
+
+def run_request(handler: Handler, request: Dict[str, Any], write: OutputWriter) -> int:
+    """Run a single forwarded invocation through handler, passing its output to write as it is
+    produced, and return its exit code"""
+    stdout = _OutputStream("stdout", write)
+    stderr = _OutputStream("stderr", write)
+    exit_code = 0
+    with _invocation_context(request), contextlib.redirect_stdout(
+        stdout
+    ), contextlib.redirect_stderr(stderr):
+        try:
+            handler(list(request.get("argv", [])))
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"An error occurred while using the FERRY CLI: {e}")
+            exit_code = 1
+        finally:
+            stdout.flush()
+            stderr.flush()
+    return exit_code
+
+
+def _peer_uid(sock: "socket.socket") -> Optional[int]:
+    """Return the uid of the process on the other end of sock, where the platform supports it"""
+    # pylint: disable=import-outside-toplevel,redefined-outer-name
+    import socket
+    import struct
+
+    so_peercred = getattr(socket, "SO_PEERCRED", None)
+    if so_peercred is None:
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, so_peercred, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return int(uid)
+
+
+def _handle_connection(
+    conn: "socket.socket", handler: Handler, identity: Dict[str, str]
+) -> bool:
+    """Answer one connection to the daemon, whose configuration is identity (see _identity).
+    Returns whether it asked the daemon to stop"""
+    # The socket lives in a directory only we can read, but check the peer anyway
+    peer_uid = _peer_uid(conn)
+    if peer_uid is not None and peer_uid != os.geteuid():
+        return False
+
+    with conn.makefile("rb") as rfile, conn.makefile("wb") as wfile:
+        lock = threading.Lock()
+
+        def send(message: Dict[str, Any]) -> None:
+            # Workflows may write from several threads at once
+            with lock:
+                wfile.write(json.dumps(message).encode() + b"\n")
+                wfile.flush()
+
+        request = json.loads(rfile.readline() or b"{}")
+        command = request.get("command", "run")
+        if command == "ping":
+            send({"exit_code": 0, "pid": os.getpid()})
+        elif command == "stop":
+            send(
+                {"stdout": "ferry-cli daemon stopping\n", "stderr": "", "exit_code": 0}
+            )
+            return True
+        else:
+            refused = _mismatch(request, identity)
+            if refused:
+                send({"refused": refused})
+                return False
+            exit_code = run_request(
+                handler,
+                request,
+                lambda stream, data: send({"stream": stream, "data": data}),
+            )
+            send({"exit_code": exit_code})
+    return False
+
+
+def serve(
+    handler: Handler,
+    socket_path: Optional[str] = None,
+    idle_timeout: Optional[float] = None,
+) -> None:
+    """Serve forwarded invocations until stopped, or until no request arrives for idle_timeout seconds.
+
+    Requests are handled one at a time, since each one temporarily takes over the process's
+    argv, environment, working directory and standard streams.
+    """
+    import socket  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    if socket_path is None:
+        socket_path = get_socket_path()
+    # Clients with another configuration are refused, so they run in-process
+    identity = _identity(config.get_configfile_path())
+    if os.path.exists(socket_path):
+        if _send(socket_path, {"command": "ping"}) is not None:
+            raise RuntimeError(
+                f"A ferry-cli daemon is already listening on {socket_path}"
+            )
+        # Left behind by a daemon that didn't shut down cleanly
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+        server.settimeout(idle_timeout)
+        print(f"ferry-cli daemon (pid {os.getpid()}) listening on {socket_path}")
+        sys.stdout.flush()
+        stopping = False
+        while not stopping:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                print("ferry-cli daemon idle timeout reached, exiting")
+                break
+            with conn:
+                # Connections may have inherited the idle timeout
+                conn.settimeout(None)
+                try:
+                    stopping = _handle_connection(conn, handler, identity)
+                except (OSError, ValueError):
+                    # The client went away, or didn't send a request we understand
+                    continue
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(socket_path)
+
+
+def get_daemon_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="ferry-cli daemon",
+        description="Run a resident ferry-cli process that other ferry-cli invocations are forwarded to",
+    )
+    parser.add_argument(
+        "command",
+        choices=["start", "stop", "status"],
+        help="start: run the daemon in the foreground; stop: stop a running daemon; status: check whether a daemon is running",
+    )
+    parser.add_argument(
+        "--socket",
+        default=None,
+        help=f"Path to the daemon socket.  Defaults to ${SOCKET_ENV}, or {SOCKET_NAME} in the ferry_cli runtime directory",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="Exit after this many seconds without a request",
+    )
+    return parser
+
+
+def main(args: List[str], handler: Handler) -> None:
+    """Entry point for `ferry-cli daemon ...`"""
+    daemon_args = get_daemon_parser().parse_args(args)
+    socket_path = daemon_args.socket or get_socket_path()
+    if daemon_args.command == "start":
+        serve(handler, socket_path, daemon_args.idle_timeout)
+        sys.exit(0)
+
+    response = _send(
+        socket_path, {"command": "ping" if daemon_args.command == "status" else "stop"}
+    )
+    if response is None:
+        print(f"No ferry-cli daemon is listening on {socket_path}")
+        sys.exit(1)
+    if daemon_args.command == "status":
+        print(
+            f"ferry-cli daemon (pid {response.get('pid')}) is listening on {socket_path}"
+        )
+    else:
+        sys.stdout.write(response.get("stdout", ""))
+    sys.exit(0)
@@ -1,26 +1,69 @@
 import json
 import sys
-from typing import Any, Dict
-
-import requests  # pylint: disable=import-error
+import threading
+import time
+from typing import Any, Dict, Optional, TYPE_CHECKING
 
 try:
+    from ferry_cli.helpers import jsoncodec
     from ferry_cli.helpers.auth import Auth, DebugLevel
+    from ferry_cli.helpers.endpoint_index import EndpointIndex, build_endpoint_index
     from ferry_cli.config import CONFIG_DIR
 except ImportError:
+    from helpers import jsoncodec  # type: ignore
     from helpers.auth import Auth, DebugLevel  # type: ignore
+    from helpers.endpoint_index import EndpointIndex, build_endpoint_index  # type: ignore
     from config import CONFIG_DIR  # type: ignore
 
+if TYPE_CHECKING:
+    import requests
+
+    try:
+        from ferry_cli.helpers.ratelimit import RateLimiter
+        from ferry_cli.helpers.resilience import CircuitBreaker, RetryPolicy
+    except ImportError:
+        from helpers.ratelimit import RateLimiter  # type: ignore
+        from helpers.resilience import CircuitBreaker, RetryPolicy  # type: ignore
+
+    try:
+        from ferry_cli.helpers.cache import ResponseCache
+    except ImportError:
+        from helpers.cache import ResponseCache  # type: ignore
+
+    try:
+        from ferry_cli.helpers.snapshot import Snapshot
+    except ImportError:
+        from helpers.snapshot import Snapshot  # type: ignore
+
+# Defaults for the HTTP connection pool.  These can be overridden in the [api] section of the config file
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_RETRIES = 0
+
+# How much of a streamed response body to read at a time
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Default number of requests that AsyncFerryAPI (and so --batch) makes at once
+DEFAULT_CONCURRENCY = 8
+
 
 # pylint: disable=unused-argument,pointless-statement,too-many-arguments
 class FerryAPI:
-    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
     def __init__(
         self: "FerryAPI",
         base_url: str,
         authorizer: Auth = Auth(),
         debug_level: DebugLevel = DebugLevel.NORMAL,
         dryrun: bool = False,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        keep_alive: bool = True,
+        cache: Optional["ResponseCache"] = None,
+        retry_policy: Optional["RetryPolicy"] = None,
+        circuit_breaker: Optional["CircuitBreaker"] = None,
+        rate_limiter: Optional["RateLimiter"] = None,
     ):
         """
         Parameters:
@@ -28,13 +71,112 @@ class FerryAPI:
             authorizer (Callable[[requests.Session, requests.Session]): A function that prepares the requests session by adding any necessary auth data
             debug_level (DebugLevel): Level of debugging.  Can be DebugLevel.QUIET, DebugLevel.NORMAL, or DebugLevel.DEBUG
             dryrun (bool): Whether or not this is a test run.  If True, the intended URL will be printed, but the HTTP request will not be made
+            pool_connections (int): Number of per-host connection pools to keep
+            pool_maxsize (int): Maximum number of connections kept open per host.  Should be at least the number of concurrent requests.
+            max_retries (int): How many times to retry a request that failed to connect.  Requests that reached the server are never retried here.
+            keep_alive (bool): Whether to keep connections open between requests
+            cache (Optional[ResponseCache]): If given, successful GET responses are cached here, and served from it while they're fresh
+            retry_policy (Optional[RetryPolicy]): Timeouts, and how failed GETs are retried.  Defaults to RetryPolicy()
+            circuit_breaker (Optional[CircuitBreaker]): Stops calling FERRY after repeated server errors.  Defaults to CircuitBreaker()
+            rate_limiter (Optional[RateLimiter]): If given, every request to FERRY (including retries) waits for a token from it
         """
         self.base_url = base_url
         self.authorizer = authorizer
         self.debug_level = debug_level
         self.dryrun = dryrun
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.keep_alive = keep_alive
+        self.cache = cache
+        # Only needed once a FerryAPI is made, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        try:
+            from ferry_cli.helpers.resilience import CircuitBreaker, RetryPolicy
+        except ImportError:
+            from helpers.resilience import CircuitBreaker, RetryPolicy  # type: ignore
+
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = (
+            circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        )
+        self.rate_limiter = rate_limiter
+        # If True, cached responses are not used, but fresh responses are still stored in the cache
+        self.refresh_cache = False
+        # If True, the cache is neither read nor stored to.  Writes still invalidate cached responses.
+        self.bypass_cache = False
+        # Used to find the cached responses each write invalidates.  If None, writes clear the whole cache
+        self.endpoint_index: Optional[EndpointIndex] = None
+        # Local snapshot of FERRY's large collections, which read-only workflows may use instead of
+        # calling FERRY.  Writes mark the collections they may change as stale
+        self.snapshot: Optional["Snapshot"] = None
+        self._session: Optional["requests.Session"] = None
+        # Held while the session is created or closed, so threads calling at once share one session
+        self._session_lock = threading.Lock()
+
+    def get_session(self: "FerryAPI") -> "requests.Session":
+        """Return the session used for all of this FerryAPI's calls, creating and authorizing it on first use.
+
+        Reusing one session means connections (and their TLS handshakes) are kept alive and
+        reused across calls, and the authorizer only runs once.
+        """
+        session = self._session
+        if session is not None:
+            return session
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+            return self._session
 
-    # pylint: disable=dangerous-default-value,too-many-arguments
+    def _create_session(self: "FerryAPI") -> "requests.Session":
+        # requests is slow to import, so we only pay for it on code paths that make HTTP calls
+        # pylint: disable=import-error,import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        adapter_options: Dict[str, Any] = {
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            # Only retry failures to connect, since those requests never reached FERRY
+            "max_retries": Retry(total=self.max_retries, read=False, redirect=False),
+        }
+        # The authorizer may also be a plain function of the session
+        get_ssl_context = getattr(self.authorizer, "ssl_context", None)
+        ssl_context = get_ssl_context() if get_ssl_context is not None else None
+        if ssl_context is None:
+            adapter = HTTPAdapter(**adapter_options)
+        else:
+            # Certificate auth: load the proxy and CAs once, instead of for every connection
+            try:
+                from ferry_cli.helpers.tls import SSLContextAdapter
+            except ImportError:
+                from helpers.tls import SSLContextAdapter  # type: ignore
+
+            adapter = SSLContextAdapter(ssl_context, **adapter_options)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return self.authorizer(session)  # Handles auth for session
+
+    def close(self: "FerryAPI") -> None:
+        """Close the session, and any connections it holds open"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _cache_for(
+        self: "FerryAPI", endpoint: str, method: str
+    ) -> Optional["ResponseCache"]:
+        """Return the cache to use for this call, or None if its response shouldn't be cached"""
+        if self.cache is None or self.bypass_cache or method.lower() != "get":
+            return None
+        return self.cache if self.cache.cacheable(endpoint) else None
+
+    # pylint: disable=dangerous-default-value,too-many-arguments,too-many-branches,too-many-locals
     def call_endpoint(
         self: "FerryAPI",
         endpoint: str,
@@ -43,8 +185,18 @@ class FerryAPI:
         headers: Dict[str, Any] = {},
         params: Dict[Any, Any] = {},
         extra: Dict[Any, Any] = {},
+        use_cache: bool = True,
+        stream: bool = False,
     ) -> Any:
-        # Create a session object to persist certain parameters across requests
+        """Call a FERRY endpoint and return its decoded JSON response.
+
+        GET responses are served from and stored in self.cache (if there is one), unless use_cache is False.
+        PUT and POST calls remove the cached responses they may have changed.
+
+        If stream is True, the response is parsed as it is downloaded (see jsonstream.parse_response):
+        a list ferry_output is returned as an iterator that parses each record as it's needed.
+        Streamed responses are not cached.
+        """
         if self.dryrun:
             print(
                 f"\nWould call endpoint: {self.base_url}{endpoint} with params\n{params}"
@@ -56,45 +208,167 @@ class FerryAPI:
         if debug:
             print(f"\nCalling Endpoint: {self.base_url}{endpoint}")
 
-        _session = requests.Session()
-        session = self.authorizer(_session)  # Handles auth for session
-
         if extra:
             for attribute_name, attribute_value in extra:
                 if attribute_name not in params:
                     params[attribute_name] = attribute_value
+
+        cache = self._cache_for(endpoint, method) if use_cache and not stream else None
+        if cache is not None and not self.refresh_cache:
+            cached = cache.get(self.base_url, endpoint, params)
+            if cached is not None:
+                if debug:
+                    print(f"Using cached response for {endpoint}")
+                return cached
+
         # I believe they are all actually "GET" calls
         try:
-            if method.lower() == "get":
-                response = session.get(
-                    f"{self.base_url}{endpoint}", headers=headers, params=params
-                )
-            elif method.lower() == "post":
-                response = session.post(
-                    f"{self.base_url}{endpoint}", params=params, headers=headers
-                )
-            elif method.lower() == "put":
-                response = session.put(
-                    f"{self.base_url}{endpoint}", params=params, headers=headers
-                )
-            else:
-                raise ValueError("Unsupported HTTP method.")
+            response = self._send(endpoint, method, headers, params, stream)
             if debug:
                 print(f"Called Endpoint: {response.request.url}")
-            output = response.json()
+            if stream:
+                # Only --stream needs this, so keep it off the import path
+                # pylint: disable=import-outside-toplevel
+                try:
+                    from ferry_cli.helpers.jsonstream import parse_response
+                except ImportError:
+                    from helpers.jsonstream import parse_response  # type: ignore
+
+                return parse_response(
+                    response.iter_content(chunk_size=STREAM_CHUNK_SIZE),
+                    on_close=response.close,
+                    extra={"request_url": response.request.url},
+                )
+            output = jsoncodec.loads(response.content)
 
             output["request_url"] = response.request.url
+            # Only cache successful responses, so that errors are retried next time
+            if (
+                cache is not None
+                and response.ok
+                and output.get("ferry_status") != "failure"
+            ):
+                cache.put(self.base_url, endpoint, params, output)
             return output
         except BaseException as e:
             # How do we want to handle errors?
             raise e
+        finally:
+            # Even a failed write may have changed something, so always invalidate
+            if method.lower() in ("post", "put"):
+                self._invalidate_cache(endpoint, params)
+
+    def _send(
+        self: "FerryAPI",
+        endpoint: str,
+        method: str,
+        headers: Dict[str, Any],
+        params: Dict[Any, Any],
+        stream: bool = False,
+    ) -> "requests.Response":
+        """Make the HTTP request for a call, retrying GETs that fail according to self.retry_policy.
+        If stream is True, the body is left to be read from the returned response.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open, so FERRY was not called
+        """
+        # pylint: disable=import-error,import-outside-toplevel
+        import requests
+
+        try:
+            from ferry_cli.helpers.ratelimit import request_class
+            from ferry_cli.helpers.resilience import RETRY_STATUSES
+        except ImportError:
+            from helpers.ratelimit import request_class  # type: ignore
+            from helpers.resilience import RETRY_STATUSES  # type: ignore
+
+        if method.lower() not in ("get", "post", "put"):
+            raise ValueError("Unsupported HTTP method.")
+        debug = self.debug_level == DebugLevel.DEBUG
+        session = self.get_session()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire(request_class(method))
+                if debug and waited > 0:
+                    print(
+                        f"Rate limited: waited {waited:.2f}s before calling {endpoint}"
+                    )
+            # Checked after the rate limiter's wait, which may be long enough for the breaker to change
+            trial = self.circuit_breaker.before_call()
+            try:
+                response = session.request(
+                    method.upper(),
+                    f"{self.base_url}{endpoint}",
+                    headers=headers,
+                    params=params,
+                    timeout=self.retry_policy.timeout,
+                    stream=stream,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.circuit_breaker.record_failure()
+                if not self.retry_policy.retryable(method, attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                reason = type(e).__name__
+            except BaseException:
+                # Any other error (e.g. an invalid URL) says nothing about FERRY, but a trial call
+                # mustn't be left in flight, or the breaker would never let another call through
+                if trial:
+                    self.circuit_breaker.release_trial()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if response.status_code not in RETRY_STATUSES or (
+                    not self.retry_policy.retryable(method, attempt)
+                ):
+                    return response
+                delay = self.retry_policy.delay(
+                    attempt, response.status_code, response.headers.get("Retry-After")
+                )
+                reason = f"HTTP {response.status_code}"
+                response.close()
+
+            if debug:
+                print(
+                    f"{endpoint} failed ({reason}) on attempt {attempt} of {self.retry_policy.retries + 1}; retrying in {delay:.2f}s"
+                )
+            time.sleep(delay)
+
+    def _invalidate_cache(
+        self: "FerryAPI", endpoint: str, params: Dict[Any, Any]
+    ) -> None:
+        """Remove the cached responses (and mark stale the snapshotted collections) that a write to
+        endpoint with params may have changed"""
+        if self.cache is None and self.snapshot is None:
+            return
+        related_reads = None
+        if self.endpoint_index is not None and endpoint in self.endpoint_index:
+            related_reads = self.endpoint_index[endpoint].get("invalidates")
+        if self.debug_level == DebugLevel.DEBUG:
+            affected = (
+                "all endpoints"
+                if related_reads is None
+                else (", ".join(related_reads) or "no endpoints")
+            )
+            print(f"Invalidating cached responses from {affected} after {endpoint}")
+        if self.cache is not None:
+            self.cache.invalidate(params, related_reads)
+        if self.snapshot is not None:
+            self.snapshot.invalidate(related_reads)
 
     def get_latest_swagger_file(self: "FerryAPI") -> None:
 
-        response = self.call_endpoint("docs/swagger.json")
+        response = self.call_endpoint("docs/swagger.json", use_cache=False)
         if response:
             with open(f"{CONFIG_DIR}/swagger.json", "w") as file:
                 file.write(json.dumps(response, indent=4))
+            # Precompile the endpoint index now, so that later invocations don't have to
+            build_endpoint_index()
         else:
             print("Failed to fetch swagger.json file")
             sys.exit(1)
@@ -0,0 +1,203 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+
+try:
+    from ferry_cli.helpers.api import (
+        FerryAPI,
+        DEFAULT_CONCURRENCY,
+        DEFAULT_POOL_MAXSIZE,
+    )
+    from ferry_cli.helpers.auth import Auth, DebugLevel
+except ImportError:
+    from helpers.api import (  # type: ignore
+        FerryAPI,
+        DEFAULT_CONCURRENCY,
+        DEFAULT_POOL_MAXSIZE,
+    )
+    from helpers.auth import Auth, DebugLevel  # type: ignore
+
+__all__ = ["AsyncFerryAPI", "DEFAULT_CONCURRENCY"]
+
+# A single call, as keyword arguments to call_endpoint, e.g. {"endpoint": "getUserInfo", "params": {"username": "x"}}
+EndpointCall = Dict[str, Any]
+
+
+class AsyncFerryAPI:
+    """asyncio interface to FERRY, with the same call_endpoint and get_latest_swagger_file surface as FerryAPI.
+
+    Calls are made through a FerryAPI (so the same Auth classes, pooled session, dryrun and debug
+    handling apply), and run on a thread pool so that many independent FERRY requests can be in
+    flight at once.  At most `concurrency` requests run at the same time.
+
+    Usage:
+        async with AsyncFerryAPI(base_url, authorizer, concurrency=16) as api:
+            results = await api.gather_endpoints(
+                [{"endpoint": "getUserInfo", "params": {"username": u}} for u in users]
+            )
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self: "AsyncFerryAPI",
+        base_url: str,
+        authorizer: Auth = Auth(),
+        debug_level: DebugLevel = DebugLevel.NORMAL,
+        dryrun: bool = False,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        **api_options: Any,
+    ) -> None:
+        """
+        Parameters:
+            base_url, authorizer, debug_level, dryrun: See FerryAPI
+            concurrency (int): Maximum number of requests in flight at once
+            api_options: Any other FerryAPI keyword arguments (e.g. connection pool settings).  The
+                connection pool is grown to at least `concurrency` connections.
+        """
+        api_options["pool_maxsize"] = max(
+            api_options.get("pool_maxsize", DEFAULT_POOL_MAXSIZE), concurrency
+        )
+        api = FerryAPI(base_url, authorizer, debug_level, dryrun, **api_options)
+        self._setup(api, concurrency)
+
+    @classmethod
+    def from_api(
+        cls: Type["AsyncFerryAPI"],
+        api: FerryAPI,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ) -> "AsyncFerryAPI":
+        """Wrap an existing FerryAPI, sharing its session and settings.
+
+        If api's connection pool is smaller than concurrency, it is grown, and api's session is
+        replaced with one using the larger pool.
+        """
+        if api.pool_maxsize < concurrency:
+            api.pool_maxsize = concurrency
+            api.close()
+        async_api = cls.__new__(cls)
+        async_api._setup(api, concurrency)
+        return async_api
+
+    def _setup(self: "AsyncFerryAPI", api: FerryAPI, concurrency: int) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.api = api
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="ferry-api"
+        )
+        # Semaphores belong to an event loop, so we create ours inside the loop that uses it
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def dryrun(self: "AsyncFerryAPI") -> bool:
+        return bool(self.api.dryrun)
+
+    @property
+    def debug_level(self: "AsyncFerryAPI") -> DebugLevel:
+        return self.api.debug_level
+
+    def _get_semaphore(self: "AsyncFerryAPI") -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _run(self: "AsyncFerryAPI", func: Any, *args: Any) -> Any:
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    # pylint: disable=too-many-arguments
+    async def call_endpoint(
+        self: "AsyncFerryAPI",
+        endpoint: str,
+        method: str = "get",
+        data: Optional[Dict[Any, Any]] = None,
+        headers: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[Any, Any]] = None,
+        extra: Optional[Dict[Any, Any]] = None,
+        use_cache: bool = True,
+    ) -> Any:
+        """Asynchronous FerryAPI.call_endpoint"""
+        return await self._run(
+            functools.partial(
+                self.api.call_endpoint,
+                endpoint,
+                method=method,
+                data=data if data is not None else {},
+                headers=headers if headers is not None else {},
+                params=params if params is not None else {},
+                extra=extra if extra is not None else {},
+                use_cache=use_cache,
+            )
+        )
+
+    async def get_latest_swagger_file(self: "AsyncFerryAPI") -> None:
+        """Asynchronous FerryAPI.get_latest_swagger_file"""
+        await self._run(self.api.get_latest_swagger_file)
+
+    async def gather_endpoints(
+        self: "AsyncFerryAPI",
+        calls: Iterable[EndpointCall],
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """Make all of calls concurrently, and return their results in the same order as calls.
+
+        If return_exceptions is True, a failed call's exception is returned in its place instead of
+        being raised.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.call_endpoint(**call) for call in calls),
+                return_exceptions=return_exceptions,
+            )
+        )
+
+    async def iter_completed(
+        self: "AsyncFerryAPI", calls: Iterable[EndpointCall]
+    ) -> AsyncIterator[Tuple[int, Any, Optional[BaseException]]]:
+        """Make all of calls concurrently, yielding (position in calls, result, exception) as each one finishes.
+
+        Exactly one of result and exception is meaningful: exception is None if the call succeeded.
+        """
+
+        async def _tagged(
+            i: int, call: EndpointCall
+        ) -> Tuple[int, Any, Optional[BaseException]]:
+            try:
+                return i, await self.call_endpoint(**call), None
+            except Exception as e:  # pylint: disable=broad-except
+                return i, None, e
+
+        tasks = [
+            asyncio.ensure_future(_tagged(i, call)) for i, call in enumerate(calls)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self: "AsyncFerryAPI") -> None:
+        """Shut down the worker threads.  The underlying FerryAPI (and its session) is left open"""
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self: "AsyncFerryAPI") -> "AsyncFerryAPI":
+        return self
+
+    async def __aexit__(self: "AsyncFerryAPI", *exc_info: Any) -> None:
+        self.close()
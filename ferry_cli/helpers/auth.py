@@ -1,13 +1,20 @@
 from abc import ABC
 from argparse import Namespace
+import base64
 import enum
+import json
 from os import geteuid
 import os.path
-from typing import List, Optional, Tuple
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 # pylint: disable=import-error,no-else-return
-import requests
-import requests.auth
+if TYPE_CHECKING:
+    # requests (and ssl) are only imported when a request is actually made (see helpers.api)
+    import ssl
+
+    import requests
 
 try:
     from ferry_cli.helpers.customs import FerryParser
@@ -22,12 +29,36 @@ __all__ = [
     "DEFAULT_CA_DIR",
     "get_default_token_string",
     "get_default_cert_path",
+    "decode_jwt_claims",
+    "certificate_validity",
+    "pem_certificate_validity",
+    "preflight_check",
     "AuthToken",
     "AuthCert",
+    "CredentialError",
 ]
 
 DEFAULT_CA_DIR = "/etc/grid-security/certificates"
 
+# Defaults for preflight_check.  These can be overridden in the [authorization] section of the config file
+DEFAULT_WARN_MINUTES = 10.0
+DEFAULT_FAIL_MINUTES = 0.0
+
+# Allowance for clocks that are a little behind the token issuer's, when checking a token's nbf claim
+NOT_BEFORE_LEEWAY = 60
+
+# (not before, not after) of each credential we've checked, so that each is only decoded once per
+# process (or daemon).  Keyed by the token, or by the certificate file and its modification time
+_validity_cache: Dict[Tuple[Any, ...], Tuple[Optional[float], Optional[float]]] = {}
+
+# SSL contexts built by AuthCert.ssl_context, keyed by the proxy file (and its modification time) and
+# CA path, so every session in this process (or daemon) shares one while the proxy is unchanged
+_ssl_context_cache: Dict[Tuple[Any, ...], Optional["ssl.SSLContext"]] = {}
+
+
+class CredentialError(Exception):
+    """Credentials that have expired, aren't valid yet, or will expire too soon to use"""
+
 
 def get_default_token_string(debug: bool = False) -> str:
     """Follow the WLCG Bearer Token Discovery standard to get the token string.
@@ -71,6 +102,159 @@ def read_in_token(token_path: str) -> str:
         return _token_string.strip()  # Drop \n at end of token_string
 
 
+def decode_jwt_claims(token_string: str) -> Dict[str, Any]:
+    """Return the claims in a JWT's payload, WITHOUT verifying its signature.  Returns an empty dict
+    if token_string is not a JWT"""
+    try:
+        payload = token_string.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def _claim_time(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def _der_element(der: bytes, pos: int) -> Tuple[int, int, int]:
+    """Read the header of the DER element at pos.  Returns its tag, and where its contents start and end"""
+    tag, length = der[pos], der[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num_bytes = length & 0x7F
+        length = int.from_bytes(der[pos : pos + num_bytes], "big")
+        pos += num_bytes
+    if pos + length > len(der):
+        raise ValueError("Truncated DER element")
+    return tag, pos, pos + length
+
+
+def _der_time(tag: int, value: bytes) -> float:
+    """Convert an ASN.1 UTCTime or GeneralizedTime to a Unix time"""
+    # Only needed for certificates, so keep it off the import path
+    import datetime  # pylint: disable=import-outside-toplevel
+
+    text = value.decode("ascii")
+    if not text.endswith("Z"):
+        raise ValueError(f"Unsupported certificate time {text!r}")
+    if tag == 0x17:  # UTCTime: YYMMDDHHMM[SS]Z, where YY >= 50 means 19YY
+        year = int(text[:2])
+        year += 1900 if year >= 50 else 2000
+        rest = text[2:-1]
+    elif tag == 0x18:  # GeneralizedTime: YYYYMMDDHHMM[SS[.fff]]Z
+        year = int(text[:4])
+        rest = text[4:-1]
+    else:
+        raise ValueError(f"Unexpected certificate time tag {tag:#x}")
+    month, day, hour, minute = (int(rest[i : i + 2]) for i in (0, 2, 4, 6))
+    second = int(rest[8:10]) if len(rest) >= 10 else 0
+    return datetime.datetime(
+        year, month, day, hour, minute, second, tzinfo=datetime.timezone.utc
+    ).timestamp()
+
+
+def certificate_validity(der: bytes) -> Tuple[float, float]:
+    """Return the notBefore and notAfter times of a DER-encoded X.509 certificate, as Unix times.
+
+    Only as much of the certificate is parsed as it takes to find them: Certificate ->
+    tbsCertificate -> [version], serialNumber, signature, issuer, validity.
+
+    Raises:
+        ValueError: If der isn't a certificate (IndexError for one that is cut short)
+    """
+    _, pos, _ = _der_element(der, 0)  # Certificate
+    _, pos, _ = _der_element(der, pos)  # tbsCertificate
+    if der[pos] == 0xA0:  # The optional, explicitly tagged, version
+        _, _, pos = _der_element(der, pos)
+    for _field in ("serialNumber", "signature", "issuer"):
+        _, _, pos = _der_element(der, pos)
+    _, pos, _ = _der_element(der, pos)  # validity
+    tag, start, end = _der_element(der, pos)
+    not_before = _der_time(tag, der[start:end])
+    tag, start, end = _der_element(der, end)
+    return not_before, _der_time(tag, der[start:end])
+
+
+def pem_certificate_validity(pem: str) -> Tuple[Optional[float], Optional[float]]:
+    """Return when every certificate in pem (e.g. a proxy and the certificates that signed it) is
+    valid: the latest notBefore and the earliest notAfter.  (None, None) if pem has no certificates.
+
+    Raises:
+        ValueError: If a certificate can't be decoded
+    """
+    not_before: Optional[float] = None
+    not_after: Optional[float] = None
+    for block in pem.split("-----BEGIN CERTIFICATE-----")[1:]:
+        body = block.split("-----END CERTIFICATE-----")[0]
+        try:
+            before, after = certificate_validity(
+                base64.b64decode("".join(body.split()))
+            )
+        except IndexError:
+            raise ValueError(  # pylint: disable=raise-missing-from
+                "Truncated certificate"
+            )
+        not_before = before if not_before is None else max(not_before, before)
+        not_after = after if not_after is None else min(not_after, after)
+    return not_before, not_after
+
+
+def _format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S %Z", time.localtime(timestamp))
+
+
+def preflight_check(
+    authorizer: "Auth",
+    warn_minutes: float = DEFAULT_WARN_MINUTES,
+    fail_minutes: float = DEFAULT_FAIL_MINUTES,
+    quiet: bool = False,
+    now: Optional[float] = None,
+) -> Optional[float]:
+    """Check authorizer's credentials locally before using them, so that a run fails before its first
+    call to FERRY rather than partway through.
+
+    Parameters:
+        warn_minutes (float): Print a warning (unless quiet) if the credentials expire sooner than this
+        fail_minutes (float): Fail if the credentials expire sooner than this, e.g. the length of a long batch
+        now (Optional[float]): The time to check at.  Defaults to the current time
+
+    Returns:
+        The number of seconds until the credentials expire, or None if that isn't known (e.g. for a
+        token that isn't a JWT)
+
+    Raises:
+        CredentialError: If the credentials have expired, aren't valid yet, or expire within fail_minutes
+    """
+    now = time.time() if now is None else now
+    not_before, not_after = authorizer.validity()
+    name = authorizer.credential_name
+    hint = f"  {authorizer.renew_hint}" if authorizer.renew_hint else ""
+    if not_before is not None and now < not_before - NOT_BEFORE_LEEWAY:
+        raise CredentialError(
+            f"{name} is not valid until {_format_time(not_before)}.  Please check this computer's clock."
+        )
+    if not_after is None:
+        return None
+    remaining = not_after - now
+    if remaining <= 0:
+        raise CredentialError(f"{name} expired at {_format_time(not_after)}.{hint}")
+    if remaining < fail_minutes * 60:
+        raise CredentialError(
+            f"{name} expires in {remaining / 60:.0f} minutes, at {_format_time(not_after)}, "
+            f"but at least {fail_minutes:g} minutes are required.{hint}"
+        )
+    if remaining < warn_minutes * 60 and not quiet:
+        print(
+            f"Warning: {name} expires in {remaining / 60:.0f} minutes, at {_format_time(not_after)}.{hint}",
+            file=sys.stderr,
+        )
+    return remaining
+
+
 def get_default_cert_path(debug: bool = False) -> str:
     """Get the default path where cigetcert stores x509 certificates.  If $X509_USER_PROXY is set, use that first"""
     env_location = os.environ.get("X509_USER_PROXY")
@@ -90,16 +274,40 @@ def get_default_cert_path(debug: bool = False) -> str:
 class Auth(ABC):
     """This is the base class on which all Auth classes should build"""
 
-    def __call__(self: "Auth", s: requests.Session) -> requests.Session:
+    # Describe the credentials and how to renew them, for preflight_check's messages
+    credential_name = "Credentials"
+    renew_hint = ""
+
+    def __call__(self: "Auth", s: "requests.Session") -> "requests.Session":
         raise NotImplementedError(
             "Must use a subclass of Auth with __call__ method defined"
         )
 
+    def identity(self: "Auth") -> str:
+        """Identifies whose credentials these are, without including any secrets.  Used to keep
+        cached responses for different identities apart"""
+        return type(self).__name__
+
+    def validity(self: "Auth") -> Tuple[Optional[float], Optional[float]]:
+        """When the credentials become valid and when they expire, as Unix times, or None where
+        that isn't known"""
+        return None, None
+
+    def ssl_context(self: "Auth") -> Optional["ssl.SSLContext"]:
+        """An SSL context for every HTTPS connection to use (see helpers.tls), or None to let
+        requests set up TLS with the session's settings"""
+        return None
+
 
 class AuthToken(Auth):
     """This is a callable class that modifies a requests.Session object to add token
     auth"""
 
+    credential_name = "Bearer token"
+    renew_hint = (
+        "Run 'htgettoken -a htvaultprod.fnal.gov -i fermilab' to get a new one."
+    )
+
     def __init__(
         self: "AuthToken", token_path: Optional[str] = None, debug: bool = False
     ) -> None:
@@ -115,7 +323,7 @@ class AuthToken(Auth):
                 f"Bearer token file not found. Please verify that you have a valid token in the specified, or default path: /tmp/{default_token_file_name()}, or run 'htgettoken -a htvaultprod.fnal.gov -i fermilab'"
             )
 
-    def __call__(self: "AuthToken", s: requests.Session) -> requests.Session:
+    def __call__(self: "AuthToken", s: "requests.Session") -> "requests.Session":
         """Modify the passed in session to add token auth"""
         s.headers["Authorization"] = f"Bearer {self.token_string}"
         if self.debug:
@@ -123,11 +331,37 @@ class AuthToken(Auth):
             print("Actual Token string redacted\n")
         return s
 
+    def identity(self: "AuthToken") -> str:
+        """The token's issuer, subject and scopes, which stay the same when the token is renewed"""
+        claims = decode_jwt_claims(self.token_string)
+        if claims.get("sub"):
+            return f"token:{claims.get('iss', '')}:{claims['sub']}:{claims.get('scope', '')}"
+        # Not a JWT we can read, so fall back to a digest of the token itself
+        import hashlib  # pylint: disable=import-outside-toplevel
+
+        return f"token:{hashlib.sha256(self.token_string.encode()).hexdigest()}"
+
+    def validity(self: "AuthToken") -> Tuple[Optional[float], Optional[float]]:
+        """The token's nbf and exp claims"""
+        key = ("token", self.token_string)
+        if key not in _validity_cache:
+            claims = decode_jwt_claims(self.token_string)
+            _validity_cache[key] = (
+                _claim_time(claims.get("nbf")),
+                _claim_time(claims.get("exp")),
+            )
+        return _validity_cache[key]
+
 
 class AuthCert(Auth):
     """This is a callable class that modifies a requests.Session object to add X509 Certificate
     auth"""
 
+    credential_name = "X.509 proxy"
+    renew_hint = (
+        "Make sure you have a Kerberos ticket, then run kx509 to get a new one."
+    )
+
     def __init__(
         self: "AuthCert",
         cert_path: Optional[str] = None,
@@ -148,7 +382,7 @@ class AuthCert(Auth):
             )
         self.ca_path = ca_path
 
-    def __call__(self: "AuthCert", s: requests.Session) -> requests.Session:
+    def __call__(self: "AuthCert", s: "requests.Session") -> "requests.Session":
         """Modify the passed in session to use certificate auth"""
         s.cert = self.cert_path
         s.verify = self.ca_path
@@ -158,6 +392,66 @@ class AuthCert(Auth):
             )
         return s
 
+    def identity(self: "AuthCert") -> str:
+        return f"cert:{os.path.realpath(self.cert_path)}"
+
+    def ssl_context(self: "AuthCert") -> Optional["ssl.SSLContext"]:
+        """An SSL context holding the proxy's certificate chain and key, that verifies servers
+        against ca_path.  It is built once per proxy file, rather than for each new connection.
+
+        Returns None, so that requests uses the session's cert and verify settings (set by
+        __call__) as before, if the context can't be built, e.g. because the proxy is invalid.
+        """
+        # pylint: disable=import-outside-toplevel
+        from urllib3.util.ssl_ import create_urllib3_context
+
+        try:
+            stat = os.stat(self.cert_path)
+        except OSError:
+            return None
+        key = (
+            os.path.realpath(self.cert_path),
+            stat.st_mtime_ns,
+            stat.st_size,
+            os.path.realpath(self.ca_path),
+        )
+        if key not in _ssl_context_cache:
+            try:
+                # Verify servers with the settings requests would use for the same cert and verify
+                # paths.  ssl.create_default_context's can differ, e.g. it turns on
+                # VERIFY_X509_STRICT on Python 3.13+
+                context = create_urllib3_context()
+                if os.path.isdir(self.ca_path):
+                    context.load_verify_locations(capath=self.ca_path)
+                else:
+                    context.load_verify_locations(cafile=self.ca_path)
+                context.load_cert_chain(self.cert_path)
+                _ssl_context_cache[key] = context
+            except OSError as e:  # Including ssl.SSLError
+                if self.debug:
+                    print(
+                        f"Could not build an SSL context from {self.cert_path} and {self.ca_path} ({e}); "
+                        "falling back to the session's cert and verify settings"
+                    )
+                _ssl_context_cache[key] = None
+        return _ssl_context_cache[key]
+
+    def validity(self: "AuthCert") -> Tuple[Optional[float], Optional[float]]:
+        """When every certificate in the proxy file is valid (see pem_certificate_validity).
+        (None, None) if the file can't be read or decoded, since FERRY will then say what's wrong"""
+        try:
+            stat = os.stat(self.cert_path)
+        except OSError:
+            return None, None
+        key = ("cert", os.path.realpath(self.cert_path), stat.st_mtime_ns, stat.st_size)
+        if key not in _validity_cache:
+            try:
+                with open(self.cert_path, "r", encoding="ascii", errors="replace") as f:
+                    _validity_cache[key] = pem_certificate_validity(f.read())
+            except (OSError, ValueError):
+                _validity_cache[key] = (None, None)
+        return _validity_cache[key]
+
 
 def get_auth_parser() -> "FerryParser":
     auth_parser = FerryParser.create(
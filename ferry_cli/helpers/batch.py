@@ -0,0 +1,173 @@
+"""Batch mode: run many endpoint calls from a JSONL file, concurrently, over one session.
+
+Each input line is a JSON object such as {"endpoint": "getUserInfo", "params": {"username": "johndoe"}}.
+A line may also give the endpoint's HTTP "method", as workflow --plan output does.  Each call is made
+with the method its endpoint is documented with, and a line whose method doesn't match is rejected.
+Each result is written as a JSON line as soon as its call completes, tagged with the input line it
+came from:
+    {"line": 1, "endpoint": "getUserInfo", "result": {...}}
+    {"line": 2, "endpoint": "getUserInfo", "error": "..."}
+"""
+import asyncio
+import contextlib
+import io
+import json
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, TextIO
+
+try:
+    from ferry_cli.helpers.async_api import AsyncFerryAPI
+except ImportError:
+    from helpers.async_api import AsyncFerryAPI  # type: ignore
+
+__all__ = ["BatchCall", "read_batch", "params_to_args", "prepare_batch", "run_batch"]
+
+
+class BatchCall(NamedTuple):
+    line: int
+    endpoint: str
+    params: Dict[str, Any]
+    method: Optional[str] = None
+
+
+def read_batch(source: TextIO) -> List[BatchCall]:
+    """Read the calls in a batch file.  Blank lines are skipped.
+
+    Raises:
+        ValueError: If any line is not a valid call.  All invalid lines are reported at once.
+    """
+    calls: List[BatchCall] = []
+    errors: List[str] = []
+    for line_number, line in enumerate(source, start=1):
+        if not line.strip():
+            continue
+        try:
+            call = json.loads(line)
+        except ValueError as e:
+            errors.append(f"line {line_number}: Invalid JSON: {e}")
+            continue
+        if not isinstance(call, dict) or not isinstance(call.get("endpoint"), str):
+            errors.append(f'line {line_number}: Missing "endpoint"')
+            continue
+        params = call.get("params", {})
+        if not isinstance(params, dict):
+            errors.append(f'line {line_number}: "params" must be a JSON object')
+            continue
+        method = call.get("method")
+        if method is not None and not isinstance(method, str):
+            errors.append(f'line {line_number}: "method" must be a string')
+            continue
+        calls.append(BatchCall(line_number, call["endpoint"], params, method))
+    if errors:
+        raise ValueError("Invalid batch input:\n" + "\n".join(errors))
+    return calls
+
+
+def params_to_args(params: Dict[str, Any]) -> List[str]:
+    """Convert a batch line's params to command-line arguments, e.g. {"username": "johndoe"} -> ["--username", "johndoe"]"""
+    args: List[str] = []
+    for name, value in params.items():
+        if value is None:
+            continue
+        args.append(f"--{name}")
+        args.append(value if isinstance(value, str) else json.dumps(value))
+    return args
+
+
+def _parse_quietly(
+    parse_params: Callable[[str, List[str]], Dict[str, Any]],
+    endpoint: str,
+    args: List[str],
+) -> Dict[str, Any]:
+    """Run parse_params, turning argparse's usage message and exit into a ValueError"""
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            return parse_params(endpoint, args)
+    except SystemExit:
+        messages = [line for line in stderr.getvalue().splitlines() if line.strip()]
+        # pylint: disable=raise-missing-from
+        raise ValueError(messages[-1] if messages else "Invalid parameters")
+
+
+def prepare_batch(
+    calls: List[BatchCall],
+    parse_params: Callable[[str, List[str]], Dict[str, Any]],
+    verify: Callable[[str], None],
+    endpoint_method: Callable[[str], str],
+) -> List[BatchCall]:
+    """Check every call before any of them are made.
+
+    Args:
+        calls (List[BatchCall]): The calls from read_batch
+        parse_params (Callable): Parses command-line arguments for an endpoint into its parameters (FerryCLI.parse_endpoint_params)
+        verify (Callable): Safeguard check for an endpoint (SafeguardsDCS.verify)
+        endpoint_method (Callable): The HTTP method of an endpoint (EndpointParsers.method)
+
+    Returns:
+        List[BatchCall]: The calls, with their params parsed and filled in the same way as for a single -e call,
+            and their endpoint's method
+
+    Raises:
+        ValueError: If any call has an unknown endpoint, invalid parameters, or a method its endpoint
+            doesn't take.  All of them are reported at once.
+    """
+    prepared: List[BatchCall] = []
+    errors: List[str] = []
+    for call in calls:
+        verify(call.endpoint)
+        try:
+            params = _parse_quietly(
+                parse_params, call.endpoint, params_to_args(call.params)
+            )
+        except ValueError as e:
+            errors.append(f"line {call.line}: {e}")
+            continue
+        method = endpoint_method(call.endpoint)
+        if call.method is not None and call.method.upper() != method:
+            errors.append(
+                f"line {call.line}: {call.endpoint} is called with {method}, not {call.method}"
+            )
+            continue
+        prepared.append(call._replace(params=params, method=method))
+    if errors:
+        raise ValueError("Invalid batch input:\n" + "\n".join(errors))
+    return prepared
+
+
+async def _run_batch(
+    api: AsyncFerryAPI, calls: List[BatchCall], out: TextIO, write_results: bool
+) -> int:
+    failures = 0
+    endpoint_calls = [
+        {
+            "endpoint": call.endpoint,
+            "method": call.method or "GET",
+            "params": call.params,
+        }
+        for call in calls
+    ]
+    async for i, result, error in api.iter_completed(endpoint_calls):
+        record: Dict[str, Any] = {"line": calls[i].line, "endpoint": calls[i].endpoint}
+        if error is None:
+            record["result"] = result
+        else:
+            record["error"] = str(error)
+            failures += 1
+        if write_results:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    return failures
+
+
+def run_batch(
+    api: AsyncFerryAPI,
+    calls: List[BatchCall],
+    out: TextIO,
+    write_results: bool = True,
+) -> int:
+    """Make all of calls, writing each result to out as a JSON line in the order they complete.
+
+    Returns:
+        int: The number of calls that failed
+    """
+    return asyncio.run(_run_batch(api, calls, out, write_results))
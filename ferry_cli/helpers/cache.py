@@ -0,0 +1,301 @@
+"""On-disk cache of FERRY GET responses.
+
+Each response is stored as its own file, <cache_dir>/<endpoint>/<key>.json, where the key is a hash
+of the FERRY base URL, the endpoint, its (sorted) parameters and the identity of the credentials
+used.  The file's first line is a small JSON header (when it was stored, and the call's parameters),
+and the second is the response itself, so that entries can be checked without reading whole responses.
+
+Entries expire after a per-endpoint TTL.  When the cache grows past its size limit, the least
+recently used entries are removed.  Writes to FERRY remove the entries they may have changed (see
+invalidate).
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    from ferry_cli.helpers import jsoncodec
+except ImportError:
+    from helpers import jsoncodec  # type: ignore
+
+__all__ = [
+    "CacheStats",
+    "DEFAULT_CACHE_TTLS",
+    "DEFAULT_MAX_SIZE_MB",
+    "ResponseCache",
+]
+
+# Endpoints whose responses change slowly enough to cache by default, and their TTLs in seconds.
+# These can be overridden (or set to 0 to disable caching) in the [cache-ttl] section of the config file.
+DEFAULT_CACHE_TTLS: Dict[str, float] = {
+    "getAllGroups": 600,
+    "getAllComputeResources": 600,
+    "getUserGroupsForComputeResource": 600,
+}
+
+# Endpoints not listed in the TTLs are not cached, unless [cache] default_ttl is set
+DEFAULT_TTL = 0.0
+
+DEFAULT_MAX_SIZE_MB = 100
+
+
+class CacheStats:
+    """Counters for one ferry-cli invocation's use of the cache"""
+
+    def __init__(self: "CacheStats") -> None:
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __str__(self: "CacheStats") -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses, {self.stores} stored, "
+            f"{self.evictions} evicted, {self.invalidations} invalidated"
+        )
+
+
+class ResponseCache:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self: "ResponseCache",
+        cache_dir: pathlib.Path,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = DEFAULT_TTL,
+        max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+        identity: str = "",
+    ) -> None:
+        """
+        Parameters:
+            cache_dir (pathlib.Path): Directory to keep cached responses in
+            ttls (Dict[str, float]): Time to live, in seconds, for each endpoint's responses.  These override DEFAULT_CACHE_TTLS.
+                Endpoint names are matched case-insensitively, since configparser lowercases option names
+            default_ttl (float): Time to live for endpoints not in ttls.  0 means they are not cached
+            max_size_mb (float): Size limit for the whole cache, in megabytes
+            identity (str): Identifies the credentials in use (see Auth.identity), since FERRY's responses can depend on who is asking
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.ttls = {
+            endpoint.lower(): float(ttl)
+            for endpoint, ttl in list(DEFAULT_CACHE_TTLS.items())
+            + list((ttls or {}).items())
+        }
+        self.default_ttl = default_ttl
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.identity = identity
+        self.stats = CacheStats()
+        # Total size of the cache on disk, counted on first store and then kept up to date
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def ttl(self: "ResponseCache", endpoint: str) -> float:
+        return self.ttls.get(endpoint.lower(), self.default_ttl)
+
+    def cacheable(self: "ResponseCache", endpoint: str) -> bool:
+        return self.ttl(endpoint) > 0
+
+    def reset_stats(self: "ResponseCache") -> None:
+        with self._lock:
+            self.stats = CacheStats()
+
+    def _entry_path(
+        self: "ResponseCache", base_url: str, endpoint: str, params: Dict[Any, Any]
+    ) -> pathlib.Path:
+        # Only needed once we actually look something up, so keep it off the import path
+        import hashlib  # pylint: disable=import-outside-toplevel
+
+        key_material = json.dumps(
+            [base_url, endpoint, sorted(params.items()), self.identity], default=str
+        )
+        key = hashlib.sha256(key_material.encode()).hexdigest()
+        return self.cache_dir / endpoint.replace("/", "_") / f"{key}.json"
+
+    def get(
+        self: "ResponseCache", base_url: str, endpoint: str, params: Dict[Any, Any]
+    ) -> Optional[Any]:
+        """Return the cached response for this call, or None if there isn't a fresh one"""
+        path = self._entry_path(base_url, endpoint, params)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                if time.time() - header.get("stored", 0) > self.ttl(endpoint):
+                    response = None
+                    expired = True
+                else:
+                    response = jsoncodec.loads(f.readline())
+                    expired = False
+        except (OSError, ValueError, AttributeError):
+            self._count("misses")
+            return None
+
+        if expired:
+            self._remove(path)
+            self._count("misses")
+            return None
+
+        # Mark the entry as recently used, for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return response
+
+    def put(
+        self: "ResponseCache",
+        base_url: str,
+        endpoint: str,
+        params: Dict[Any, Any],
+        response: Any,
+    ) -> None:
+        """Store a response.  Failures to write are ignored, since the cache is only an optimization"""
+        path = self._entry_path(base_url, endpoint, params)
+        header = {"stored": time.time(), "endpoint": endpoint, "params": params}
+        content = (
+            json.dumps(header, default=str).encode()
+            + b"\n"
+            + jsoncodec.dumps_compact(response)
+            + b"\n"
+        )
+        tmp_file = path.with_name(
+            f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            try:
+                old_size = path.stat().st_size
+            except OSError:
+                old_size = 0
+            with open(tmp_file, "wb") as f:
+                f.write(content)
+            os.replace(tmp_file, path)
+        except OSError:
+            self._remove(tmp_file)
+            return
+
+        with self._lock:
+            self.stats.stores += 1
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._scan())
+            else:
+                self._size += len(content) - old_size
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self: "ResponseCache") -> None:
+        """Remove least recently used entries until the cache is within its size limit"""
+        with self._lock:
+            entries = sorted(self._scan(), key=lambda entry: entry[1])
+            size = sum(size for _, _, size in entries)
+            for path, _, entry_size in entries:
+                if size <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    size -= entry_size
+                    self.stats.evictions += 1
+            self._size = size
+
+    def invalidate(
+        self: "ResponseCache",
+        params: Dict[Any, Any],
+        related_reads: Optional[Iterable[str]] = None,
+    ) -> None:
+        """Remove the cached responses that a write to FERRY may have changed.
+
+        Only responses from related_reads are removed, and of those, responses for calls that
+        clearly concern something else are kept.  For example, after addUserToGroup with
+        groupname=g1, a cached getGroupMembers response for groupname=g2 is kept.
+
+        Args:
+            params (dict): The write's parameters
+            related_reads (Optional[Iterable[str]]): GET endpoints that the write may affect (see
+                endpoint_index.related_reads).  If None, the write is unknown, and every entry is removed.
+        """
+        if related_reads is None:
+            self.clear()
+            return
+
+        with self._lock:
+            for endpoint in related_reads:
+                endpoint_dir = self.cache_dir / endpoint.replace("/", "_")
+                try:
+                    entry_files = list(os.scandir(endpoint_dir))
+                except OSError:
+                    continue
+                for entry_file in entry_files:
+                    if not entry_file.name.endswith(".json"):
+                        continue
+                    path = pathlib.Path(entry_file.path)
+                    if self._unrelated(path, params):
+                        continue
+                    try:
+                        size = entry_file.stat().st_size
+                    except OSError:
+                        size = 0
+                    if self._remove(path):
+                        self.stats.invalidations += 1
+                        if self._size is not None:
+                            self._size -= size
+
+    @staticmethod
+    def _unrelated(path: pathlib.Path, write_params: Dict[Any, Any]) -> bool:
+        """Whether the cached call in path is clearly about something other than a write with
+        write_params, i.e. they share a parameter but with different values"""
+        try:
+            with open(path, "rb") as f:
+                entry_params = json.loads(f.readline()).get("params", {})
+        except (OSError, ValueError, AttributeError):
+            return False
+        for name, value in write_params.items():
+            cached_value = entry_params.get(name)
+            if value is None or cached_value is None:
+                continue
+            if str(cached_value) != str(value):
+                return True
+        return False
+
+    def clear(self: "ResponseCache") -> None:
+        """Remove every entry"""
+        with self._lock:
+            for path, _, _ in self._scan():
+                if self._remove(path):
+                    self.stats.invalidations += 1
+            self._size = 0
+
+    def _scan(self: "ResponseCache") -> Iterator[Tuple[pathlib.Path, float, int]]:
+        """Yield (path, last used time, size) for every entry"""
+        try:
+            endpoint_dirs = list(os.scandir(self.cache_dir))
+        except OSError:
+            return
+        for endpoint_dir in endpoint_dirs:
+            if not endpoint_dir.is_dir():
+                continue
+            try:
+                files = list(os.scandir(endpoint_dir.path))
+            except OSError:
+                continue
+            for entry_file in files:
+                if not entry_file.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry_file.stat()
+                except OSError:
+                    continue
+                yield pathlib.Path(entry_file.path), stat.st_mtime, stat.st_size
+
+    def _remove(self: "ResponseCache", path: pathlib.Path) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _count(self: "ResponseCache", counter: str) -> None:
+        with self._lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
@@ -13,18 +13,22 @@ class FerryParser(argparse.ArgumentParser):
         """Initializes arguments for the parser from the
 
         Args:
-            params (list): An array of Dictionary objects representing a parameter option
+            params (list): An array of Dictionary objects representing a parameter option.
+                If a parameter has a pre-rendered "help" entry (see helpers.endpoint_index), it is used as-is.
         """
         for param in params:
             req = "required" if param.get("required", False) else "optional"
-            self.add_argument(
-                f"--{param['name']}",
-                type=str,
-                help=FerryParser.parse_description(
+            help_text = param.get("help", None)
+            if help_text is None:
+                help_text = FerryParser.parse_description(
                     name="",
                     description=param["description"],
                     method=f"{param['type']}: {req}",
-                ),
+                )
+            self.add_argument(
+                f"--{param['name']}",
+                type=str,
+                help=help_text,
                 required=param.get("required", False),
             )
 
@@ -0,0 +1,361 @@
+import json
+import os
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set, Tuple, Type
+
+try:
+    from ferry_cli.config import CONFIG_DIR
+    from ferry_cli.helpers import jsoncodec
+    from ferry_cli.helpers.customs import FerryParser
+except ImportError:
+    from config import CONFIG_DIR  # type: ignore
+    from helpers import jsoncodec  # type: ignore
+    from helpers.customs import FerryParser  # type: ignore
+
+__all__ = [
+    "EndpointIndex",
+    "EndpointParsers",
+    "INDEX_FILENAME",
+    "SWAGGER_FILENAME",
+    "build_endpoint_index",
+    "compile_endpoint_index",
+    "load_endpoint_index",
+    "related_reads",
+]
+
+SWAGGER_FILENAME = "swagger.json"
+INDEX_FILENAME = "swagger_index.json"
+
+# Bump this whenever the layout of the compiled index changes, so that indexes
+# written by older versions are rebuilt instead of misread
+INDEX_FORMAT_VERSION = 2
+
+# Methods are checked in this order when a path supports more than one
+SUPPORTED_METHODS = ("get", "post", "put")
+
+
+def hash_swagger(content: bytes) -> str:
+    """Return the content hash that keys a compiled index to its swagger.json"""
+    # Only needed when swagger.json changed, so keep it off the import path
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def compile_endpoint_index(
+    swagger: Dict[str, Any], swagger_hash: str
+) -> Dict[str, Any]:
+    """Compile the parsed swagger.json data into an endpoint index.
+
+    The index holds everything FerryCLI needs to build an endpoint parser (method,
+    parameter specs, and the help text already rendered by FerryParser.parse_description),
+    so that the swagger file does not need to be parsed and formatted on every invocation.
+    Each write (PUT/POST) endpoint also lists the GET endpoints whose cached responses it
+    invalidates (see related_reads).
+
+    Args:
+        swagger (dict): Parsed contents of swagger.json
+        swagger_hash (str): Content hash of swagger.json (see hash_swagger)
+
+    Returns:
+        dict: The compiled endpoint index
+    """
+    endpoints: Dict[str, Dict[str, Any]] = {}
+    for path, data in swagger.get("paths", {}).items():
+        endpoint = path.replace("/", "")
+        method = next((m for m in SUPPORTED_METHODS if m in data), None)
+        if method is None:
+            continue
+
+        operation = data[method]
+        parameters: List[Dict[str, Any]] = []
+        for param in operation.get("parameters", []):
+            required = param.get("required", False)
+            req = "required" if required else "optional"
+            parameters.append(
+                {
+                    "name": param["name"],
+                    "type": param.get("type", "string"),
+                    "required": required,
+                    "description": param["description"],
+                    "help": FerryParser.parse_description(
+                        name="",
+                        description=param["description"],
+                        method=f"{param.get('type', 'string')}: {req}",
+                    ),
+                }
+            )
+
+        endpoints[endpoint] = {
+            "method": method.upper(),
+            "description": FerryParser.parse_description(
+                endpoint, method.upper(), operation["description"]
+            ),
+            "tags": operation.get("tags", []),
+            "parameters": parameters,
+        }
+
+    for endpoint, reads in related_reads(endpoints).items():
+        endpoints[endpoint]["invalidates"] = reads
+
+    return {
+        "format": INDEX_FORMAT_VERSION,
+        "swagger_hash": swagger_hash,
+        "swagger_version": swagger.get("info", {}).get("version", None),
+        "endpoints": endpoints,
+    }
+
+
+def related_reads(endpoints: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """For each write (non-GET) endpoint, find the GET endpoints whose responses it may change.
+
+    A GET endpoint is related to a write endpoint if they share a swagger tag (e.g. both are
+    "Groups" endpoints), or a parameter name (e.g. both take a groupname).
+
+    Args:
+        endpoints (dict): The "endpoints" of a compiled index
+
+    Returns:
+        dict: {write endpoint: sorted list of related GET endpoints}
+    """
+    reads_by_tag: Dict[str, Set[str]] = {}
+    reads_by_param: Dict[str, Set[str]] = {}
+    for endpoint, entry in endpoints.items():
+        if entry["method"] != "GET":
+            continue
+        for tag in entry.get("tags", []):
+            reads_by_tag.setdefault(tag, set()).add(endpoint)
+        for param in entry.get("parameters", []):
+            reads_by_param.setdefault(param["name"], set()).add(endpoint)
+
+    related: Dict[str, List[str]] = {}
+    for endpoint, entry in endpoints.items():
+        if entry["method"] == "GET":
+            continue
+        reads: Set[str] = set()
+        for tag in entry.get("tags", []):
+            reads.update(reads_by_tag.get(tag, ()))
+        for param in entry.get("parameters", []):
+            reads.update(reads_by_param.get(param["name"], ()))
+        related[endpoint] = sorted(reads)
+    return related
+
+
+class EndpointIndex(Mapping[str, Dict[str, Any]]):
+    """Read-only mapping of endpoint name to its compiled index entry.
+
+    On disk, the index is a single JSON header line (swagger hash, version, and the byte offset of
+    each endpoint's entry), followed by one JSON entry per line.  Loading the index only decodes
+    the header, and an entry is read from disk and decoded the first time it is looked up, so the
+    cost of calling one endpoint does not grow with the number of paths in swagger.json.
+    """
+
+    def __init__(
+        self: "EndpointIndex",
+        header: Dict[str, Any],
+        entries: Optional[Dict[str, Dict[str, Any]]] = None,
+        index_file: Optional[str] = None,
+        body_offset: int = 0,
+    ) -> None:
+        self.header = header
+        self._offsets: Dict[str, List[int]] = header.get("endpoints", {})
+        self._entries: Dict[str, Dict[str, Any]] = entries if entries else {}
+        self._index_file = index_file
+        self._body_offset = body_offset
+
+    @classmethod
+    def from_compiled(
+        cls: Type["EndpointIndex"], compiled: Dict[str, Any]
+    ) -> "EndpointIndex":
+        """Wrap the output of compile_endpoint_index"""
+        header = {key: value for key, value in compiled.items() if key != "endpoints"}
+        header["endpoints"] = {name: [] for name in compiled.get("endpoints", {})}
+        return cls(header, entries=dict(compiled.get("endpoints", {})))
+
+    @property
+    def swagger_hash(self: "EndpointIndex") -> Optional[str]:
+        return self.header.get("swagger_hash", None)
+
+    @property
+    def swagger_version(self: "EndpointIndex") -> Optional[str]:
+        return self.header.get("swagger_version", None)
+
+    def __getitem__(self: "EndpointIndex", endpoint: str) -> Dict[str, Any]:
+        entry = self._entries.get(endpoint, None)
+        if entry is None:
+            offset, length = self._offsets[endpoint]
+            with open(self._index_file, "rb") as f:  # type: ignore
+                f.seek(self._body_offset + offset)
+                entry = json.loads(f.read(length))
+            self._entries[endpoint] = entry
+        return entry
+
+    def __contains__(self: "EndpointIndex", endpoint: object) -> bool:
+        return endpoint in self._offsets
+
+    def __iter__(self: "EndpointIndex") -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self: "EndpointIndex") -> int:
+        return len(self._offsets)
+
+    def iter_entries(self: "EndpointIndex") -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield every (endpoint, entry) pair, reading the index body in a single pass"""
+        if self._index_file is None or len(self._entries) == len(self._offsets):
+            for endpoint in self._offsets:
+                yield endpoint, self[endpoint]
+            return
+        with open(self._index_file, "rb") as f:
+            f.seek(self._body_offset)
+            for endpoint, line in zip(self._offsets, f):
+                entry = self._entries.get(endpoint, None)
+                if entry is None:
+                    entry = json.loads(line)
+                    self._entries[endpoint] = entry
+                yield endpoint, entry
+
+    def to_compiled(self: "EndpointIndex") -> Dict[str, Any]:
+        """Inverse of from_compiled"""
+        compiled = {
+            key: value for key, value in self.header.items() if key != "endpoints"
+        }
+        compiled["endpoints"] = dict(self.iter_entries())
+        return compiled
+
+
+def build_endpoint_index(config_dir: str = CONFIG_DIR) -> EndpointIndex:
+    """Compile the index for the swagger.json in config_dir and store it alongside it"""
+    swagger_file = os.path.join(config_dir, SWAGGER_FILENAME)
+    with open(swagger_file, "rb") as f:
+        content = f.read()
+    compiled = compile_endpoint_index(jsoncodec.loads(content), hash_swagger(content))
+    compiled["swagger_stat"] = _stat_stamp(swagger_file)
+    _write_index(os.path.join(config_dir, INDEX_FILENAME), compiled)
+    return EndpointIndex.from_compiled(compiled)
+
+
+def load_endpoint_index(config_dir: str = CONFIG_DIR) -> EndpointIndex:
+    """Load the compiled endpoint index for the swagger.json in config_dir.
+
+    The stored index is used as-is when swagger.json is unchanged since the index was written.
+    If swagger.json has been touched, its content hash is compared against the one the index was
+    compiled from, and the index is rebuilt if the two differ.  A missing or unreadable index is
+    rebuilt as well.
+
+    Raises:
+        FileNotFoundError: If there is no swagger.json in config_dir
+    """
+    swagger_file = os.path.join(config_dir, SWAGGER_FILENAME)
+    index_file = os.path.join(config_dir, INDEX_FILENAME)
+    stamp = _stat_stamp(swagger_file)
+
+    index = _read_index(index_file)
+    if index is not None and index.header.get("swagger_stat") == stamp:
+        return index
+
+    with open(swagger_file, "rb") as f:
+        content = f.read()
+    swagger_hash = hash_swagger(content)
+
+    if index is not None and index.swagger_hash == swagger_hash:
+        compiled = index.to_compiled()
+    else:
+        compiled = compile_endpoint_index(jsoncodec.loads(content), swagger_hash)
+    compiled["swagger_stat"] = stamp
+    _write_index(index_file, compiled)
+    return EndpointIndex.from_compiled(compiled)
+
+
+def _stat_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read_index(index_file: str) -> Optional[EndpointIndex]:
+    try:
+        with open(index_file, "rb") as f:
+            header_line = f.readline()
+        header = json.loads(header_line)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("format") != INDEX_FORMAT_VERSION:
+        return None
+    return EndpointIndex(header, index_file=index_file, body_offset=len(header_line))
+
+
+def _write_index(index_file: str, compiled: Dict[str, Any]) -> None:
+    header = {key: value for key, value in compiled.items() if key != "endpoints"}
+    header["endpoints"] = {}
+    body = []
+    offset = 0
+    for endpoint, entry in compiled["endpoints"].items():
+        line = json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+        header["endpoints"][endpoint] = [offset, len(line)]
+        body.append(line)
+        offset += len(line)
+
+    # Write to a temporary file and rename it into place, so that concurrent invocations never
+    # read a partially written index.  If the config directory is read-only, we simply keep
+    # using the in-memory index.
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(json.dumps(header, separators=(",", ":")).encode() + b"\n")
+            f.writelines(body)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+class EndpointParsers(Mapping[str, FerryParser]):
+    """Read-only mapping of endpoint name to FerryParser, backed by a compiled endpoint index.
+
+    Parsers are only built the first time an endpoint is looked up, so a single invocation pays
+    for the one endpoint it calls rather than for every path in swagger.json.  Listing endpoints
+    is served from the index metadata alone, and printing an endpoint's parameters only builds
+    that endpoint's parser.
+    """
+
+    def __init__(self: "EndpointParsers", index: EndpointIndex) -> None:
+        self.index = index
+        self._parsers: Dict[str, FerryParser] = {}
+
+    def __getitem__(self: "EndpointParsers", endpoint: str) -> FerryParser:
+        parser = self._parsers.get(endpoint, None)
+        if parser is None:
+            entry = self.index[endpoint]
+            parser = FerryParser(description=entry["description"])
+            parser.set_arguments(entry["parameters"])
+            self._parsers[endpoint] = parser
+        return parser
+
+    def __contains__(self: "EndpointParsers", endpoint: object) -> bool:
+        return endpoint in self.index
+
+    def __iter__(self: "EndpointParsers") -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self: "EndpointParsers") -> int:
+        return len(self.index)
+
+    @property
+    def built(self: "EndpointParsers") -> List[str]:
+        """Names of the endpoints whose parsers have been built so far"""
+        return list(self._parsers)
+
+    def method(self: "EndpointParsers", endpoint: str) -> str:
+        return str(self.index[endpoint]["method"])
+
+    def description(self: "EndpointParsers", endpoint: str) -> str:
+        return str(self.index[endpoint]["description"])
+
+    def descriptions(self: "EndpointParsers") -> Iterator[Tuple[str, str]]:
+        """Yield (endpoint, description) for every endpoint in the index"""
+        for endpoint, entry in self.index.iter_entries():
+            yield endpoint, entry["description"]
+
+    def format_help(self: "EndpointParsers", endpoint: str) -> str:
+        """The endpoint's help text, from its parser (built, and kept, if it hasn't been yet)"""
+        return self[endpoint].format_help()
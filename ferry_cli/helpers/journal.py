@@ -0,0 +1,235 @@
+"""Journal of a workflow run's completed steps, so that a run that stops part way can be resumed.
+
+Each run appends to its own file, <journal_dir>/<run-id>.jsonl.  The first line records the workflow,
+its arguments and the FERRY server.  Each later line records a completed write: the step's name,
+the parameters of the FERRY call it made (when the step has them), a digest of its result, and the
+result itself.  Reads aren't recorded, since a resumed run should see FERRY's current state.  Lines are flushed as they are written, so the journal holds every step that completed
+however the run ends.  A run that succeeds ends with a "finished" line.
+
+`--resume <run-id>` reopens the journal of a run that didn't finish: the writes it records are not made
+again, and the steps that need them are given the recorded results instead (see Workflow.run_steps).
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Dict, IO, List, NamedTuple, Optional, Tuple
+
+__all__ = [
+    "DEFAULT_MAX_AGE_DAYS",
+    "JournalEntry",
+    "JournalError",
+    "WorkflowJournal",
+    "digest",
+]
+
+# Journals older than this are removed when a new run starts
+DEFAULT_MAX_AGE_DAYS = 30.0
+
+
+class JournalError(Exception):
+    """A journal can't be resumed: it doesn't exist, it is for a different run, or the run finished"""
+
+
+class JournalEntry(NamedTuple):
+    """A completed step, as recorded in the journal"""
+
+    step: str
+    params: Optional[Dict[str, Any]]
+    digest: str
+    result: Any
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def digest(value: Any) -> str:
+    """A short digest of a JSON value, the same however its keys are ordered"""
+    # Only needed once a run is journaled, so keep it off the import path
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    return hashlib.sha256(_canonical(value).encode()).hexdigest()[:16]
+
+
+class WorkflowJournal:
+    """The journal of one workflow run.  Use create for a new run, or resume for an unfinished one.
+
+    record may be called from several threads at once, as run_steps does.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self: "WorkflowJournal",
+        path: pathlib.Path,
+        run_id: str,
+        workflow: str,
+        entries: List[JournalEntry],
+        f: IO[str],
+    ) -> None:
+        self.path = path
+        self.run_id = run_id
+        self.workflow = workflow
+        # Completed steps, by name and a digest of their parameters
+        self._entries: Dict[Tuple[str, str], JournalEntry] = {
+            (entry.step, digest(entry.params)): entry for entry in entries
+        }
+        # How many steps were completed by earlier attempts at this run
+        self.resumed = len(entries)
+        self._f = f
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        journal_dir: pathlib.Path,
+        workflow: str,
+        args: Dict[str, Any],
+        server: str = "",
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ) -> "WorkflowJournal":
+        """Start the journal of a new run of workflow with args, against server (its base URL)"""
+        journal_dir = pathlib.Path(journal_dir)
+        journal_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        cls.prune(journal_dir, max_age_days)
+        run_id = f"{workflow}-{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+        path = journal_dir / f"{run_id}.jsonl"
+        # pylint: disable=consider-using-with
+        f = open(path, "x", encoding="utf-8")
+        f.write(
+            _canonical(
+                {
+                    "run_id": run_id,
+                    "workflow": workflow,
+                    "args": args,
+                    "server": server,
+                    "started": time.time(),
+                }
+            )
+            + "\n"
+        )
+        f.flush()
+        return cls(path, run_id, workflow, [], f)
+
+    @classmethod
+    def resume(
+        cls,
+        journal_dir: pathlib.Path,
+        run_id: str,
+        workflow: str,
+        args: Dict[str, Any],
+        server: str = "",
+    ) -> "WorkflowJournal":
+        """Reopen the journal of an unfinished run, to continue it
+
+        Raises:
+            JournalError: If there is no such run, it was for a different workflow, arguments or
+                server, or it already finished
+        """
+        path = pathlib.Path(journal_dir) / f"{run_id}.jsonl"
+        if os.sep in run_id or not path.is_file():
+            raise JournalError(f"There is no journal for run {run_id} in {journal_dir}")
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        lines = text.splitlines()
+        cls._check_header(
+            json.loads(lines[0]) if lines else {}, run_id, workflow, args, server
+        )
+        entries: List[JournalEntry] = []
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line may have been cut off when the run stopped
+                continue
+            if record.get("finished"):
+                raise JournalError(f"Run {run_id} already finished")
+            entry = JournalEntry(
+                record["step"], record.get("params"), record["digest"], record["result"]
+            )
+            # Skip entries whose result doesn't match its digest, so the step runs again
+            if digest(entry.result) == entry.digest:
+                entries.append(entry)
+        # pylint: disable=consider-using-with
+        f_append = open(path, "a", encoding="utf-8")
+        if text and not text.endswith("\n"):
+            # End the cut off line, so it doesn't swallow the next entry
+            f_append.write("\n")
+        return cls(path, run_id, workflow, entries, f_append)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _check_header(
+        header: Dict[str, Any],
+        run_id: str,
+        workflow: str,
+        args: Dict[str, Any],
+        server: str,
+    ) -> None:
+        if header.get("workflow") != workflow:
+            raise JournalError(
+                f"Run {run_id} was of the {header.get('workflow')} workflow, not {workflow}"
+            )
+        # Compared as they were recorded, so that e.g. tuples and lists compare the same way
+        recorded_args = header.get("args", {})
+        current_args = json.loads(_canonical(args))
+        changed = sorted(
+            name
+            for name in set(recorded_args) | set(current_args)
+            if recorded_args.get(name) != current_args.get(name)
+        )
+        if changed:
+            raise JournalError(
+                f"Run {run_id} was started with different arguments ({', '.join(changed)}).  "
+                "Resume it with the same arguments, or start a new run"
+            )
+        if header.get("server", "") != server:
+            raise JournalError(
+                f"Run {run_id} was against {header.get('server')}, not {server}"
+            )
+
+    @staticmethod
+    def prune(journal_dir: pathlib.Path, max_age_days: float) -> None:
+        """Remove journals last written more than max_age_days ago"""
+        cutoff = time.time() - max_age_days * 86400
+        try:
+            entries = list(os.scandir(journal_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith(".jsonl") and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def completed(
+        self: "WorkflowJournal", step: str, params: Optional[Dict[str, Any]] = None
+    ) -> Optional[JournalEntry]:
+        """The journal's record of step, with these params, if an earlier attempt completed it"""
+        with self._lock:
+            return self._entries.get((step, digest(params)))
+
+    def record(
+        self: "WorkflowJournal",
+        step: str,
+        result: Any,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Record that step, with params, completed with result"""
+        entry = JournalEntry(step, params, digest(result), result)
+        line = _canonical(entry._asdict()) + "\n"
+        with self._lock:
+            self._entries[(step, digest(params))] = entry
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self: "WorkflowJournal", finished: bool = False) -> None:
+        """Close the journal.  A finished run can't be resumed"""
+        with self._lock:
+            if self._f.closed:
+                return
+            if finished:
+                self._f.write(_canonical({"finished": time.time()}) + "\n")
+            self._f.close()
@@ -0,0 +1,199 @@
+"""Pluggable JSON encoding and decoding.
+
+Uses orjson or ujson when one is installed, since decoding and encoding large FERRY responses with
+the standard library's json module dominates the CPU time of the big list endpoints.  Falls back to
+the standard library otherwise.
+
+Decoding always gives the same result as json.loads: if the fast backend can't decode something
+(e.g. integers too large for it), the standard library is used instead.  Output that users see is
+byte-for-byte identical to json.dumps unless compatibility mode is turned off, since no fast backend
+matches json.dumps' formatting (indentation and escaping of non-ASCII characters) exactly.
+
+The backend is chosen on first use, so that commands which never touch JSON don't pay to import it.
+"""
+import json
+from typing import Any, Callable, IO, Optional, Tuple, Type
+
+__all__ = [
+    "BACKENDS",
+    "backend_name",
+    "configure",
+    "dumps_compact",
+    "loads",
+    "write_indented",
+]
+
+# In order of preference for "auto"
+BACKENDS = ("orjson", "ujson", "stdlib")
+
+_requested_backend = "auto"  # pylint: disable=invalid-name
+_compatible = True  # pylint: disable=invalid-name
+_backend: Optional["_Backend"] = None  # pylint: disable=invalid-name
+
+# orjson decodes integers that don't fit in 64 bits as floats, where json.loads keeps them exact.
+# Those have at least 19 digits, so input with a run of that many digits is left to the standard library.
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+_LONG_DIGIT_RUN = b"0" * 19
+_SCAN_CHUNK = 1 << 20
+
+
+class _Unsupported(Exception):
+    """Raised by a backend for input it can't decode exactly as json.loads would"""
+
+
+class _Backend:
+    """The functions a backend provides.  Any of them may raise, in which case the standard library is used"""
+
+    def __init__(
+        self: "_Backend",
+        name: str,
+        loads_func: Callable[[Any], Any],
+        dumps_compact_func: Callable[[Any], bytes],
+        dumps_indented: Optional[Callable[[Any], bytes]],
+        errors: Tuple[Type[BaseException], ...],
+    ) -> None:
+        self.name = name
+        self.loads = loads_func
+        self.dumps_compact = dumps_compact_func
+        # None if the backend can't pretty-print
+        self.dumps_indented = dumps_indented
+        # Exceptions meaning "this backend can't handle that input"
+        self.errors = errors
+
+
+def _stdlib_dumps_compact(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+def _has_long_digit_run(data: bytes) -> bool:
+    """Whether data contains len(_LONG_DIGIT_RUN) or more digits in a row"""
+    overlap = len(_LONG_DIGIT_RUN) - 1
+    # In chunks, so that we don't make a translated copy of all of data at once
+    for start in range(0, len(data), _SCAN_CHUNK):
+        chunk = data[max(0, start - overlap) : start + _SCAN_CHUNK]
+        if _LONG_DIGIT_RUN in chunk.translate(_DIGITS_TO_ZERO):
+            return True
+    return False
+
+
+def _load_backend(name: str) -> Optional[_Backend]:
+    # pylint: disable=import-outside-toplevel,import-error,no-member
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+
+        def orjson_loads(data: Any) -> Any:
+            if not isinstance(data, bytes) or _has_long_digit_run(data):
+                raise _Unsupported()
+            return orjson.loads(data)
+
+        return _Backend(
+            "orjson",
+            orjson_loads,
+            lambda obj: orjson.dumps(obj, default=str),
+            lambda obj: orjson.dumps(obj, default=str, option=orjson.OPT_INDENT_2),
+            (
+                orjson.JSONDecodeError,
+                orjson.JSONEncodeError,
+                TypeError,
+                _Unsupported,
+            ),
+        )
+    if name == "ujson":
+        try:
+            import ujson
+        except ImportError:
+            return None
+        return _Backend(
+            "ujson",
+            ujson.loads,
+            lambda obj: ujson.dumps(
+                obj, escape_forward_slashes=False, default=str
+            ).encode(),
+            lambda obj: ujson.dumps(
+                obj, escape_forward_slashes=False, default=str, indent=4
+            ).encode(),
+            (ValueError, TypeError, OverflowError),
+        )
+    return _Backend("stdlib", json.loads, _stdlib_dumps_compact, None, ())
+
+
+def configure(backend: str = "auto", compatible: bool = True) -> None:
+    """Choose the JSON backend.
+
+    Parameters:
+        backend (str): "auto" (the fastest one installed), or one of BACKENDS.  A backend that isn't
+            installed falls back to the standard library
+        compatible (bool): If True, output users see is identical to json.dumps(obj, indent=4).  If False,
+            the fast backend's own pretty-printing is used, which is much faster but formatted differently
+    """
+    global _requested_backend, _compatible, _backend  # pylint: disable=global-statement
+    if backend != "auto" and backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown JSON backend {backend!r}; choose from auto, {', '.join(BACKENDS)}"
+        )
+    _requested_backend = backend
+    _compatible = compatible
+    _backend = None
+
+
+def _get_backend() -> _Backend:
+    global _backend  # pylint: disable=global-statement
+    if _backend is None:
+        names = BACKENDS if _requested_backend == "auto" else (_requested_backend,)
+        for name in names:
+            _backend = _load_backend(name)
+            if _backend is not None:
+                break
+        else:
+            _backend = _load_backend("stdlib")
+    assert _backend is not None
+    return _backend
+
+
+def backend_name() -> str:
+    """The name of the backend in use"""
+    return _get_backend().name
+
+
+def loads(data: Any) -> Any:
+    """Decode JSON from bytes (or a str, which fast backends may not handle), as json.loads would"""
+    backend = _get_backend()
+    try:
+        return backend.loads(data)
+    except backend.errors:
+        return json.loads(data)
+
+
+def dumps_compact(obj: Any) -> bytes:
+    """Encode obj as compact UTF-8 JSON, for ferry-cli's own files (e.g. the response cache).
+
+    The formatting may differ between backends, so this is not for output that users see.
+    Values JSON can't represent are converted with str().
+    """
+    backend = _get_backend()
+    try:
+        return backend.dumps_compact(obj)
+    except backend.errors:
+        return _stdlib_dumps_compact(obj)
+
+
+def write_indented(obj: Any, stream: IO[str]) -> bool:
+    """Write obj pretty-printed with the fast backend, if compatibility mode is off and it can.
+
+    Returns:
+        bool: Whether obj was written.  If not, the caller should write it with the standard library.
+    """
+    if _compatible:
+        return False
+    backend = _get_backend()
+    if backend.dumps_indented is None:
+        return False
+    try:
+        encoded = backend.dumps_indented(obj)
+    except backend.errors:
+        return False
+    stream.write(encoded.decode())
+    return True
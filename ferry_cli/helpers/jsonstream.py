@@ -0,0 +1,222 @@
+"""Incremental parsing of FERRY responses, for --stream.
+
+parse_response reads a response body chunk by chunk.  The keys before ferry_output are parsed
+right away, and if ferry_output is a list, its records are parsed one at a time as they are
+iterated over, so memory use is proportional to the largest record rather than to the response.
+"""
+import codecs
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+__all__ = ["StreamedResponse", "parse_response"]
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+# Read at least this much more before retrying a value that was cut off by the end of a chunk
+_MIN_READ = 1 << 16
+
+
+class StreamedResponse(Dict[str, Any]):
+    """A response whose ferry_output records are parsed as they are iterated over.
+
+    The dict holds the keys that came before ferry_output in the response, and "ferry_output",
+    an iterator over its records.  Any keys after ferry_output are only known once the records
+    have all been read, and are then in tail.
+    """
+
+    def __init__(
+        self: "StreamedResponse",
+        head: Dict[str, Any],
+        records: Iterator[Any],
+        tail: Dict[str, Any],
+    ) -> None:
+        super().__init__(head)
+        self["ferry_output"] = records
+        self.tail = tail
+
+    def with_records(
+        self: "StreamedResponse", records: Iterator[Any]
+    ) -> "StreamedResponse":
+        """A copy of this response with other records (e.g. filtered ones), sharing its tail"""
+        head = {key: value for key, value in self.items() if key != "ferry_output"}
+        return StreamedResponse(head, records, self.tail)
+
+
+class _Reader:
+    """A text buffer over a stream of UTF-8 chunks, which JSON values are decoded from one at a time"""
+
+    def __init__(self: "_Reader", chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self: "_Reader") -> bool:
+        """Read another chunk into the buffer.  Returns False if there was nothing left to read"""
+        if self.pos:
+            # Drop what's been parsed already, so the buffer only holds what's still needed
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        if self.eof:
+            return False
+        self.eof = True
+        text = self._decoder.decode(b"", final=True)
+        self.buffer += text
+        return bool(text)
+
+    def _read_more(self: "_Reader") -> None:
+        """Grow the unparsed part of the buffer substantially, so a large value that's split across
+        many chunks is only re-parsed a few times"""
+        target = max(2 * (len(self.buffer) - self.pos), _MIN_READ)
+        while len(self.buffer) - self.pos < target and self._fill():
+            pass
+
+    def peek(self: "_Reader") -> str:
+        """Skip whitespace, and return the next character without consuming it, or "" at the end"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()  # type: ignore[union-attr]
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self: "_Reader", char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(
+                f"Expecting {char!r}, found {found or 'end of response'!r}",
+                self.buffer,
+                self.pos,
+            )
+        self.pos += 1
+
+    def value(self: "_Reader") -> Any:
+        """Decode the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Most likely the value is cut off by the end of the buffer
+                self._read_more()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # A number (or true, false, null) at the very end might continue in the next chunk
+                self._read_more()
+                continue
+            self.pos = end
+            return obj
+
+    def read_members(self: "_Reader", into: Dict[str, Any]) -> Optional[str]:
+        """Read an object's "key": value pairs into into, up to its closing brace or a ferry_output
+        list.  Returns "ferry_output" if it stopped at the start of that list, otherwise None"""
+        if self.peek() == "}":
+            self.pos += 1
+            return None
+        while True:
+            key = self.value()
+            self.expect(":")
+            if key == "ferry_output" and self.peek() == "[":
+                self.pos += 1
+                return "ferry_output"
+            into[key] = self.value()
+            separator = self.peek()
+            self.expect(separator if separator in ",}" else ",")
+            if separator == "}":
+                return None
+
+    def read_rest(self: "_Reader") -> str:
+        """Everything not parsed yet"""
+        while self._fill():
+            pass
+        rest = self.buffer[self.pos :]
+        self.pos = len(self.buffer)
+        return rest
+
+    def expect_end(self: "_Reader") -> None:
+        if self.peek():
+            raise json.JSONDecodeError("Extra data", self.buffer, self.pos)
+
+
+def parse_response(
+    chunks: Iterable[bytes],
+    on_close: Optional[Callable[[], None]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """Parse a response body from its chunks.
+
+    Parameters:
+        chunks (Iterable[bytes]): The body, as UTF-8
+        on_close (Optional[Callable[[], None]]): Called once the body has been fully read (or
+            reading stops early), e.g. to release the connection
+        extra (Optional[Dict[str, Any]]): Keys to add to the end of the response
+
+    Returns:
+        A StreamedResponse if the response is an object with a ferry_output list.  Otherwise, the
+        whole response, decoded as json.loads would.
+
+    Raises:
+        json.JSONDecodeError: If the response is not valid JSON.  For a StreamedResponse, this can
+            also happen while its records are read.
+    """
+    reader = _Reader(chunks)
+    streaming = False
+    try:
+        if reader.peek() != "{":
+            response = json.loads(reader.read_rest())
+            if isinstance(response, dict) and extra:
+                response.update(extra)
+            return response
+        reader.pos += 1
+        head: Dict[str, Any] = {}
+        if reader.read_members(head) is None:
+            reader.expect_end()
+            head.update(extra or {})
+            return head
+        streaming = True
+    finally:
+        # Once streaming, the records iterator closes the response when it's done
+        if not streaming and on_close is not None:
+            on_close()
+
+    tail: Dict[str, Any] = {}
+    return StreamedResponse(head, _records(reader, tail, extra or {}, on_close), tail)
+
+
+def _records(
+    reader: _Reader,
+    tail: Dict[str, Any],
+    extra: Dict[str, Any],
+    on_close: Optional[Callable[[], None]],
+) -> Iterator[Any]:
+    """Yield the records of the ferry_output list the reader is at, then read the rest of the
+    response into tail"""
+    try:
+        if reader.peek() == "]":
+            reader.pos += 1
+        else:
+            while True:
+                yield reader.value()
+                separator = reader.peek()
+                reader.expect(separator if separator in ",]" else ",")
+                if separator == "]":
+                    break
+        separator = reader.peek()
+        reader.expect(separator if separator in ",}" else ",")
+        if separator == ",":
+            reader.read_members(tail)
+        reader.expect_end()
+        tail.update(extra)
+    finally:
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,367 @@
+"""In-memory index of who can reach what in FERRY: users, their groups, the groups' affiliation units,
+and the capability sets of those units.
+
+Answering "which capability sets can user X reach" from FERRY directly takes a chain of
+getGroupMembers, getGroupUnits and getCapabilitySet calls for every user.  A MembershipGraph is built
+once (see load_membership_graph), after which each such question, in either direction, is answered
+in a single pass over the graph without calling FERRY.
+
+Nodes are numbered per kind, and each kind of link is stored in both directions as compressed sparse
+rows: the neighbours of node i are targets[offsets[i]:offsets[i + 1]], in two array('I')s.
+"""
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    from ferry_cli.helpers.api import DEFAULT_CONCURRENCY, FerryAPI
+    from ferry_cli.helpers.auth import DebugLevel
+except ImportError:
+    from helpers.api import DEFAULT_CONCURRENCY, FerryAPI  # type: ignore
+    from helpers.auth import DebugLevel  # type: ignore
+
+__all__ = [
+    "CAPABILITY_SET",
+    "GROUP",
+    "KINDS",
+    "MembershipGraph",
+    "MembershipGraphBuilder",
+    "UNIT",
+    "USER",
+    "load_membership_graph",
+]
+
+USER = "user"
+GROUP = "group"
+UNIT = "unit"
+CAPABILITY_SET = "capabilityset"
+
+# The chain that links users to capability sets.  Queries walk it forwards or backwards.
+KINDS = (USER, GROUP, UNIT, CAPABILITY_SET)
+
+# The field each kind's names are reported in, as FERRY names them
+FIELDS = {
+    USER: "username",
+    GROUP: "groupname",
+    UNIT: "unitname",
+    CAPABILITY_SET: "setname",
+}
+
+# The field listing the intermediate nodes a result was reached through
+_VIA_FIELDS = {GROUP: "groups", UNIT: "units"}
+
+
+class _Adjacency:
+    """One direction of one kind of link, as compressed sparse rows"""
+
+    def __init__(
+        self: "_Adjacency",
+        num_nodes: int,
+        sources: "array[int]",
+        targets: "array[int]",
+    ) -> None:
+        # A counting sort of the links by source, so that each node's neighbours are contiguous
+        offsets = array("I", [0]) * (num_nodes + 1)
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(num_nodes):
+            offsets[i + 1] += offsets[i]
+        next_slot = offsets[:-1]
+        self.targets = array("I", [0]) * len(targets)
+        for source, target in zip(sources, targets):
+            self.targets[next_slot[source]] = target
+            next_slot[source] += 1
+        self.offsets = offsets
+
+    def __getitem__(self: "_Adjacency", node: int) -> "array[int]":
+        return self.targets[self.offsets[node] : self.offsets[node + 1]]
+
+
+class MembershipGraph:
+    """Users, groups, units and capability sets, and the links between them (see MembershipGraphBuilder)"""
+
+    def __init__(
+        self: "MembershipGraph",
+        names: Dict[str, List[str]],
+        links: Dict[Tuple[str, str], Tuple["array[int]", "array[int]"]],
+    ) -> None:
+        self._names = names
+        self._ids = {
+            kind: {name: i for i, name in enumerate(kind_names)}
+            for kind, kind_names in names.items()
+        }
+        self._adjacency: Dict[Tuple[str, str], _Adjacency] = {}
+        # Groups whose members or units couldn't be fetched, so their links may be missing, with why
+        self.failed_groups: Dict[str, str] = {}
+        for (source_kind, target_kind), (sources, targets) in links.items():
+            self._adjacency[(source_kind, target_kind)] = _Adjacency(
+                len(names[source_kind]), sources, targets
+            )
+            self._adjacency[(target_kind, source_kind)] = _Adjacency(
+                len(names[target_kind]), targets, sources
+            )
+
+    def __len__(self: "MembershipGraph") -> int:
+        """The number of nodes"""
+        return sum(len(kind_names) for kind_names in self._names.values())
+
+    def names(self: "MembershipGraph", kind: str) -> List[str]:
+        return list(self._names[kind])
+
+    def __contains__(self: "MembershipGraph", node: Tuple[str, str]) -> bool:
+        kind, name = node
+        return name in self._ids[kind]
+
+    def reachable(
+        self: "MembershipGraph", kind: str, name: str, target_kind: str
+    ) -> Iterator[Dict[str, Any]]:
+        """Every target_kind node that name (of kind) is linked to along KINDS, in either direction.
+
+        Yields one dict per node reached, sorted by name, e.g. for a user and CAPABILITY_SET:
+            {"username": ..., "setname": ..., "groups": [...], "units": [...]}
+        where groups and units are the nodes in between that link the two.  Nothing is yielded if
+        name isn't in the graph.
+        """
+        start, end = KINDS.index(kind), KINDS.index(target_kind)
+        if start == end:
+            raise ValueError(f"Can't link {kind}s to themselves")
+        path = KINDS[start : end + 1] if start < end else KINDS[end : start + 1][::-1]
+        source = self._ids[kind].get(name)
+        if source is None:
+            return
+
+        levels = self._walk(path, source)
+        target_names = self._names[target_kind]
+        for target in sorted(levels[-1], key=target_names.__getitem__):
+            result: Dict[str, Any] = {
+                FIELDS[kind]: name,
+                FIELDS[target_kind]: target_names[target],
+            }
+            result.update(self._via(path, levels, target))
+            yield result
+
+    def _walk(
+        self: "MembershipGraph", path: Sequence[str], source: int
+    ) -> List[Set[int]]:
+        """Walk path one kind at a time from source, returning every node reached at each level"""
+        levels: List[Set[int]] = [{source}]
+        for from_kind, to_kind in zip(path, path[1:]):
+            adjacency = self._adjacency[(from_kind, to_kind)]
+            reached: Set[int] = set()
+            for node in levels[-1]:
+                reached.update(adjacency[node])
+            levels.append(reached)
+        return levels
+
+    def _via(
+        self: "MembershipGraph",
+        path: Sequence[str],
+        levels: List[Set[int]],
+        target: int,
+    ) -> Dict[str, List[str]]:
+        """The nodes in between the source and target that link them, found by walking back from
+        target through the levels reached on the way there"""
+        via: Dict[str, List[str]] = {}
+        back = {target}
+        for i in range(len(path) - 1, 1, -1):
+            adjacency = self._adjacency[(path[i], path[i - 1])]
+            back = {node for b in back for node in adjacency[b]} & levels[i - 1]
+            kind_names = self._names[path[i - 1]]
+            via[_VIA_FIELDS[path[i - 1]]] = sorted(kind_names[node] for node in back)
+        # Report them in the order the path passes through them
+        return dict(reversed(list(via.items())))
+
+
+class MembershipGraphBuilder:
+    """Collects links, by name, and builds a MembershipGraph from them"""
+
+    def __init__(self: "MembershipGraphBuilder") -> None:
+        self._names: Dict[str, List[str]] = {kind: [] for kind in KINDS}
+        self._ids: Dict[str, Dict[str, int]] = {kind: {} for kind in KINDS}
+        # The two ends of each kind of link, and the links added so far (as source << 32 | target)
+        self._links: Dict[Tuple[str, str], Tuple["array[int]", "array[int]"]] = {
+            pair: (array("I"), array("I")) for pair in zip(KINDS, KINDS[1:])
+        }
+        self._seen: Dict[Tuple[str, str], Set[int]] = {
+            pair: set() for pair in self._links
+        }
+
+    def add(self: "MembershipGraphBuilder", kind: str, name: str) -> int:
+        """Add a node (if it isn't there already), and return its ID"""
+        ids = self._ids[kind]
+        node = ids.get(name)
+        if node is None:
+            node = ids[name] = len(ids)
+            self._names[kind].append(name)
+        return node
+
+    def link(
+        self: "MembershipGraphBuilder",
+        kind: str,
+        name: str,
+        other_kind: str,
+        other_name: str,
+    ) -> None:
+        """Link two nodes of kinds next to each other in KINDS, adding them if need be"""
+        if (kind, other_kind) not in self._links:
+            kind, name, other_kind, other_name = other_kind, other_name, kind, name
+        source, target = self.add(kind, name), self.add(other_kind, other_name)
+        seen = self._seen[(kind, other_kind)]
+        if source << 32 | target in seen:
+            return
+        seen.add(source << 32 | target)
+        sources, targets = self._links[(kind, other_kind)]
+        sources.append(source)
+        targets.append(target)
+
+    def build(self: "MembershipGraphBuilder") -> MembershipGraph:
+        return MembershipGraph(self._names, self._links)
+
+
+def fqan_unit(fqan: str) -> Optional[str]:
+    """The affiliation unit an FQAN belongs to, e.g. /fermilab/nova/Role=Production -> nova"""
+    parts = [part for part in fqan.split("/") if part and "=" not in part]
+    return parts[-1] if parts else None
+
+
+def _records(response: Any) -> List[Any]:
+    """The records of a successful response, or none for a failed one (e.g. a group without members)"""
+    if not isinstance(response, dict) or response.get("ferry_status") != "success":
+        return []
+    output = response.get("ferry_output")
+    if isinstance(output, list):
+        return output
+    return [] if output is None else [output]
+
+
+def _collection(api: FerryAPI, name: str, endpoint: str) -> Tuple[List[Any], int]:
+    """All of a collection's records, from a fresh local snapshot if there is one, or else from
+    FERRY, and how many calls to FERRY that took"""
+    if api.snapshot is not None and api.snapshot.is_fresh(name):
+        return list(api.snapshot.query(name)), 0
+    response = api.call_endpoint(endpoint)
+    if not isinstance(response, dict) or response.get("ferry_status") != "success":
+        errors = ", ".join(map(str, (response or {}).get("ferry_error") or []))
+        raise RuntimeError(f"{endpoint} failed: {errors or 'no response'}")
+    return _records(response), 1
+
+
+def load_membership_graph(
+    api: FerryAPI, concurrency: int = DEFAULT_CONCURRENCY
+) -> Optional[MembershipGraph]:
+    """Build a MembershipGraph from FERRY.
+
+    Groups and capability sets come from getAllGroups and getCapabilitySet (or the local snapshot, if
+    it is fresh).  Each group's members and units are then fetched with getGroupMembers and
+    getGroupUnits, up to concurrency calls at a time.  Capability sets are linked to the units of
+    their roles' FQANs.  A group whose members or units can't be fetched doesn't stop the others:
+    it is reported (unless quiet), and listed in the graph's failed_groups.
+
+    Returns:
+        The graph, or None in a dry run, where no calls are made
+
+    Raises:
+        RuntimeError: If getAllGroups or getCapabilitySet fails
+    """
+    if api.dryrun:
+        api.call_endpoint("getAllGroups")
+        api.call_endpoint("getCapabilitySet")
+        print(
+            "Dryrun: the members and units of every group would then be fetched with getGroupMembers and getGroupUnits"
+        )
+        return None
+
+    builder = MembershipGraphBuilder()
+    groups, calls = _collection(api, "groups", "getAllGroups")
+    groupnames = [
+        group["groupname"]
+        for group in groups
+        if isinstance(group, dict) and group.get("groupname")
+    ]
+    capability_sets, set_calls = _collection(api, "capabilitysets", "getCapabilitySet")
+    calls += set_calls
+    for capability_set in capability_sets:
+        setname = capability_set.get("setname")
+        if not setname:
+            continue
+        builder.add(CAPABILITY_SET, setname)
+        for role in capability_set.get("roles") or []:
+            unitname = role.get("unitname") or fqan_unit(role.get("fqan") or "")
+            if unitname:
+                builder.link(UNIT, unitname, CAPABILITY_SET, setname)
+    failed_groups = _add_group_links(api, builder, groupnames, concurrency)
+    calls += 2 * len(groupnames)
+
+    graph = builder.build()
+    graph.failed_groups = failed_groups
+    if failed_groups and api.debug_level != DebugLevel.QUIET:
+        _report_failed_groups(failed_groups)
+    if api.debug_level == DebugLevel.DEBUG:
+        print(f"Built membership graph: {len(graph)} nodes from {calls} calls")
+    return graph
+
+
+def _report_failed_groups(failed_groups: Dict[str, str]) -> None:
+    print(
+        f"Couldn't fetch the members or units of {len(failed_groups)} group(s), so their links may be missing:"
+    )
+    for groupname, error in sorted(failed_groups.items()):
+        print(f"  {groupname}: {error}")
+
+
+def _add_group_links(
+    api: FerryAPI,
+    builder: MembershipGraphBuilder,
+    groupnames: List[str],
+    concurrency: int,
+) -> Dict[str, str]:
+    """Fetch the members and units of each group, concurrently, and link them to it.
+
+    Returns:
+        The groups whose members or units couldn't be fetched, with the errors
+    """
+    # Only these workflows need asyncio, which is slow to import
+    # pylint: disable=import-outside-toplevel
+    import asyncio
+
+    try:
+        from ferry_cli.helpers.async_api import AsyncFerryAPI
+    except ImportError:
+        from helpers.async_api import AsyncFerryAPI  # type: ignore
+
+    calls: List[Dict[str, Any]] = [
+        {"endpoint": endpoint, "params": {"groupname": groupname}}
+        for groupname in groupnames
+        for endpoint in ("getGroupMembers", "getGroupUnits")
+    ]
+    async_api = AsyncFerryAPI.from_api(api, concurrency)
+    try:
+        responses = asyncio.run(
+            async_api.gather_endpoints(calls, return_exceptions=True)
+        )
+    finally:
+        async_api.close()
+
+    failed: Dict[str, str] = {}
+    for call, response in zip(calls, responses):
+        groupname = call["params"]["groupname"]
+        builder.add(GROUP, groupname)
+        if isinstance(response, BaseException):
+            if not isinstance(response, Exception):
+                # e.g. KeyboardInterrupt, which stops the audit rather than one group
+                raise response
+            error = f"{call['endpoint']} failed: {response}"
+            failed[groupname] = (
+                f"{failed[groupname]}; {error}" if groupname in failed else error
+            )
+            continue
+        for record in _records(response):
+            if call["endpoint"] == "getGroupMembers" and record.get("username"):
+                builder.link(USER, record["username"], GROUP, groupname)
+            elif call["endpoint"] == "getGroupUnits" and record.get("unitname"):
+                builder.link(GROUP, groupname, UNIT, record["unitname"])
+    return failed
+
+
+def split_names(names: str) -> List[str]:
+    """Parse a workflow's comma-separated list of names"""
+    return [name.strip() for name in names.split(",") if name.strip()]
@@ -0,0 +1,298 @@
+"""Writing responses out, in the formats --format offers, without building the whole serialized
+response in memory"""
+import contextlib
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, Iterator, IO, List, Optional, Sequence, Tuple
+
+try:
+    from ferry_cli.helpers import jsoncodec
+except ImportError:
+    from helpers import jsoncodec  # type: ignore
+
+__all__ = [
+    "OUTPUT_FORMATS",
+    "atomic_output",
+    "response_records",
+    "write_compact_json",
+    "write_delimited",
+    "write_json",
+    "write_ndjson",
+    "write_output",
+]
+
+# The choices for --format.  "json" is the indented JSON ferry-cli has always printed.  The rest
+# print list responses one record per line, so downstream tools can start on them right away.
+OUTPUT_FORMATS = ("json", "json-compact", "ndjson", "csv", "tsv")
+
+# How many encoder chunks to join into each write.  Chunks are mostly small (a key, a value or some
+# indentation), so this keeps writes reasonably sized while bounding what's held in memory.
+CHUNK_BATCH = 1024
+
+# How many records to format before each write, for the line-oriented formats
+RECORD_BATCH = 512
+
+# Shared, since json.dumps with non-default options makes a new encoder for every call
+_COMPACT_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def write_json(obj: Any, stream: IO[str], indent: int = 4) -> None:
+    """Serialize obj to stream incrementally.
+
+    The output is identical to json.dumps(obj, indent=indent), but only a small part of it is
+    held in memory at a time.  If jsoncodec's compatibility mode is off, the fast backend writes
+    obj instead, formatted its own way and all at once.
+
+    A response whose records are an iterator (see jsonstream and records.filter_response) is
+    written record by record, as if they were a list.
+    """
+    if _has_iterator(obj):
+        _write_streamed_json(obj, stream, indent)
+        return
+    if jsoncodec.write_indented(obj, stream):
+        return
+    pending = []
+    for chunk in json.JSONEncoder(indent=indent).iterencode(obj):
+        pending.append(chunk)
+        if len(pending) >= CHUNK_BATCH:
+            stream.write("".join(pending))
+            pending.clear()
+    stream.write("".join(pending))
+
+
+@contextlib.contextmanager
+def atomic_output(path: str) -> Iterator[IO[str]]:
+    """Open a file to write path's new contents to.  path is only replaced once writing finishes
+    successfully, so readers never see a partly-written file, and a failure leaves any existing
+    file alone.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            yield f
+        # Keep the permissions of the file we're replacing
+        with contextlib.suppress(OSError):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def write_output(
+    obj: Any,
+    stream: IO[str],
+    output_format: str = "json",
+    columns: Optional[Sequence[str]] = None,
+) -> None:
+    """Write a response (or workflow result) to stream in output_format, one of OUTPUT_FORMATS.
+
+    columns chooses the columns for csv and tsv (see write_delimited).  Whatever the format, the
+    output ends with a newline, except for "json", which is printed as it always has been.
+
+    Records may be an iterator (see records.filter_response and jsonstream), in which case every
+    format writes them as they come.
+    """
+    if output_format == "json":
+        write_json(obj, stream)
+    elif output_format == "json-compact":
+        write_compact_json(obj, stream)
+        stream.write("\n")
+    elif output_format == "ndjson":
+        write_ndjson(response_records(obj), stream)
+    elif output_format in ("csv", "tsv"):
+        write_delimited(
+            response_records(obj),
+            stream,
+            delimiter="," if output_format == "csv" else "\t",
+            columns=columns,
+        )
+    else:
+        raise ValueError(
+            f"Unknown output format {output_format!r}; choose from {', '.join(OUTPUT_FORMATS)}"
+        )
+
+
+def response_records(obj: Any) -> Iterator[Any]:
+    """The records in a response: the items of ferry_output if it is a list, or ferry_output itself.
+
+    Workflow results and other values without a ferry_output are treated the same way.  Errors from
+    a failed response are printed to stderr once the records have been read, since they are not
+    records (and a streamed response's errors may come after them).
+    """
+    if not (isinstance(obj, dict) and ("ferry_output" in obj or "ferry_status" in obj)):
+        yield from _as_records(obj)
+        return
+    yield from _as_records(obj.get("ferry_output"))
+    for error in _response_items(obj, "ferry_error") or []:
+        print(f"FERRY error: {error}", file=sys.stderr)
+
+
+def _as_records(obj: Any) -> Iterable[Any]:
+    if isinstance(obj, (list, Iterator)):
+        return obj
+    if obj is None or obj == {}:
+        return []
+    return [obj]
+
+
+def _response_items(obj: Any, key: str) -> Any:
+    """obj[key], looking in a streamed response's tail too"""
+    if key in obj:
+        return obj[key]
+    return getattr(obj, "tail", {}).get(key)
+
+
+def _items(obj: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """obj's items, followed by those of a streamed response's tail, which is only filled in
+    once the records before it have been read"""
+    yield from obj.items()
+    yield from getattr(obj, "tail", {}).items()
+
+
+def _has_iterator(obj: Any) -> bool:
+    return isinstance(obj, Iterator) or (
+        isinstance(obj, dict) and isinstance(obj.get("ferry_output"), Iterator)
+    )
+
+
+def _write_streamed_json(obj: Any, stream: IO[str], indent: int) -> None:
+    """Write a response with iterator records as json.dumps(indent=indent) would write it with
+    the records in a list"""
+    encoder = json.JSONEncoder(indent=indent)
+    if isinstance(obj, Iterator):
+        _write_indented_list(obj, stream, encoder, "")
+        return
+    pad = " " * indent
+    first = True
+    for key, value in _items(obj):
+        stream.write(f"{'{' if first else ','}\n{pad}{json.dumps(key)}: ")
+        first = False
+        if isinstance(value, Iterator):
+            _write_indented_list(value, stream, encoder, pad)
+        else:
+            stream.write(encoder.encode(value).replace("\n", "\n" + pad))
+    stream.write("{}" if first else "\n}")
+
+
+def _write_indented_list(
+    items: Iterator[Any], stream: IO[str], encoder: json.JSONEncoder, outer: str
+) -> None:
+    """Write items as a list, indented by outer"""
+    inner = outer + " " * encoder.indent  # type: ignore[operator]
+    pending: List[str] = []
+    first = True
+    for item in items:
+        pending.append(
+            f"{'[' if first else ','}\n{inner}"
+            + encoder.encode(item).replace("\n", "\n" + inner)
+        )
+        first = False
+        if len(pending) >= RECORD_BATCH:
+            stream.write("".join(pending))
+            pending.clear()
+    pending.append("[]" if first else f"\n{outer}]")
+    stream.write("".join(pending))
+
+
+def write_compact_json(obj: Any, stream: IO[str]) -> None:
+    """Write obj as json.dumps(obj, separators=(",", ":")) would.
+
+    The top two levels of lists and dicts are written item by item, and everything below them is
+    encoded with json's C encoder, so this is both fast and doesn't hold the whole output in memory.
+    """
+    pending: List[str] = []
+    for chunk in _compact_chunks(obj, depth=2):
+        pending.append(chunk)
+        if len(pending) >= RECORD_BATCH:
+            stream.write("".join(pending))
+            pending.clear()
+    stream.write("".join(pending))
+
+
+def _compact_chunks(obj: Any, depth: int) -> Iterator[str]:
+    if depth and isinstance(obj, (list, Iterator)):
+        yield "["
+        for i, item in enumerate(obj):
+            if i:
+                yield ","
+            yield from _compact_chunks(item, depth - 1)
+        yield "]"
+    elif (
+        depth
+        and isinstance(obj, dict)
+        # json converts other key types to strings in its own way, so leave those dicts to it
+        and all(isinstance(key, str) for key in obj)
+    ):
+        yield "{"
+        for i, (key, value) in enumerate(_items(obj)):
+            yield f"{',' if i else ''}{json.dumps(key)}:"
+            yield from _compact_chunks(value, depth - 1)
+        yield "}"
+    else:
+        yield _COMPACT_ENCODER.encode(obj)
+
+
+def write_ndjson(records: Iterable[Any], stream: IO[str]) -> None:
+    """Write each record as compact JSON on its own line"""
+    pending: List[str] = []
+    for record in records:
+        pending.append(_COMPACT_ENCODER.encode(record))
+        if len(pending) >= RECORD_BATCH:
+            pending.append("")
+            stream.write("\n".join(pending))
+            pending.clear()
+    if pending:
+        pending.append("")
+        stream.write("\n".join(pending))
+
+
+def write_delimited(
+    records: Iterable[Any],
+    stream: IO[str],
+    delimiter: str = ",",
+    columns: Optional[Sequence[str]] = None,
+) -> None:
+    """Write records as CSV (or TSV, with delimiter="\\t"), with a header row.
+
+    Parameters:
+        columns (Optional[Sequence[str]]): The fields to write, in order.  Defaults to the fields of
+            the first record; fields that later records add are left out.  Records that aren't
+            objects are written as a single "value" column.
+
+    Fields missing from a record and null values are written empty, booleans as true/false, and
+    lists and objects as compact JSON.
+    """
+    # csv is only needed for these formats, so keep it off the import path
+    import csv  # pylint: disable=import-outside-toplevel
+
+    writer = csv.writer(stream, delimiter=delimiter, lineterminator="\n")
+    rows = (
+        record if isinstance(record, dict) else {"value": record} for record in records
+    )
+    header = list(columns) if columns else None
+    if header is not None:
+        writer.writerow(header)
+    pending: List[List[str]] = []
+    for row in rows:
+        if header is None:
+            header = list(row)
+            writer.writerow(header)
+        pending.append([_cell(row.get(column)) for column in header])
+        if len(pending) >= RECORD_BATCH:
+            writer.writerows(pending)
+            pending.clear()
+    writer.writerows(pending)
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return _COMPACT_ENCODER.encode(value)
+    return str(value)
@@ -0,0 +1,142 @@
+"""Client-side rate limiting of FERRY calls.
+
+Reads (GET) and writes (PUT/POST) each have their own token bucket: a bucket holds up to `burst`
+tokens, refills at `rate` tokens per second, and every call takes one token, waiting for one if
+the bucket is empty.
+
+Buckets are shared by all threads of a process, and, where the platform supports file locks, by
+every ferry-cli process on the host using the same state file.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, IO, Optional, Tuple
+
+__all__ = ["RateLimiter", "READ", "WRITE", "request_class"]
+
+READ = "read"
+WRITE = "write"
+
+
+def request_class(method: str) -> str:
+    """The bucket that a call with this HTTP method takes its token from"""
+    return READ if method.lower() == "get" else WRITE
+
+
+class RateLimiter:
+    def __init__(
+        self: "RateLimiter",
+        limits: Dict[str, Tuple[float, float]],
+        state_file: Optional[str] = None,
+    ) -> None:
+        """
+        Parameters:
+            limits (Dict[str, Tuple[float, float]]): (rate in requests per second, burst) for READ and/or
+                WRITE.  Calls of a class with no limit (or a rate of 0) are not limited
+            state_file (Optional[str]): File holding the bucket levels, shared with other processes.
+                If None, buckets are only shared within this process
+        """
+        self.limits = {
+            kind: (float(rate), max(float(burst), 1.0))
+            for kind, (rate, burst) in limits.items()
+            if rate > 0
+        }
+        self.state_file = state_file
+        # One lock per bucket, so that waiting writers don't hold up readers
+        self._locks = {kind: threading.Lock() for kind in self.limits}
+        # Bucket levels, as {kind: [tokens, timestamp]}, when there is no state file to keep them in
+        self._state: Dict[str, Any] = {}
+
+    def acquire(self: "RateLimiter", kind: str) -> float:
+        """Take a token from kind's bucket, waiting for one if needed.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if kind not in self.limits:
+            return 0.0
+        waited = 0.0
+        with self._locks[kind]:
+            while True:
+                wait = self._take(kind)
+                if wait <= 0:
+                    return waited
+                time.sleep(wait)
+                waited += wait
+
+    def _take(self: "RateLimiter", kind: str) -> float:
+        """Try to take a token.  Returns 0 if one was taken, or else how long until one is available"""
+        rate, burst = self.limits[kind]
+        with self._shared_state() as state:
+            now = time.time()
+            stored_tokens, stamp = state.get(kind, [burst, now])
+            # Refill for the time since the bucket was last updated.  A clock that went backwards
+            # refills nothing.
+            tokens = min(
+                burst, float(stored_tokens) + max(0.0, now - float(stamp)) * rate
+            )
+            if tokens >= 1:
+                state[kind] = [tokens - 1, now]
+                return 0.0
+            state[kind] = [tokens, now]
+            return (1 - tokens) / rate
+
+    def _shared_state(self: "RateLimiter") -> "_StateFile":
+        return _StateFile(self.state_file, self._state)
+
+
+class _StateFile:
+    """Context manager that reads the bucket levels under an exclusive lock, and writes them back on exit.
+
+    Falls back to in-process state if there is no state file, no file locking (non-POSIX), or
+    the file can't be opened.
+    """
+
+    def __init__(
+        self: "_StateFile", path: Optional[str], fallback: Dict[str, Any]
+    ) -> None:
+        self.path = path
+        self.fallback = fallback
+        self.state: Dict[str, Any] = fallback
+        self._file: Optional[IO[str]] = None
+
+    def __enter__(self: "_StateFile") -> Dict[str, Any]:
+        if self.path is None:
+            return self.fallback
+        try:
+            import fcntl  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            return self.fallback
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._file = os.fdopen(fd, "r+")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        except OSError:
+            self._close()
+            return self.fallback
+        try:
+            loaded = json.loads(self._file.read() or "{}")
+            self.state = loaded if isinstance(loaded, dict) else {}
+        except ValueError:
+            self.state = {}
+        return self.state
+
+    def __exit__(self: "_StateFile", *exc_info: Any) -> None:
+        if self._file is None:
+            return
+        try:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(json.dumps(self.state))
+            self._file.flush()
+        except OSError:
+            pass
+        finally:
+            # Closing the file releases the lock
+            self._close()
+
+    def _close(self: "_StateFile") -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,160 @@
+"""Client-side filtering (--where) and projection (--select) of the records in a response.
+
+Both are applied lazily, record by record: the filtered response's ferry_output is an iterator, so
+records that are dropped, and fields that aren't selected, are never copied into the output.
+"""
+import json
+import operator
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+__all__ = [
+    "Condition",
+    "filter_response",
+    "parse_select",
+    "select_fields",
+    "where",
+]
+
+_CONDITION_RE = re.compile(r"^\s*([^\s=!<>~]+)\s*(==|!=|<=|>=|=|<|>|!~|~)\s*(.*?)\s*$")
+
+_ORDERINGS: Dict[str, Callable[[Any, Any], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class Condition:
+    """One --where condition, "field op value", that a record either matches or doesn't.
+
+    Operators:
+        == (or =), !=: Equal, not equal.  value is read as JSON if it can be (e.g. 5, true, null,
+            "quoted"), and otherwise as a string.  A string field also matches value's text as-is,
+            so groupname == 1234 matches the group named "1234".
+        <, <=, >, >=: Compare numbers numerically, and anything else as strings
+        ~, !~: Contains, doesn't contain the text of value (case-sensitive)
+
+    A record without the field matches no condition on it.
+    """
+
+    def __init__(self: "Condition", expression: str) -> None:
+        """
+        Raises:
+            ValueError: If expression isn't of the form "field op value"
+        """
+        match = _CONDITION_RE.match(expression)
+        if match is None:
+            raise ValueError(
+                f"Invalid condition {expression!r}: expected 'field op value', where op is one of "
+                "==, !=, <, <=, >, >=, ~ or !~"
+            )
+        self.expression = expression
+        self.field, op, self.text = match.groups()
+        self.op = "==" if op == "=" else op
+        try:
+            self.value: Any = json.loads(self.text)
+        except ValueError:
+            self.value = self.text
+
+    def __repr__(self: "Condition") -> str:
+        return f"Condition({self.expression!r})"
+
+    def __call__(self: "Condition", record: Any) -> bool:
+        if not isinstance(record, dict) or self.field not in record:
+            return False
+        actual = record[self.field]
+        if self.op in ("==", "!="):
+            equal = actual == self.value or (
+                isinstance(actual, str) and actual == self.text
+            )
+            return equal if self.op == "==" else not equal
+        if self.op in ("~", "!~"):
+            contains = actual is not None and self.text in _as_text(actual)
+            return contains if self.op == "~" else not contains
+        return self._compare(actual)
+
+    def _compare(self: "Condition", actual: Any) -> bool:
+        compare = _ORDERINGS[self.op]
+        if _is_number(actual) and _is_number(self.value):
+            return compare(actual, self.value)
+        if actual is None:
+            return False
+        return compare(_as_text(actual), self.text)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _as_text(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def parse_select(select: str) -> List[str]:
+    """Parse --select's comma-separated field names
+
+    Raises:
+        ValueError: If no field names are given
+    """
+    fields = [field.strip() for field in select.split(",") if field.strip()]
+    if not fields:
+        raise ValueError(f"Invalid --select {select!r}: expected field1,field2,...")
+    return fields
+
+
+def where(records: Iterable[Any], conditions: Sequence[Condition]) -> Iterator[Any]:
+    """The records that match every condition"""
+    return (
+        record
+        for record in records
+        if all(condition(record) for condition in conditions)
+    )
+
+
+def select_fields(records: Iterable[Any], fields: Sequence[str]) -> Iterator[Any]:
+    """Each record with only fields, in that order.  Fields a record doesn't have are null.
+    Records that aren't objects are passed through as they are."""
+    return (
+        {field: record.get(field) for field in fields}
+        if isinstance(record, dict)
+        else record
+        for record in records
+    )
+
+
+def filter_response(
+    response: Any,
+    select: Optional[Sequence[str]] = None,
+    conditions: Optional[Sequence[Condition]] = None,
+) -> Any:
+    """Apply conditions and select to the records of a response (see output.response_records).
+
+    If the records are a list, the returned response's records are an iterator, which
+    output.write_output consumes.  A single object is filtered and projected right away, and
+    becomes None if it doesn't match.  Anything else is returned as it is.
+    """
+    if not select and not conditions:
+        return response
+    wrapped = isinstance(response, dict) and (
+        "ferry_output" in response or "ferry_status" in response
+    )
+    records = response.get("ferry_output") if wrapped else response
+    if isinstance(records, dict):
+        filtered: Any = next(
+            select_fields(where([records], conditions or []), select or list(records)),
+            None,
+        )
+    elif isinstance(records, (list, Iterator)):
+        filtered = where(records, conditions) if conditions else iter(records)
+        if select:
+            filtered = select_fields(filtered, select)
+    else:
+        return response
+    if wrapped and hasattr(response, "with_records"):
+        # A streamed response (see jsonstream), whose remaining keys are still to be read
+        return response.with_records(filtered)
+    if wrapped:
+        return {**response, "ferry_output": filtered}
+    return filtered
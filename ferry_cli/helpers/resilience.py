@@ -0,0 +1,181 @@
+"""Retry and circuit breaker policies for FERRY calls (see FerryAPI.call_endpoint)"""
+import threading
+import time
+from typing import Optional, Tuple
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "RetryPolicy",
+]
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# Responses worth retrying: throttling, and server errors that are usually transient
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses where FERRY (or a proxy in front of it) may tell us how long to wait
+RETRY_AFTER_STATUSES = (429, 503)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling FERRY while the circuit breaker is open"""
+
+
+class RetryPolicy:
+    """How GET calls are retried, and how long any call may take.
+
+    Only GETs are retried, since they are idempotent.  Waits grow exponentially with each
+    attempt, with full jitter so that concurrent callers don't retry in lockstep, unless the
+    response says how long to wait with a Retry-After header.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self: "RetryPolicy",
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: Optional[float] = DEFAULT_READ_TIMEOUT,
+    ) -> None:
+        """
+        Parameters:
+            retries (int): How many times to retry a failed GET.  0 disables retries
+            backoff (float): Base wait, in seconds.  The wait before retry n is up to backoff * 2**(n-1)
+            max_backoff (float): Longest wait, in seconds, including waits asked for with Retry-After
+            connect_timeout (Optional[float]): Seconds to wait for a connection.  None waits forever
+            read_timeout (Optional[float]): Seconds to wait for the response.  None waits forever
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    @property
+    def timeout(
+        self: "RetryPolicy",
+    ) -> Tuple[Optional[float], Optional[float]]:
+        """The timeout to pass to requests"""
+        return (self.connect_timeout, self.read_timeout)
+
+    def retryable(self: "RetryPolicy", method: str, attempt: int) -> bool:
+        """Whether a call that failed on attempt (counting from 1) may be tried again"""
+        return method.lower() == "get" and attempt <= self.retries
+
+    def delay(
+        self: "RetryPolicy",
+        attempt: int,
+        status: Optional[int] = None,
+        retry_after: Optional[str] = None,
+    ) -> float:
+        """How long to wait before retrying a call that failed on attempt (counting from 1)"""
+        # Only needed once something has failed, so keep it off the import path
+        import random  # pylint: disable=import-outside-toplevel
+
+        if retry_after and status in RETRY_AFTER_STATUSES:
+            requested = parse_retry_after(retry_after)
+            if requested is not None:
+                return min(requested, self.max_backoff)
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """Parse a Retry-After header, which is either a number of seconds or an HTTP date"""
+    # email.utils is slow to import, and only needed for the rare date form
+    from email.utils import (  # pylint: disable=import-outside-toplevel
+        parsedate_to_datetime,
+    )
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CircuitBreaker:
+    """Fails fast once FERRY looks unhealthy.
+
+    After failure_threshold consecutive server errors (5xx responses, connection failures or
+    timeouts), the breaker opens and calls raise CircuitOpenError without reaching FERRY.  After
+    reset_timeout seconds, one trial call is let through: if it succeeds the breaker closes,
+    otherwise it opens again.
+
+    One breaker is shared by all threads using a FerryAPI.
+    """
+
+    def __init__(
+        self: "CircuitBreaker",
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ) -> None:
+        """
+        Parameters:
+            failure_threshold (int): Consecutive server errors that open the breaker.  0 disables the breaker
+            reset_timeout (float): Seconds to stay open before letting a trial call through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self: "CircuitBreaker") -> bool:
+        return self.opened_at is not None
+
+    def before_call(self: "CircuitBreaker") -> bool:
+        """Check that a call may go ahead.
+
+        Returns:
+            Whether the call is the trial call of a breaker that has been open for reset_timeout.
+            A trial that ends without success or failure must be released (see release_trial)
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial_in_flight:
+                raise CircuitOpenError(
+                    f"FERRY has failed {self.failures} times in a row; not calling it for another "
+                    f"{max(remaining, 0):.0f}s"
+                )
+            self._trial_in_flight = True
+            return True
+
+    def release_trial(self: "CircuitBreaker") -> None:
+        """End a trial call that neither succeeded nor failed (e.g. it raised an error that says
+        nothing about FERRY's health), so that the next call is let through as the trial instead"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self: "CircuitBreaker") -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self: "CircuitBreaker") -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failure_threshold and (
+                self.opened_at is not None or self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
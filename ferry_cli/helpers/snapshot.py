@@ -0,0 +1,365 @@
+"""Local SQLite snapshot of FERRY's large collections (groups, users, compute resources, ...).
+
+`ferry-cli snapshot sync` downloads each collection from its list endpoint and stores the records,
+one row each, with the fields that lookups usually filter on copied into indexed columns.
+`ferry-cli query` and read-only workflows (e.g. getFilteredGroupInfo) then look records up locally,
+in microseconds, instead of downloading the whole collection again.
+
+Each sync replaces a collection in a single transaction, so readers see either the old records or
+the new ones.  Writes made through FerryAPI mark the collections they may have changed as stale (see
+invalidate), and workflows only use collections synced less than max_age seconds ago.
+"""
+import pathlib
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+try:
+    from ferry_cli.helpers import jsoncodec
+    from ferry_cli.helpers.records import Condition
+except ImportError:
+    from helpers import jsoncodec  # type: ignore
+    from helpers.records import Condition  # type: ignore
+
+if TYPE_CHECKING:
+    import sqlite3
+
+    try:
+        from ferry_cli.helpers.api import FerryAPI
+    except ImportError:
+        from helpers.api import FerryAPI  # type: ignore
+
+__all__ = [
+    "COLLECTIONS",
+    "Collection",
+    "DEFAULT_MAX_AGE",
+    "Snapshot",
+    "SnapshotError",
+]
+
+
+class Collection(NamedTuple):
+    """A FERRY collection that can be snapshotted"""
+
+    # The GET endpoint that returns every record
+    endpoint: str
+    # Record fields copied into their own indexed columns, so equality lookups on them don't scan
+    indexed: Tuple[str, ...]
+
+
+COLLECTIONS: Dict[str, Collection] = {
+    "groups": Collection("getAllGroups", ("groupname", "gid", "grouptype")),
+    "users": Collection("getAllUsers", ("username", "uid", "status")),
+    "computeresources": Collection(
+        "getAllComputeResources", ("resourcename", "unitname", "resourcetype")
+    ),
+    "units": Collection("getAllAffiliationUnits", ("unitname", "unitid")),
+    "capabilitysets": Collection("getCapabilitySet", ("setname",)),
+}
+
+# Workflows use a collection's snapshot if it was synced less than this many seconds ago.  This can
+# be overridden in the [snapshot] section of the config file; 0 means workflows never use it.
+DEFAULT_MAX_AGE = 3600.0
+
+# How many rows to read from SQLite at a time while a query's records are iterated over
+_FETCH_BATCH = 512
+
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_meta (
+    collection TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    records INTEGER NOT NULL,
+    identity TEXT NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+class SnapshotError(Exception):
+    """A collection is unknown, hasn't been synced, or couldn't be synced"""
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_value(value: Any) -> Any:
+    """value as stored in (or compared against) an indexed column"""
+    if value is None or isinstance(value, (str, float)):
+        return value
+    if isinstance(value, int):
+        # SQLite integers are 64-bit
+        return value if -(2**63) <= value < 2**63 else str(value)
+    return jsoncodec.dumps_compact(value).decode()
+
+
+class Snapshot:
+    def __init__(
+        self: "Snapshot",
+        path: pathlib.Path,
+        max_age: float = DEFAULT_MAX_AGE,
+        identity: str = "",
+    ) -> None:
+        """
+        Parameters:
+            path (pathlib.Path): The SQLite database file.  It is created on the first sync
+            max_age (float): How old, in seconds, a collection's snapshot can be for is_fresh
+            identity (str): Identifies the credentials in use (see Auth.identity).  FERRY's responses
+                can depend on who is asking, so is_fresh only trusts collections synced with these credentials
+        """
+        self.path = pathlib.Path(path)
+        self.max_age = max_age
+        self.identity = identity
+        self._db: Optional["sqlite3.Connection"] = None
+        self._lock = threading.Lock()
+
+    def _connect(self: "Snapshot") -> "sqlite3.Connection":
+        if self._db is None:
+            # Only snapshot commands and lookups need sqlite3, so keep it off the import path
+            import sqlite3  # pylint: disable=import-outside-toplevel
+
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            # Readers keep seeing the previous sync while a new one is being written
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                db.execute(_META_SCHEMA)
+                for name, collection in COLLECTIONS.items():
+                    columns = "".join(
+                        f", {_quote(field)}" for field in collection.indexed
+                    )
+                    db.execute(
+                        f"CREATE TABLE IF NOT EXISTS {_quote(name)} (data TEXT NOT NULL{columns})"
+                    )
+                    for field in collection.indexed:
+                        db.execute(
+                            f"CREATE INDEX IF NOT EXISTS {_quote(f'{name}_{field}')} "
+                            f"ON {_quote(name)} ({_quote(field)})"
+                        )
+            self._db = db
+        return self._db
+
+    def close(self: "Snapshot") -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def collection(name: str) -> Collection:
+        """
+        Raises:
+            SnapshotError: If name isn't one of COLLECTIONS
+        """
+        try:
+            return COLLECTIONS[name]
+        except KeyError:
+            raise SnapshotError(  # pylint: disable=raise-missing-from
+                f"Unknown collection {name!r}; choose from {', '.join(COLLECTIONS)}"
+            )
+
+    def sync(self: "Snapshot", api: "FerryAPI", name: str) -> int:
+        """Download a collection and replace its snapshot.  The records are streamed from FERRY
+        straight into the database, so they are never all held in memory.
+
+        Returns:
+            The number of records stored (0 for a dry run, which stores nothing)
+
+        Raises:
+            SnapshotError: If FERRY's response was unsuccessful or invalid.  The previous snapshot of
+                the collection is kept.
+        """
+        collection = self.collection(name)
+        response = api.call_endpoint(collection.endpoint, use_cache=False, stream=True)
+        if api.dryrun:
+            return 0
+        if not isinstance(response, dict):
+            raise SnapshotError(f"{collection.endpoint} returned an invalid response")
+        records = response.get("ferry_output")
+        if isinstance(records, dict):
+            records = [records]
+        elif not isinstance(records, (list, Iterator)):
+            records = []
+
+        count = 0
+
+        def rows() -> Iterator[List[Any]]:
+            nonlocal count
+            for record in records:
+                count += 1
+                fields = record if isinstance(record, dict) else {}
+                yield [jsoncodec.dumps_compact(record).decode()] + [
+                    _column_value(fields.get(field)) for field in collection.indexed
+                ]
+
+        columns = ", ".join(["data"] + [_quote(field) for field in collection.indexed])
+        placeholders = ", ".join("?" * (len(collection.indexed) + 1))
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    db.execute(f"DELETE FROM {_quote(name)}")
+                    db.executemany(
+                        f"INSERT INTO {_quote(name)} ({columns}) VALUES ({placeholders})",
+                        rows(),
+                    )
+                    tail = getattr(response, "tail", {})
+                    status = response.get("ferry_status", tail.get("ferry_status"))
+                    if status != "success":
+                        errors = response.get("ferry_error", tail.get("ferry_error"))
+                        raise SnapshotError(
+                            f"{collection.endpoint} failed: {', '.join(map(str, errors or [])) or status}"
+                        )
+                    db.execute(
+                        "INSERT OR REPLACE INTO snapshot_meta "
+                        "(collection, endpoint, synced_at, records, identity, stale) VALUES (?, ?, ?, ?, ?, 0)",
+                        (name, collection.endpoint, time.time(), count, self.identity),
+                    )
+            except ValueError as e:
+                # An invalid streamed response
+                raise SnapshotError(f"{collection.endpoint}: {e}") from e
+            finally:
+                if isinstance(records, Iterator) and hasattr(records, "close"):
+                    records.close()
+        return count
+
+    def status(self: "Snapshot") -> List[Dict[str, Any]]:
+        """When each synced collection was synced, how many records it has, and whether it's stale"""
+        if not self.path.exists():
+            return []
+        now = time.time()
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT collection, endpoint, synced_at, records, identity, stale "
+                    "FROM snapshot_meta ORDER BY collection"
+                )
+                .fetchall()
+            )
+        return [
+            {
+                "collection": name,
+                "endpoint": endpoint,
+                "records": records,
+                "synced_at": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S%z", time.localtime(synced_at)
+                ),
+                "age_seconds": round(now - synced_at),
+                "stale": bool(stale) or identity != self.identity,
+            }
+            for name, endpoint, synced_at, records, identity, stale in rows
+        ]
+
+    def age(self: "Snapshot", name: str) -> Optional[float]:
+        """Seconds since the collection was synced with our credentials, or None if it hasn't been
+        (or a write has made it stale since)"""
+        self.collection(name)
+        if not self.path.exists():
+            return None
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT synced_at FROM snapshot_meta "
+                    "WHERE collection = ? AND identity = ? AND NOT stale",
+                    (name, self.identity),
+                )
+                .fetchone()
+            )
+        return None if row is None else time.time() - row[0]
+
+    def is_fresh(self: "Snapshot", name: str) -> bool:
+        """Whether the collection's snapshot is recent enough for workflows to use instead of FERRY"""
+        if self.max_age <= 0:
+            return False
+        age = self.age(name)
+        return age is not None and age <= self.max_age
+
+    def query(
+        self: "Snapshot", name: str, conditions: Sequence[Condition] = ()
+    ) -> Iterator[Any]:
+        """The collection's records that match every condition, read as they are iterated over.
+
+        Equality conditions on indexed fields are looked up in their indexes.  Every condition is
+        then checked on the records themselves, so the results are exactly those --where would give.
+
+        Raises:
+            SnapshotError: If the collection has never been synced
+        """
+        collection = self.collection(name)
+        clauses: List[str] = []
+        params: List[Any] = []
+        for condition in conditions:
+            if condition.op != "==" or condition.field not in collection.indexed:
+                continue
+            if isinstance(condition.value, (dict, list)):
+                # Stored as compact JSON, which the condition's text needn't match
+                continue
+            # A condition matches either its JSON value or its text as-is (see Condition)
+            values = {_column_value(condition.value), condition.text}
+            column = _quote(condition.field)
+            clause = f"{column} IN ({', '.join('?' * len(values - {None}))})"
+            if None in values:
+                clause = f"({clause} OR {column} IS NULL)"
+            clauses.append(clause)
+            params.extend(values - {None})
+
+        with self._lock:
+            if not self.path.exists() or (
+                self._connect()
+                .execute("SELECT 1 FROM snapshot_meta WHERE collection = ?", (name,))
+                .fetchone()
+                is None
+            ):
+                raise SnapshotError(
+                    f"{name} has not been synced; run 'ferry-cli snapshot sync {name}' first"
+                )
+            cursor = self._connect().execute(
+                f"SELECT data FROM {_quote(name)}"
+                + (f" WHERE {' AND '.join(clauses)}" if clauses else "")
+                + " ORDER BY rowid",
+                params,
+            )
+        return self._matching(cursor, conditions)
+
+    def _matching(
+        self: "Snapshot", cursor: "sqlite3.Cursor", conditions: Sequence[Condition]
+    ) -> Iterator[Any]:
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(_FETCH_BATCH)
+            if not rows:
+                return
+            for (data,) in rows:
+                record = jsoncodec.loads(data)
+                if all(condition(record) for condition in conditions):
+                    yield record
+
+    def invalidate(self: "Snapshot", related_reads: Optional[Iterable[str]]) -> None:
+        """Mark the collections read from related_reads as stale, after a write to FERRY that may have
+        changed them.  If related_reads is None, the write is unknown, and every collection is marked."""
+        if not self.path.exists():
+            return
+        with self._lock:
+            db = self._connect()
+            with db:
+                if related_reads is None:
+                    db.execute("UPDATE snapshot_meta SET stale = 1")
+                else:
+                    db.executemany(
+                        "UPDATE snapshot_meta SET stale = 1 WHERE endpoint = ?",
+                        [(endpoint,) for endpoint in related_reads],
+                    )
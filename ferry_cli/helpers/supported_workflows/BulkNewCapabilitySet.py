@@ -0,0 +1,449 @@
+# pylint: disable=invalid-name,arguments-differ,unused-import
+import csv
+import io
+import json
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, TextIO, Tuple
+
+try:
+    from ferry_cli.helpers.api import FerryAPI
+    from ferry_cli.helpers.auth import DebugLevel
+    from ferry_cli.helpers.supported_workflows.NewCapabilitySet import (
+        FQAN_LOOKUP,
+        NewCapabilitySet,
+    )
+    from ferry_cli.helpers.workflows import PlannedCall, Step
+except ImportError:
+    from helpers.api import FerryAPI  # type: ignore
+    from helpers.auth import DebugLevel  # type: ignore
+    from helpers.supported_workflows.NewCapabilitySet import (  # type: ignore
+        FQAN_LOOKUP,
+        NewCapabilitySet,
+    )
+    from helpers.workflows import PlannedCall, Step  # type: ignore
+
+REQUIRED_FIELDS = ("groupname", "gid", "unitname", "fqan", "setname", "scopes_pattern")
+OPTIONAL_FIELDS = ("mapped_user", "token_subject")
+FORMATS = ("csv", "jsonl")
+# The checks (see BulkNewCapabilitySet._verify_row) that have to pass before each write, as they
+# do in newCapabilitySet: the group is checked before anything is added to it, and the group's
+# unit and members before the FQAN and capability set are made.  All of them, and the capability
+# set's, are made after the row's last write
+_GROUP_CHECKS = ("checkGroup", "checkGroupUnit", "checkGroupMembers")
+_CHECKS_BEFORE = {
+    "addGroupToUnit": ("checkGroup",),
+    "addUserToGroup": ("checkGroup",),
+    "createFQAN": _GROUP_CHECKS,
+    "createCapabilitySet": _GROUP_CHECKS,
+    "addCapabilitySetToFQAN": _GROUP_CHECKS,
+}
+
+
+class CapabilitySetRow(NamedTuple):
+    # The line of the input file the row ends on
+    line: int
+    # newCapabilitySet's arguments
+    args: Dict[str, str]
+    role: str
+
+
+def read_rows(source: TextIO, fmt: str = "") -> List[Tuple[int, Dict[str, Any]]]:
+    """Read the rows of a CSV file (with a header row) or JSONL file, as (line, row).  Blank lines
+    are skipped.  Without fmt, JSONL is assumed if the first row starts with "{".
+
+    Raises:
+        ValueError: If the file can't be read as fmt.  All invalid lines are reported at once.
+    """
+    text = source.read()
+    if not fmt:
+        fmt = "jsonl" if text.lstrip().startswith("{") else "csv"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}: expected one of {', '.join(FORMATS)}")
+    rows: List[Tuple[int, Dict[str, Any]]] = []
+    errors: List[str] = []
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            if None in record:
+                errors.append(f"line {reader.line_num}: More values than columns")
+            elif any((value or "").strip() for value in record.values()):
+                rows.append((reader.line_num, record))
+    else:
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                errors.append(f"line {line_number}: Invalid JSON: {e}")
+                continue
+            if not isinstance(record, dict):
+                errors.append(f"line {line_number}: Expected a JSON object")
+                continue
+            rows.append((line_number, record))
+    if errors:
+        raise ValueError("Invalid capability set rows:\n" + "\n".join(errors))
+    return rows
+
+
+def _check_row(record: Dict[str, Any]) -> Tuple[Dict[str, str], str, List[str]]:
+    """Return a row's newCapabilitySet arguments, its role, and what's wrong with it"""
+    args = {
+        str(name): str(value).strip()
+        for name, value in record.items()
+        if value is not None and str(value).strip()
+    }
+    errors: List[str] = []
+    unknown = sorted(set(record) - set(REQUIRED_FIELDS) - set(OPTIONAL_FIELDS))
+    if unknown:
+        errors.append(f"Unknown field(s) {', '.join(map(str, unknown))}")
+    missing = [name for name in REQUIRED_FIELDS if name not in args]
+    if missing:
+        errors.append(f"Missing {', '.join(missing)}")
+    if "gid" in args:
+        try:
+            args["gid"] = str(int(args["gid"]))
+        except ValueError:
+            errors.append(f"gid {args['gid']} is not an integer")
+            # So it isn't compared with other rows' gids
+            del args["gid"]
+    role = NewCapabilitySet._calculate_role(  # pylint: disable=protected-access
+        args.get("fqan", "")
+    )
+    if "fqan" in args and not role:
+        errors.append(f"Can't calculate a role from FQAN {args['fqan']}")
+    scopes = NewCapabilitySet.scopes_string_to_list(args.get("scopes_pattern", ""))
+    if any(not scope.strip() for scope in scopes):
+        errors.append(f"scopes_pattern {args['scopes_pattern']} has an empty scope")
+    return args, role, errors
+
+
+def _describe_mapping(mapping: Tuple[str, str, str]) -> str:
+    groupname, unitname, mapped_user = mapping
+    described = f"group {groupname} in unit {unitname}"
+    return f"{described} with user {mapped_user}" if mapped_user else described
+
+
+def validate_rows(  # pylint: disable=too-many-locals
+    records: List[Tuple[int, Dict[str, Any]]]
+) -> List[CapabilitySetRow]:
+    """Check every row locally, before anything is read from or written to FERRY: the fields are
+    known and the required ones present, gids are integers, each FQAN has a role and each scopes
+    pattern is a list of scopes.  Rows mustn't contradict each other either: each capability set is
+    defined once, a group has the same gid on every row, and an FQAN is mapped to the same group,
+    unit and user on every row.
+
+    Raises:
+        ValueError: If any row is invalid.  All of them are reported at once.
+    """
+    rows: List[CapabilitySetRow] = []
+    errors: List[str] = []
+    setname_lines: Dict[str, int] = {}
+    # The first line each gid and groupname appear on, and what they appear with there
+    gids: Dict[str, Tuple[int, str]] = {}
+    groupnames: Dict[str, Tuple[int, str]] = {}
+    # The first line each FQAN appears on, and the group, unit and user it's mapped to there
+    fqans: Dict[str, Tuple[int, Tuple[str, str, str]]] = {}
+    for line, record in records:
+        args, role, row_errors = _check_row(record)
+        setname = args.get("setname", "")
+        if setname in setname_lines:
+            row_errors.append(
+                f"Capability set {setname} is also defined on line {setname_lines[setname]}"
+            )
+        elif setname:
+            setname_lines[setname] = line
+        gid, groupname = args.get("gid", ""), args.get("groupname", "")
+        if gid and groupname:
+            first_line, other = gids.setdefault(gid, (line, groupname))
+            if other != groupname:
+                row_errors.append(
+                    f"gid {gid} is for group {other} on line {first_line}, not {groupname}"
+                )
+            first_line, other = groupnames.setdefault(groupname, (line, gid))
+            if other != gid:
+                row_errors.append(
+                    f"Group {groupname} has gid {other} on line {first_line}, not {gid}"
+                )
+        fqan = args.get("fqan", "")
+        if fqan:
+            mapping = (groupname, args.get("unitname", ""), args.get("mapped_user", ""))
+            first_line, other_mapping = fqans.setdefault(fqan, (line, mapping))
+            if other_mapping != mapping:
+                row_errors.append(
+                    f"FQAN {fqan} is mapped to {_describe_mapping(other_mapping)} on line "
+                    f"{first_line}, not {_describe_mapping(mapping)}"
+                )
+        errors += [f"line {line}: {error}" for error in row_errors]
+        rows.append(CapabilitySetRow(line, args, role))
+    if errors:
+        raise ValueError("Invalid capability set rows:\n" + "\n".join(errors))
+    return rows
+
+
+class BulkNewCapabilitySet(NewCapabilitySet):
+    def __init__(self: "BulkNewCapabilitySet") -> None:
+        super().__init__()
+        self.name = "bulkNewCapabilitySet"
+        self.description = "Creates many capability sets, as newCapabilitySet does, from a CSV or JSONL file"
+        self.params = [
+            {
+                "name": "file",
+                "description": (
+                    "CSV file (with a header row) or JSONL file of the capability sets to create, one per row, "
+                    + "with newCapabilitySet's parameters as its columns or keys.  "
+                    + '"-" reads the file from stdin'
+                ),
+                "type": "string",
+                "required": True,
+            },
+            {
+                "name": "input_format",
+                "description": "csv or jsonl.  Defaults to the file's extension, or is guessed from its contents",
+                "type": "string",
+                "required": False,
+            },
+        ]
+        # Writes and checks that rows have in common (e.g. creating a group that several capability
+        # sets use) are made once, by the first row that needs them, and the other rows wait for it
+        self._calls: Dict[str, "Future[None]"] = {}
+        self._calls_lock = threading.Lock()
+        self.init_parser()
+
+    def run(self: "BulkNewCapabilitySet", api: "FerryAPI", args: Any) -> Any:
+        """Create every capability set in the file.
+
+        All rows are checked locally first (see validate_rows), and nothing is done if any are
+        invalid.  Then the state every row needs is read from FERRY once, and the rows run at the
+        same time, up to --concurrency at once, each making only the writes it still needs (as
+        --reconcile does), then checking them as newCapabilitySet does.  A row that fails doesn't
+        stop the others.
+
+        Returns:
+            A report of each row: its line, setname, status ("created", "up to date" or "failed"),
+            the writes it made and the error it failed with
+        """
+        rows = self._load_rows(args)
+        if api.dryrun:
+            print(
+                "WARNING:  This workflow is being run with the --dryrun flag.  Since nothing is read from FERRY, "
+                "every write is shown for every row."
+            )
+        states = self._prefetch(api, rows)
+        self._calls = {}
+        self.failures = 0
+        if api.dryrun or self.concurrency <= 1:
+            report = [
+                self._run_row(api, row, state) for row, state in zip(rows, states)
+            ]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="ferry-bulk"
+            ) as executor:
+                report = list(executor.map(partial(self._run_row, api), rows, states))
+        self.failures = sum(1 for entry in report if entry["status"] == "failed")
+        if api.debug_level != DebugLevel.QUIET and not api.dryrun:
+            updated = sum(1 for entry in report if entry["status"] == "created")
+            print(
+                f"{self.name}: {updated} created, {len(rows) - updated - self.failures} already up to date, "
+                f"{self.failures} failed, of {len(rows)} capability sets"
+            )
+            for entry in report:
+                if entry["status"] == "failed":
+                    print(
+                        f"  line {entry['line']} ({entry['setname']}): {entry['error']}"
+                    )
+        return report
+
+    def plan(
+        self: "BulkNewCapabilitySet", api: "FerryAPI", args: Any
+    ) -> List[PlannedCall]:
+        """The writes every row needs, each once
+
+        Raises:
+            ValueError: If any row conflicts with the current state in FERRY (see NewCapabilitySet.plan)
+        """
+        rows = self._load_rows(args)
+        calls: Dict[str, PlannedCall] = {}
+        errors: List[str] = []
+        for row, state in zip(rows, self._prefetch(api, rows)):
+            try:
+                for call in self._plan_calls(row.args, row.role, state):
+                    calls.setdefault(self._call_key(call), call)
+            except ValueError as e:
+                errors.append(f"line {row.line}: {e}")
+        if errors:
+            raise ValueError(
+                "Capability set rows conflict with FERRY:\n" + "\n".join(errors)
+            )
+        return list(calls.values())
+
+    def reconcile(self: "BulkNewCapabilitySet", api: "FerryAPI", args: Any) -> Any:
+        """run already makes only the writes each row needs, so --reconcile is the same as run"""
+        if self.plan_only:
+            return [call.as_dict() for call in self.plan(api, args)]
+        return self.run(api, args)
+
+    def _load_rows(self: "BulkNewCapabilitySet", args: Any) -> List[CapabilitySetRow]:
+        path = args["file"]
+        fmt = (args.get("input_format") or "").lower()
+        if not fmt:
+            if path.endswith(".csv"):
+                fmt = "csv"
+            elif path.endswith((".jsonl", ".ndjson")):
+                fmt = "jsonl"
+        if path == "-":
+            rows = validate_rows(read_rows(sys.stdin, fmt))
+        else:
+            with open(path, encoding="utf-8", newline="") as f:
+                rows = validate_rows(read_rows(f, fmt))
+        if not rows:
+            raise ValueError(
+                f"No capability sets in {'stdin' if path == '-' else path}"
+            )
+        return rows
+
+    def _prefetch(
+        self: "BulkNewCapabilitySet", api: "FerryAPI", rows: List[CapabilitySetRow]
+    ) -> List[Dict[str, Any]]:
+        """Read the state every row needs from FERRY, all at once, and return each row's state
+        (see NewCapabilitySet._lookups).
+
+        Groups, capability sets and FQANs are read whole, with one call each, rather than one call
+        per row.  Each group's units and members are read once, however many rows use the group.
+        """
+        steps = {
+            "groups": Step("groups", self._reader(api, "getAllGroups", {})),
+            "capabilitySets": Step(
+                "capabilitySets", self._reader(api, "getCapabilitySet", {})
+            ),
+            "fqans": Step("fqans", self._reader(api, FQAN_LOOKUP, {})),
+        }
+        for row in rows:
+            for name, (endpoint, params) in self._lookups(row.args).items():
+                if name in ("units", "members"):
+                    key = f"{name}:{row.args['groupname']}"
+                    steps.setdefault(
+                        key, Step(key, self._reader(api, endpoint, params))
+                    )
+        state = self.run_steps(api, list(steps.values()))
+        groups = {
+            str(group.get("gid")): group
+            for group in state["groups"] or []
+            if group.get("grouptype", "UnixGroup") == "UnixGroup"
+        }
+        capability_sets = {
+            capability_set.get("setname"): capability_set
+            for capability_set in state["capabilitySets"] or []
+        }
+        states: List[Dict[str, Any]] = []
+        for row in rows:
+            group = groups.get(row.args["gid"])
+            capability_set = capability_sets.get(row.args["setname"])
+            states.append(
+                {
+                    "group": group and {"groupname": group.get("groupname")},
+                    "units": state[f"units:{row.args['groupname']}"],
+                    "capabilitySet": capability_set and [capability_set],
+                    "members": state.get(f"members:{row.args['groupname']}"),
+                    "fqans": state["fqans"],
+                }
+            )
+        return states
+
+    def _run_row(
+        self: "BulkNewCapabilitySet",
+        api: "FerryAPI",
+        row: CapabilitySetRow,
+        state: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "line": row.line,
+            "setname": row.args["setname"],
+            "status": "",
+            "writes": [],
+            "error": "",
+        }
+        try:
+            for call in self._plan_calls(row.args, row.role, state):
+                if not api.dryrun:
+                    self._verify_row(api, row, _CHECKS_BEFORE.get(call.endpoint, ()))
+                self._call_once(api, call)
+                entry["writes"].append(call.endpoint)
+            if entry["writes"] and not api.dryrun:
+                self._verify_row(api, row, (*_GROUP_CHECKS, "checkCapabilitySet"))
+        except Exception as e:  # pylint: disable=broad-except
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        else:
+            entry["status"] = "created" if entry["writes"] else "up to date"
+        if api.debug_level == DebugLevel.DEBUG:
+            print(f"line {row.line} ({row.args['setname']}): {entry['status']}")
+        return entry
+
+    @staticmethod
+    def _call_key(call: PlannedCall) -> str:
+        return json.dumps([call.endpoint, call.params], sort_keys=True, default=str)
+
+    def _call_once(
+        self: "BulkNewCapabilitySet", api: "FerryAPI", call: PlannedCall
+    ) -> None:
+        """Make call, unless another row already has (or the journal records it was made by an
+        earlier attempt at this run).  Raises the call's error, if it failed, in every row that needs it.
+        """
+
+        def make_call() -> None:
+            if (
+                self.journal is None
+                or self.journal.completed(call.endpoint, call.params) is None
+            ):
+                result = self._make_call(api, call, {})
+                if self.journal is not None and not api.dryrun:
+                    self.journal.record(call.endpoint, result, call.params)
+
+        self._once(self._call_key(call), make_call)
+
+    def _verify_row(
+        self: "BulkNewCapabilitySet",
+        api: "FerryAPI",
+        row: CapabilitySetRow,
+        names: Sequence[str],
+    ) -> None:
+        """Make the named checks of the row's writes, with newCapabilitySet's checks.  Each check of
+        a group is made once, however many rows use the group and however often it's needed."""
+        args = row.args
+        # Each check, with what it checks, as the key it's made once by
+        checks = {
+            "checkGroup": ([args["gid"], args["groupname"]], self._check_group),
+            "checkGroupUnit": ([args["groupname"], args["unitname"]], self._check_group_unit),
+        }  # fmt: skip
+        if args.get("mapped_user"):
+            checks["checkGroupMembers"] = (
+                [args["groupname"], args["mapped_user"]],
+                self._check_group_members,
+            )
+        for name in names:
+            if name == "checkCapabilitySet":
+                self._check_capability_set(api, args, row.role, {})
+            elif name in checks:
+                checked, check = checks[name]
+                self._once(json.dumps([name, *checked]), partial(check, api, args, {}))
+
+    def _once(self: "BulkNewCapabilitySet", key: str, func: Callable[[], None]) -> None:
+        """Call func, unless another row already has with the same key.  Raises func's error, if it
+        failed, in every row that needs it."""
+        with self._calls_lock:
+            future = self._calls.get(key)
+            first = future is None
+            if future is None:
+                future = self._calls[key] = Future()
+        if first:
+            try:
+                func()
+                future.set_result(None)
+            except Exception as e:  # pylint: disable=broad-except
+                future.set_exception(e)
+        future.result()
@@ -1,15 +1,17 @@
 # pylint: disable=invalid-name,arguments-differ,unused-import
+import json
 import sys
-from typing import Any, Dict
+from functools import partial
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
 
 try:
     from ferry_cli.helpers.api import FerryAPI
     from ferry_cli.helpers.auth import DebugLevel
-    from ferry_cli.helpers.workflows import Workflow
+    from ferry_cli.helpers.workflows import PlannedCall, Step, Workflow
 except ImportError:
     from helpers.api import FerryAPI  # type: ignore
     from helpers.auth import DebugLevel  # type: ignore
-    from helpers.workflows import Workflow  # type: ignore
+    from helpers.workflows import PlannedCall, Step, Workflow  # type: ignore
 
 
 class CloneResource(Workflow):
@@ -39,102 +41,347 @@ class CloneResource(Workflow):
         ]
         super().__init__()
 
-    def run(self: "CloneResource", api: "FerryAPI", args: Any) -> Any:  # type: ignore # pylint: disable=arguments-differ,too-many-branches
+    def run(self: "CloneResource", api: "FerryAPI", args: Any) -> Any:  # type: ignore # pylint: disable=arguments-differ
         # Get all compute resources and filter out the resource to be cloned, and the cloned resource - if it already exists
         if api.dryrun:
             print(
                 "WARNING:  This workflow is being run with the --dryrun flag.  The exact steps shown here may differ since "
                 "some of the workflow steps depend on the output of API calls."
             )
-        try:
-            resources = {
-                resource["resourcename"]: resource
-                for resource in self.verify_output(
-                    api, api.call_endpoint("getAllComputeResources")
-                )
-                if resource.get("resourcename", "")
-                in [args["clone"], args["new_resource"]]
-            }
-            if not api.dryrun:
-                print(resources)
-            # Verify that resource to be cloned exists
-            if args["clone"] not in resources and not api.dryrun:
-                raise ValueError("Resource to be cloned does not exist")
-
-            # If the clone doesnt exist, create a resource with the same details, just changing the provided name
-            cloned_resource_data: Dict[Any, Any] = {}
-            if not api.dryrun:
-                cloned_resource_data = dict(resources[args["clone"]])
-            cloned_resource_data["resourcename"] = args["new_resource"]
-            if not api.dryrun:
-                print(cloned_resource_data)
-            if args["new_resource"] not in resources:
-                print(
-                    f"New resource doesn't exist. Creating new resource with the same attributes as: {args['clone']}"
-                )
-                self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "createComputeResource",
-                        method="PUT",
-                        params=cloned_resource_data,
-                    ),
-                )
-            else:
-                # If the clone already exists, we will update its info
-                self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "setComputeResourceInfo",
-                        method="POST",
-                        params=cloned_resource_data,
-                    ),
-                )
+        self.run_steps(
+            api,
+            [
+                Step("resources", partial(self._get_resources, api, args)),
+                Step(
+                    "cloneResource",
+                    partial(self._clone_resource, api, args),
+                    needs=["resources"],
+                    write=True,
+                ),
+                # Doesn't depend on the resources, so it's fetched alongside them
+                Step("userGroups", partial(self._get_user_groups, api, args)),
+                Step(
+                    "userAccess",
+                    partial(self._copy_user_access, api, args),
+                    needs=["cloneResource", "userGroups"],
+                    write=True,
+                ),
+            ],
+        )
+        if api.debug_level != DebugLevel.QUIET:
+            print(
+                f"Resource '{args['clone']}' has been successful cloned as '{args['new_resource']}'"
+            )
+        sys.exit(0)
+
+    def _get_resources(
+        self: "CloneResource", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        resources = {
+            resource["resourcename"]: resource
+            for resource in self.verify_output(
+                api, api.call_endpoint("getAllComputeResources")
+            )
+            if resource.get("resourcename", "") in [args["clone"], args["new_resource"]]
+        }
+        if not api.dryrun:
+            print(resources)
+        # Verify that resource to be cloned exists
+        if args["clone"] not in resources and not api.dryrun:
+            raise ValueError("Resource to be cloned does not exist")
+        return resources
 
-            # Now we will get all user groups, and filter for the original resource
-            group_json = self.verify_output(
+    def _clone_resource(
+        self: "CloneResource", api: "FerryAPI", args: Any, results: Dict[str, Any]
+    ) -> None:
+        resources = results["resources"]
+        # If the clone doesnt exist, create a resource with the same details, just changing the provided name
+        cloned_resource_data: Dict[Any, Any] = {}
+        if not api.dryrun:
+            cloned_resource_data = dict(resources[args["clone"]])
+        cloned_resource_data["resourcename"] = args["new_resource"]
+        if not api.dryrun:
+            print(cloned_resource_data)
+        if args["new_resource"] not in resources:
+            print(
+                f"New resource doesn't exist. Creating new resource with the same attributes as: {args['clone']}"
+            )
+            self.verify_output(
+                api,
+                api.call_endpoint(
+                    "createComputeResource",
+                    method="PUT",
+                    params=cloned_resource_data,
+                ),
+            )
+        else:
+            # If the clone already exists, we will update its info
+            self.verify_output(
                 api,
                 api.call_endpoint(
-                    "getUserGroupsForComputeResource",
-                    method="GET",
-                    params={"unitname": args["unitname"]},
+                    "setComputeResourceInfo",
+                    method="POST",
+                    params=cloned_resource_data,
                 ),
             )
+
+    def _get_user_groups(
+        self: "CloneResource", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> Any:
+        # Now we will get all user groups, and filter for the original resource
+        return self.verify_output(
+            api,
+            api.call_endpoint(
+                "getUserGroupsForComputeResource",
+                method="GET",
+                params={"unitname": args["unitname"]},
+            ),
+        )
+
+    def _copy_user_access(
+        self: "CloneResource", api: "FerryAPI", args: Any, results: Dict[str, Any]
+    ) -> None:
+        group_json = results["userGroups"]
+        if api.dryrun:
+            print(
+                "Dryrun: Since no API was actually run, we cannot simulate adding users from the cloned resource to the new resource"
+            )
+        else:
+            if api.debug_level != DebugLevel.QUIET:
+                print(f"Received response, searching for resource: {args['clone']}")
+        resources = [
+            resource
+            for resource in group_json
+            if resource.get("resourcename", "") == args["clone"]
+        ]
+        # Give each user from the original resource the same access to the new resource
+        updates: List[Dict[str, Any]] = []
+        for resource in resources:
+            if api.debug_level != DebugLevel.QUIET:
+                print("Found Resources")
+                print(resource)
+            for user in resource.get("users", []):
+                user_access_data = dict(user)
+                user_access_data["resourcename"] = args["new_resource"]
+                if "status" in user_access_data:
+                    del user_access_data["status"]
+                updates.append(user_access_data)
+        if updates:
+            self._update_user_access(api, args["new_resource"], updates)
+
+    def _update_user_access(
+        self: "CloneResource",
+        api: "FerryAPI",
+        new_resource: str,
+        updates: List[Dict[str, Any]],
+    ) -> None:
+        """Make the updates (see _set_user_access), then summarize them
+
+        Raises:
+            RuntimeError: If any of them failed
+        """
+        failures = self._set_user_access(api, updates)
+        if api.dryrun:
+            return
+        if api.debug_level != DebugLevel.QUIET:
+            print(
+                f"Updated access to {new_resource} for {len(updates) - len(failures)} of {len(updates)} users"
+            )
+            for username, error in failures:
+                print(f"  Failed to update access for {username}: {error}")
+        if failures:
+            usernames = ", ".join(username for username, _ in failures[:10])
+            raise RuntimeError(
+                f"Failed to update access to {new_resource} for {len(failures)} of {len(updates)} users: "
+                + (usernames if len(failures) <= 10 else f"{usernames}, ...")
+            )
+
+    def plan(self: "CloneResource", api: "FerryAPI", args: Any) -> List[PlannedCall]:
+        """Read the compute resources and the unit's user access once, and plan only the writes
+        whose data differs from the resource being cloned: the new resource if it's missing or its
+        attributes differ, and the access of each user who doesn't have the same access to it yet"""
+        state = self.run_steps(
+            api,
+            [
+                Step(
+                    "resources",
+                    lambda _: self.read_state(api, "getAllComputeResources", {}),
+                ),
+                Step(
+                    "userGroups",
+                    lambda _: self.read_state(
+                        api,
+                        "getUserGroupsForComputeResource",
+                        {"unitname": args["unitname"]},
+                    ),
+                ),
+            ],
+        )
+        resources = {
+            resource["resourcename"]: resource
+            for resource in state["resources"] or []
+            if resource.get("resourcename", "") in [args["clone"], args["new_resource"]]
+        }
+        if args["clone"] not in resources:
             if api.dryrun:
-                print(
-                    "Dryrun: Since no API was actually run, we cannot simulate adding users from the cloned resource to the new resource"
+                return []
+            raise ValueError("Resource to be cloned does not exist")
+
+        calls: List[PlannedCall] = []
+        cloned_resource_data = dict(resources[args["clone"]])
+        cloned_resource_data["resourcename"] = args["new_resource"]
+        existing = resources.get(args["new_resource"])
+        if existing is None:
+            calls.append(
+                PlannedCall(
+                    "resource", "createComputeResource", "PUT", cloned_resource_data
                 )
-            else:
-                if api.debug_level != DebugLevel.QUIET:
-                    print(f"Received response, searching for resource: {args['clone']}")
-            resources = [resource for resource in group_json if resource.get("resourcename", "") == args["clone"]]  # type: ignore
-            if resources:
-                # Add each user from the original resource into the new resource with the same configurations
-                for resource in resources:
-                    if api.debug_level != DebugLevel.QUIET:
-                        print("Found Resources")
-                        print(resource)
-                    for user in resource.get("users", []):
-                        user_access_data = dict(user)
-                        user_access_data["resourcename"] = args["new_resource"]
-                        if api.debug_level != DebugLevel.QUIET:
-                            print(
-                                f"Updating user access to {args['new_resource']} for {user['username']}"
-                            )
-                        if "status" in user_access_data:
-                            del user_access_data["status"]
-                        self.verify_output(
-                            api,
-                            api.call_endpoint(
-                                "setUserAccessToComputeResource",
-                                method="PUT",
-                                params=user_access_data,
-                            ),
-                        )
-            if api.debug_level != DebugLevel.QUIET:
+            )
+        elif any(
+            existing.get(key) != value for key, value in cloned_resource_data.items()
+        ):
+            calls.append(
+                PlannedCall(
+                    "resource", "setComputeResourceInfo", "POST", cloned_resource_data
+                )
+            )
+
+        user_groups = state["userGroups"] or []
+        current = {
+            json.dumps(access, sort_keys=True, default=str)
+            for access in self._user_access(
+                user_groups, args["new_resource"], args["new_resource"]
+            )
+        }
+        for access in self._user_access(
+            user_groups, args["clone"], args["new_resource"]
+        ):
+            key = json.dumps(access, sort_keys=True, default=str)
+            if key not in current:
+                # Also skips duplicates, where a user has the same access through several groups
+                current.add(key)
+                calls.append(
+                    PlannedCall(
+                        f"setUserAccessToComputeResource:{len(calls)}",
+                        "setUserAccessToComputeResource",
+                        "PUT",
+                        access,
+                        needs=("resource",),
+                    )
+                )
+        return calls
+
+    @staticmethod
+    def _user_access(
+        user_groups: List[Dict[str, Any]], resourcename: str, new_resource: str
+    ) -> Iterator[Dict[str, Any]]:
+        """The access of each user of resourcename, as setUserAccessToComputeResource params for
+        new_resource"""
+        for resource in user_groups:
+            if resource.get("resourcename", "") != resourcename:
+                continue
+            for user in resource.get("users", []):
+                user_access_data = dict(user)
+                user_access_data["resourcename"] = new_resource
+                user_access_data.pop("status", None)
+                yield user_access_data
+
+    def apply_plan(
+        self: "CloneResource", api: "FerryAPI", calls: Sequence[PlannedCall]
+    ) -> None:
+        """Write the resource, then update user access concurrently (see _set_user_access)"""
+        user_calls = [
+            call for call in calls if call.endpoint == "setUserAccessToComputeResource"
+        ]
+        other_calls = [call for call in calls if call not in user_calls]
+        if other_calls:
+            super().apply_plan(api, other_calls)
+        if user_calls:
+            self._update_user_access(
+                api,
+                user_calls[0].params["resourcename"],
+                [call.params for call in user_calls],
+            )
+
+    def _set_user_access(
+        self: "CloneResource", api: "FerryAPI", updates: List[Dict[str, Any]]
+    ) -> List[Tuple[str, str]]:
+        """Make each setUserAccessToComputeResource update, up to self.concurrency at a time,
+        reporting progress.  Failed updates don't stop the others.  Updates that the journal
+        records as made (by an earlier attempt at this run) are skipped.
+
+        Returns:
+            (username, error) for each update that failed
+        """
+        # asyncio is slow to import, so only this step pays for it
+        # pylint: disable=import-outside-toplevel
+        import asyncio
+
+        try:
+            from ferry_cli.helpers.async_api import AsyncFerryAPI
+        except ImportError:
+            from helpers.async_api import AsyncFerryAPI  # type: ignore
+
+        journal = self.journal
+        if journal is not None:
+            made = len(updates)
+            updates = [
+                update
+                for update in updates
+                if journal.completed("setUserAccessToComputeResource", update) is None
+            ]
+            made -= len(updates)
+            if made and api.debug_level != DebugLevel.QUIET:
                 print(
-                    f"Resource '{args['clone']}' has been successful cloned as '{args['new_resource']}'"
+                    f"Skipping {made} user access update(s) already made by run {journal.run_id}"
                 )
-            sys.exit(0)
-        except Exception as e:
-            raise e
+        calls: List[Dict[str, Any]] = [
+            {
+                "endpoint": "setUserAccessToComputeResource",
+                "method": "PUT",
+                "params": update,
+            }
+            for update in updates
+        ]
+        failures: List[Tuple[str, str]] = []
+        report = api.debug_level != DebugLevel.QUIET and not api.dryrun
+        # Report progress about every 10%
+        every = max(1, len(calls) // 10)
+
+        async def _run(async_api: AsyncFerryAPI) -> None:
+            done = 0
+            async for i, response, exception in async_api.iter_completed(calls):
+                done += 1
+                username = str(updates[i].get("username", f"#{i}"))
+                error = str(exception) if exception is not None else ""
+                if not error and not api.dryrun:
+                    if not response:
+                        error = "Empty response from FERRY"
+                    elif response.get("ferry_status", "") != "success":
+                        error = ", ".join(
+                            map(str, response.get("ferry_error") or [])
+                        ) or ("FERRY did not return a successful response")
+                if error:
+                    failures.append((username, error))
+                elif journal is not None and not api.dryrun:
+                    journal.record(
+                        "setUserAccessToComputeResource",
+                        response.get("ferry_output"),
+                        updates[i],
+                    )
+                if api.debug_level == DebugLevel.DEBUG:
+                    print(
+                        f"Updating user access to {updates[i]['resourcename']} for {username}: "
+                        + (error or "done")
+                    )
+                if report and (done % every == 0 or done == len(calls)):
+                    print(
+                        f"Updated access for {done} of {len(calls)} users ({len(failures)} failed)"
+                    )
+
+        async_api = AsyncFerryAPI.from_api(api, self.concurrency)
+        try:
+            asyncio.run(_run(async_api))
+        finally:
+            async_api.close()
+        return failures
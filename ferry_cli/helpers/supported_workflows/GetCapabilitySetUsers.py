@@ -0,0 +1,62 @@
+# pylint: disable=invalid-name,arguments-differ
+from typing import Any, Dict, List
+
+try:
+    from ferry_cli.helpers.api import FerryAPI  # pylint: disable=unused-import
+    from ferry_cli.helpers.auth import DebugLevel
+    from ferry_cli.helpers.membership import (
+        CAPABILITY_SET,
+        USER,
+        load_membership_graph,
+        split_names,
+    )
+    from ferry_cli.helpers.workflows import Workflow
+except ImportError:
+    from helpers.api import FerryAPI  # type: ignore # pylint: disable=unused-import
+    from helpers.auth import DebugLevel  # type: ignore
+    from helpers.membership import (  # type: ignore
+        CAPABILITY_SET,
+        USER,
+        load_membership_graph,
+        split_names,
+    )
+    from helpers.workflows import Workflow  # type: ignore
+
+
+class GetCapabilitySetUsers(Workflow):
+    makes_writes = False
+
+    def __init__(self: "GetCapabilitySetUsers") -> None:
+        self.name: str = "getCapabilitySetUsers"
+        self.method: str = "GET"
+        self.description: str = (
+            "Returns the users who can reach each capability set through their groups and those groups' affiliation units, with the groups and units that link them.  "
+            "Any number of names can be given: FERRY's membership data is downloaded once and indexed locally."
+        )
+        self.params: List[Dict[str, Any]] = [
+            {
+                "name": "setname",
+                "description": "Comma-separated capability set names",
+                "type": "string",
+                "required": True,
+            }
+        ]
+        super().__init__()
+
+    def run(
+        self: "GetCapabilitySetUsers", api: "FerryAPI", args: Any
+    ) -> Any:  # pylint: disable=arguments-differ
+        graph = load_membership_graph(api, self.concurrency)
+        if graph is None:
+            return []
+        # The results may be incomplete, so the CLI exits with status 1 after printing them
+        self.failures = len(graph.failed_groups)
+        results: List[Dict[str, Any]] = []
+        for name in split_names(args["setname"]):
+            if (
+                CAPABILITY_SET,
+                name,
+            ) not in graph and api.debug_level != DebugLevel.QUIET:
+                print(f"Capability set {name} was not found")
+            results.extend(graph.reachable(CAPABILITY_SET, name, USER))
+        return results
@@ -1,15 +1,20 @@
 # pylint: disable=invalid-name,arguments-differ
+import json
 from typing import Any, Dict, List
 
 try:
     from ferry_cli.helpers.auth import DebugLevel
+    from ferry_cli.helpers.records import Condition
     from ferry_cli.helpers.workflows import Workflow
 except ImportError:
     from helpers.auth import DebugLevel  # type: ignore
+    from helpers.records import Condition  # type: ignore
     from helpers.workflows import Workflow  # type: ignore
 
 
 class GetFilteredGroupInfo(Workflow):
+    makes_writes = False
+
     def __init__(self: "GetFilteredGroupInfo") -> None:
         self.name: str = "getFilteredGroupInfo"
         self.method: str = "GET"
@@ -25,6 +30,15 @@ class GetFilteredGroupInfo(Workflow):
         super().__init__()
 
     def run(self, api, args):  # type: ignore # pylint: disable=arguments-differ
+        # A recent local snapshot of the groups answers this from its index, without downloading them all
+        snapshot = api.snapshot
+        if snapshot is not None and not api.dryrun and snapshot.is_fresh("groups"):
+            if api.debug_level != DebugLevel.QUIET:
+                print(f"Using the local snapshot of groups ({snapshot.path})")
+                print(f"Filtering by groupname: '{args['groupname']}'")
+            condition = Condition(f"groupname == {json.dumps(args['groupname'])}")
+            return list(snapshot.query("groups", [condition]))
+
         group_json = self.verify_output(api, api.call_endpoint("getAllGroups"))
         if api.dryrun:
             return []
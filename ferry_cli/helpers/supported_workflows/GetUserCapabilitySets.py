@@ -0,0 +1,59 @@
+# pylint: disable=invalid-name,arguments-differ
+from typing import Any, Dict, List
+
+try:
+    from ferry_cli.helpers.api import FerryAPI  # pylint: disable=unused-import
+    from ferry_cli.helpers.auth import DebugLevel
+    from ferry_cli.helpers.membership import (
+        CAPABILITY_SET,
+        USER,
+        load_membership_graph,
+        split_names,
+    )
+    from ferry_cli.helpers.workflows import Workflow
+except ImportError:
+    from helpers.api import FerryAPI  # type: ignore # pylint: disable=unused-import
+    from helpers.auth import DebugLevel  # type: ignore
+    from helpers.membership import (  # type: ignore
+        CAPABILITY_SET,
+        USER,
+        load_membership_graph,
+        split_names,
+    )
+    from helpers.workflows import Workflow  # type: ignore
+
+
+class GetUserCapabilitySets(Workflow):
+    makes_writes = False
+
+    def __init__(self: "GetUserCapabilitySets") -> None:
+        self.name: str = "getUserCapabilitySets"
+        self.method: str = "GET"
+        self.description: str = (
+            "Returns the capability sets that each user can reach through their groups and those groups' affiliation units, with the groups and units that link them.  "
+            "Any number of names can be given: FERRY's membership data is downloaded once and indexed locally."
+        )
+        self.params: List[Dict[str, Any]] = [
+            {
+                "name": "username",
+                "description": "Comma-separated usernames",
+                "type": "string",
+                "required": True,
+            }
+        ]
+        super().__init__()
+
+    def run(
+        self: "GetUserCapabilitySets", api: "FerryAPI", args: Any
+    ) -> Any:  # pylint: disable=arguments-differ
+        graph = load_membership_graph(api, self.concurrency)
+        if graph is None:
+            return []
+        # The results may be incomplete, so the CLI exits with status 1 after printing them
+        self.failures = len(graph.failed_groups)
+        results: List[Dict[str, Any]] = []
+        for name in split_names(args["username"]):
+            if (USER, name) not in graph and api.debug_level != DebugLevel.QUIET:
+                print(f"User {name} was not found in any group")
+            results.extend(graph.reachable(USER, name, CAPABILITY_SET))
+        return results
@@ -1,15 +1,19 @@
 # pylint: disable=invalid-name,arguments-differ,unused-import
 import sys
-from typing import Any, List
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 try:
     from ferry_cli.helpers.api import FerryAPI
     from ferry_cli.helpers.auth import DebugLevel
-    from ferry_cli.helpers.workflows import Workflow
+    from ferry_cli.helpers.workflows import PlannedCall, Step, Workflow
 except ImportError:
     from helpers.api import FerryAPI  # type: ignore
     from helpers.auth import DebugLevel  # type: ignore
-    from helpers.workflows import Workflow  # type: ignore
+    from helpers.workflows import PlannedCall, Step, Workflow  # type: ignore
+
+# Lists every FQAN FERRY knows, with the unit and user it maps to
+FQAN_LOOKUP = "getVORoleMapFile"
 
 
 class NewCapabilitySet(Workflow):
@@ -74,267 +78,450 @@ class NewCapabilitySet(Workflow):
         ]
         super().__init__()
 
-    def run(self: "NewCapabilitySet", api: "FerryAPI", args: Any) -> Any:  # type: ignore # pylint: disable=arguments-differ,too-many-branches,too-many-statements
-        """Run the workflow to add a new capability set to FERRY"""
+    def run(self: "NewCapabilitySet", api: "FerryAPI", args: Any) -> Any:  # type: ignore # pylint: disable=arguments-differ
+        """Run the workflow to add a new capability set to FERRY.
+
+        Each step is checked before the steps that build on it start, as before, but steps that
+        don't build on each other run at the same time: the capability set is created alongside the
+        group, and a mapped user is added to the group alongside adding the group to its unit.
+        """
         if api.dryrun:
             print(
                 "WARNING:  This workflow is being run with the --dryrun flag.  The exact steps shown here may differ since "
                 "some of the workflow steps depend on the output of API calls."
             )
 
-        # Note - we don't have explicit dryrun checks here because the FerryAPI class handles that for us
-        # 1. Create new group in FERRY
-        try:
-            self.verify_output(
-                api,
-                api.call_endpoint(
+        # Checked up front, so a bad FQAN fails before anything is written to FERRY
+        role = self._calculate_role(args["fqan"])
+        if not role:
+            print(f"Failed to calculate role from FQAN {args['fqan']}")
+            raise ValueError("Role calculation failed")
+
+        # Note - we don't have explicit dryrun checks here because the FerryAPI class and run_steps handle that for us
+        steps = [
+            # 1. Create new group in FERRY, and check it
+            Step("createGroup", partial(self._create_group, api, args), write=True),
+            Step(
+                "checkGroup",
+                partial(self._check_group, api, args),
+                needs=["createGroup"],
+                failure="Failed to verify group creation",
+                dryrun=False,
+            ),
+            # 2. Add group to unit, and check it
+            Step(
+                "addGroupToUnit",
+                partial(self._add_group_to_unit, api, args),
+                needs=["checkGroup"],
+                failure="Failed to add group to unit",
+                write=True,
+            ),
+            Step(
+                "checkGroupUnit",
+                partial(self._check_group_unit, api, args),
+                needs=["addGroupToUnit"],
+                failure="Failed to verify group-unit association",
+                dryrun=False,
+            ),
+        ]
+        fqan_needs = ["checkGroupUnit"]
+        # TODO Test this case # pylint: disable=fixme
+        # 2a. Optional - add mapped user to group, and check it
+        if args.get("mapped_user", ""):
+            steps += [
+                Step(
+                    "addUserToGroup",
+                    partial(self._add_user_to_group, api, args),
+                    needs=["checkGroup"],
+                    failure="Failed to add mapped user to group",
+                    write=True,
+                ),
+                Step(
+                    "checkGroupMembers",
+                    partial(self._check_group_members, api, args),
+                    needs=["addUserToGroup"],
+                    failure="Failed to verify mapped user-group association",
+                    dryrun=False,
+                ),
+            ]
+            fqan_needs.append("checkGroupMembers")
+        steps += [
+            # 3. Create new FQAN.  No Check available for FQAN creation at this time
+            Step(
+                "createFQAN",
+                partial(self._create_fqan, api, args),
+                needs=fqan_needs,
+                failure="Failed to create FQAN",
+                write=True,
+            ),
+            # 4. Create capability set, alongside the FQAN.  Check will be after next step
+            Step(
+                "createCapabilitySet",
+                partial(self._create_capability_set, api, args),
+                needs=fqan_needs,
+                failure="Failed to create capability set",
+                write=True,
+            ),
+            # 5. Associate capability set with FQAN, and check all capability set settings
+            Step(
+                "addCapabilitySetToFQAN",
+                partial(self._add_capability_set_to_fqan, api, args, role),
+                needs=["createFQAN", "createCapabilitySet"],
+                failure="Failed to associate capability set with FQAN",
+                write=True,
+            ),
+            Step(
+                "checkCapabilitySet",
+                partial(self._check_capability_set, api, args, role),
+                needs=["addCapabilitySetToFQAN"],
+                failure="Failed to verify capability set creation",
+                dryrun=False,
+            ),
+        ]
+        self.run_steps(api, steps)
+        print(f"Successfully created capability set {args['setname']}.")
+
+    def plan(self: "NewCapabilitySet", api: "FerryAPI", args: Any) -> List[PlannedCall]:
+        """Read the group, its units and members, and the capability set, all at once, and plan only
+        the steps of the workflow that haven't been done yet.
+
+        The FQAN is looked up in FERRY's VO role map.  If that can't be read, the FQAN is planned
+        whenever the capability set isn't linked to it yet.
+        """
+        role = self._calculate_role(args["fqan"])
+        if not role:
+            print(f"Failed to calculate role from FQAN {args['fqan']}")
+            raise ValueError("Role calculation failed")
+        state = self.run_steps(
+            api,
+            [
+                Step(name, self._reader(api, endpoint, params))
+                for name, (endpoint, params) in self._lookups(args).items()
+            ],
+        )
+        return self._plan_calls(args, role, state)
+
+    @staticmethod
+    def _lookups(args: Any) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        """The state plan reads from FERRY, by name: (endpoint, params)"""
+        lookups = {
+            "group": ("getGroupName", {"gid": args["gid"]}),
+            "units": ("getGroupUnits", {"groupname": args["groupname"]}),
+            "capabilitySet": ("getCapabilitySet", {"setname": args["setname"]}),
+            "fqans": (FQAN_LOOKUP, {}),
+        }
+        if args.get("mapped_user", ""):
+            lookups["members"] = ("getGroupMembers", {"groupname": args["groupname"]})
+        return lookups
+
+    def _plan_calls(
+        self: "NewCapabilitySet", args: Any, role: str, state: Dict[str, Any]
+    ) -> List[PlannedCall]:
+        """The writes needed to get from state (see _lookups) to the capability set args describes"""
+        mapped_user = args.get("mapped_user", "")
+        calls: List[PlannedCall] = []
+        group = state["group"]
+        if not group:
+            calls.append(
+                PlannedCall(
+                    "createGroup",
                     "createGroup",
-                    method="PUT",
-                    params={
+                    "PUT",
+                    {
                         "groupname": args["groupname"],
                         "gid": args["gid"],
                         "grouptype": "UnixGroup",
                     },
-                ),
-            )
-        except Exception as e:  # pylint: disable=broad-except
-            if api.debug_level != DebugLevel.QUIET:
-                print("Failed to create group")
-            if "groupname already exists" in str(e):
-                print(
-                    f"Group {args['groupname']} already exists in FERRY.  Continuing with the workflow."
                 )
-            else:
-                raise
-
-        # Check
-        if not api.dryrun:
-            try:
-                response = self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "getGroupName",
-                        params={"gid": args["gid"]},
-                    ),
-                )
-                if response["groupname"] != args["groupname"]:
-                    print(
-                        f"Group name {response['groupname']} does not match expected group name {args['groupname']}"
-                    )
-                    raise ValueError("Group name mismatch")
-            except Exception:  # pylint: disable=broad-except
-                if api.debug_level != DebugLevel.QUIET:
-                    print("Failed to verify group creation")
-                raise
+            )
+        elif group.get("groupname") != args["groupname"]:
+            raise ValueError(
+                f"GID {args['gid']} already belongs to group {group.get('groupname')}, not {args['groupname']}"
+            )
 
-        # 2. Add group to unit
-        try:
-            self.verify_output(
-                api,
-                api.call_endpoint(
+        units = {entry.get("unitname") for entry in state["units"] or []}
+        if args["unitname"] not in units:
+            calls.append(
+                PlannedCall(
                     "addGroupToUnit",
-                    method="PUT",
-                    params={
+                    "addGroupToUnit",
+                    "PUT",
+                    {
                         "groupname": args["groupname"],
                         "unitname": args["unitname"],
                         "grouptype": "UnixGroup",
                     },
-                ),
-            )
-        except Exception:  # pylint: disable=broad-except
-            if api.debug_level != DebugLevel.QUIET:
-                print("Failed to add group to unit")
-            raise
-
-        # Check
-        if not api.dryrun:
-            try:
-                response = self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "getGroupUnits",
-                        params={"groupname": args["groupname"]},
-                    ),
+                    needs=("createGroup",),
                 )
-                units = (entry["unitname"] for entry in response)
-                for unit in units:
-                    if unit == args["unitname"]:
-                        break
-                else:
-                    raise ValueError(
-                        f"Group {args['groupname']} does not belong to unit {args['unitname']}"
-                    )
-            except Exception:  # pylint: disable=broad-except
-                if api.debug_level != DebugLevel.QUIET:
-                    print("Failed to verify group-unit association")
-                raise
-
-        # TODO Test this case # pylint: disable=fixme
-        # 2a. Optional - add mapped user to group
-        if args.get("mapped_user", ""):
-            try:
-                self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "addUserToGroup",
-                        method="PUT",
-                        params={
-                            "groupname": args["groupname"],
-                            "username": args["mapped_user"],
-                            "grouptype": "UnixGroup",
-                        },
-                    ),
+            )
+        members = {entry.get("username") for entry in state.get("members") or []}
+        if mapped_user and mapped_user not in members:
+            calls.append(
+                PlannedCall(
+                    "addUserToGroup",
+                    "addUserToGroup",
+                    "PUT",
+                    {
+                        "groupname": args["groupname"],
+                        "username": mapped_user,
+                        "grouptype": "UnixGroup",
+                    },
+                    needs=("createGroup",),
                 )
-            except Exception:
-                if api.debug_level != DebugLevel.QUIET:
-                    print("Failed to add mapped user to group")
-                raise
-            # Check
-            if not api.dryrun:
-                try:
-                    response = self.verify_output(
-                        api,
-                        api.call_endpoint(
-                            "getGroupMembers",
-                            params={"groupname": args["groupname"]},
-                        ),
-                    )
-                    users = (entry["username"] for entry in response)
-                    for user in users:
-                        if user == args["mapped_user"]:
-                            break
-                    else:
-                        raise ValueError(
-                            f"Mapped user {args['mapped_user']} does not belong to group {args['groupname']}"
-                        )
-                except Exception:
-                    if api.debug_level != DebugLevel.QUIET:
-                        print("Failed to verify mapped user-group association")
-                    raise
-
-        # 3. Create new FQAN
-        try:
-            params = {
-                "fqan": args["fqan"],
-                "unitname": args["unitname"],
-                "groupname": args["groupname"],
-            }
-            if args.get("mapped_user"):
-                params["username"] = args["mapped_user"]
-
-            self.verify_output(
-                api,
-                api.call_endpoint(
-                    "createFQAN",
-                    method="PUT",
-                    params=params,
-                ),
             )
-        except Exception:  # pylint: disable=broad-except
-            if api.debug_level != DebugLevel.QUIET:
-                print("Failed to create FQAN")
-            raise
 
-        # No Check available for FQAN creation at this time
-
-        # 4. Create capability set
-        try:
-            new_cap_set_params = {
-                "setname": args["setname"],
-                "pattern": args["scopes_pattern"],
-            }
+        set_info = (state["capabilitySet"] or [None])[0]
+        if not set_info:
+            params = {"setname": args["setname"], "pattern": args["scopes_pattern"]}
             if args.get("token_subject", None) is not None:
-                new_cap_set_params["token_subject"] = args["token_subject"]
-
-            self.verify_output(
-                api,
-                api.call_endpoint(
-                    "createCapabilitySet",
-                    method="PUT",
-                    params=new_cap_set_params,
-                ),
+                params["token_subject"] = args["token_subject"]
+            calls.append(
+                PlannedCall("createCapabilitySet", "createCapabilitySet", "PUT", params)
+            )
+        elif not self._check_lists_for_same_elts(
+            set_info.get("patterns", []),
+            self.scopes_string_to_list(args["scopes_pattern"]),
+        ):
+            raise ValueError(
+                f"Capability set {args['setname']} already exists with pattern {set_info.get('patterns')}, "
+                f"not {args['scopes_pattern']}"
             )
-        except Exception:  # pylint: disable=broad-except
-            if api.debug_level != DebugLevel.QUIET:
-                print("Failed to create capability set")
-            raise
-        # Check will be after next step
 
-        # 5. Associate capability set with FQAN
-        role = self._calculate_role(args["fqan"])
-        if not role:
-            print(f"Failed to calculate role from FQAN {args['fqan']}")
-            raise ValueError("Role calculation failed")
-        try:
-            self.verify_output(
-                api,
-                api.call_endpoint(
+        fqans = {
+            entry.get("fqan")
+            for entry in (set_info or {}).get("roles", [])
+            if entry.get("role") == role
+        }
+        if fqans - {args["fqan"]}:
+            raise ValueError(
+                f"Capability set {args['setname']} already has role {role} with FQAN(s) {', '.join(sorted(fqans))}"
+            )
+        if not fqans:
+            known_fqans = self._known_fqans(state.get("fqans"))
+            if known_fqans is None or args["fqan"] not in known_fqans:
+                params = {
+                    "fqan": args["fqan"],
+                    "unitname": args["unitname"],
+                    "groupname": args["groupname"],
+                }
+                if mapped_user:
+                    params["username"] = mapped_user
+                calls.append(
+                    PlannedCall(
+                        "createFQAN",
+                        "createFQAN",
+                        "PUT",
+                        params,
+                        needs=("addGroupToUnit", "addUserToGroup"),
+                    )
+                )
+            calls.append(
+                PlannedCall(
                     "addCapabilitySetToFQAN",
-                    method="PUT",
-                    params={
+                    "addCapabilitySetToFQAN",
+                    "PUT",
+                    {
                         "setname": args["setname"],
                         "unitname": args["unitname"],
                         "role": role,
                     },
-                ),
+                    needs=("createFQAN", "createCapabilitySet"),
+                )
+            )
+        return calls
+
+    @staticmethod
+    def _known_fqans(records: Any) -> Optional[Set[str]]:
+        """The FQANs in a FQAN_LOOKUP response's output, or None if it couldn't be read"""
+        if records is None:
+            return None
+        fqans: Set[str] = set()
+        pending = [records]
+        # The records may be a list, or grouped by unit
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                if isinstance(value.get("fqan"), str):
+                    fqans.add(value["fqan"])
+                else:
+                    pending.extend(value.values())
+            elif isinstance(value, list):
+                pending.extend(value)
+        return fqans
+
+    def _reader(
+        self: "NewCapabilitySet",
+        api: "FerryAPI",
+        endpoint: str,
+        params: Dict[str, Any],
+    ) -> Callable[[Dict[str, Any]], Any]:
+        return lambda _: self.read_state(api, endpoint, params)
+
+    def _put(
+        self: "NewCapabilitySet", api: "FerryAPI", endpoint: str, params: Dict[str, Any]
+    ) -> Any:
+        return self.verify_output(
+            api, api.call_endpoint(endpoint, method="PUT", params=params)
+        )
+
+    def _get(
+        self: "NewCapabilitySet", api: "FerryAPI", endpoint: str, params: Dict[str, Any]
+    ) -> Any:
+        # Verification has to see what FERRY has now, not a cached response
+        return self.verify_output(
+            api, api.call_endpoint(endpoint, params=params, use_cache=False)
+        )
+
+    def _create_group(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        try:
+            self._put(
+                api,
+                "createGroup",
+                {
+                    "groupname": args["groupname"],
+                    "gid": args["gid"],
+                    "grouptype": "UnixGroup",
+                },
             )
-        except Exception:  # pylint: disable=broad-except
+        except Exception as e:  # pylint: disable=broad-except
             if api.debug_level != DebugLevel.QUIET:
-                print("Failed to associate capability set with FQAN")
-            raise
-
-        # Check all capability set settings
-        if not api.dryrun:
-            try:
-                response = self.verify_output(
-                    api,
-                    api.call_endpoint(
-                        "getCapabilitySet",
-                        params={"setname": args["setname"]},
-                    ),
+                print("Failed to create group")
+            if "groupname already exists" in str(e):
+                print(
+                    f"Group {args['groupname']} already exists in FERRY.  Continuing with the workflow."
                 )
-                # For some reason, the getCapabilitySet API returns a list, so we need to extract the first element
-                set_info = response[0]
+            else:
+                raise
 
-                # Verify that the capability set name matches the expected name
-                try:
-                    assert set_info["setname"] == args["setname"]
-                except AssertionError:
-                    raise ValueError(
-                        f"Capability set name {set_info['setname']} does not match expected name {args['setname']}"
-                    )
+    def _check_group(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        response = self._get(api, "getGroupName", {"gid": args["gid"]})
+        if response["groupname"] != args["groupname"]:
+            print(
+                f"Group name {response['groupname']} does not match expected group name {args['groupname']}"
+            )
+            raise ValueError("Group name mismatch")
 
-                # Verify that the capability set pattern matches the expected pattern
-                try:
-                    assert self._check_lists_for_same_elts(
-                        set_info["patterns"],
-                        self.scopes_string_to_list(args["scopes_pattern"]),
-                    )
-                except AssertionError:
-                    raise ValueError(
-                        f"Capability set pattern {set_info['patterns']} does not match expected pattern {args['scopes_pattern']}"
-                    )
+    def _add_group_to_unit(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        self._put(
+            api,
+            "addGroupToUnit",
+            {
+                "groupname": args["groupname"],
+                "unitname": args["unitname"],
+                "grouptype": "UnixGroup",
+            },
+        )
 
-                # Verify that the capability set FQAN and role matches the expected FQAN and role
-                role_entries = (entry for entry in set_info["roles"])
-                for entry in role_entries:
-                    if entry["role"] == role:
-                        try:
-                            assert entry["fqan"] == args["fqan"]
-                        except AssertionError:
-                            raise ValueError(
-                                f"Capability set role {entry['role']} does not match expected role {role}"
-                            )
-                        break  # Good case - role and fqan match
-                else:
+    def _check_group_unit(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        response = self._get(api, "getGroupUnits", {"groupname": args["groupname"]})
+        if args["unitname"] not in (entry["unitname"] for entry in response):
+            raise ValueError(
+                f"Group {args['groupname']} does not belong to unit {args['unitname']}"
+            )
+
+    def _add_user_to_group(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        self._put(
+            api,
+            "addUserToGroup",
+            {
+                "groupname": args["groupname"],
+                "username": args["mapped_user"],
+                "grouptype": "UnixGroup",
+            },
+        )
+
+    def _check_group_members(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        response = self._get(api, "getGroupMembers", {"groupname": args["groupname"]})
+        if args["mapped_user"] not in (entry["username"] for entry in response):
+            raise ValueError(
+                f"Mapped user {args['mapped_user']} does not belong to group {args['groupname']}"
+            )
+
+    def _create_fqan(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        params = {
+            "fqan": args["fqan"],
+            "unitname": args["unitname"],
+            "groupname": args["groupname"],
+        }
+        if args.get("mapped_user"):
+            params["username"] = args["mapped_user"]
+        self._put(api, "createFQAN", params)
+
+    def _create_capability_set(
+        self: "NewCapabilitySet", api: "FerryAPI", args: Any, _: Dict[str, Any]
+    ) -> None:
+        new_cap_set_params = {
+            "setname": args["setname"],
+            "pattern": args["scopes_pattern"],
+        }
+        if args.get("token_subject", None) is not None:
+            new_cap_set_params["token_subject"] = args["token_subject"]
+        self._put(api, "createCapabilitySet", new_cap_set_params)
+
+    def _add_capability_set_to_fqan(
+        self: "NewCapabilitySet",
+        api: "FerryAPI",
+        args: Any,
+        role: str,
+        _: Dict[str, Any],
+    ) -> None:
+        self._put(
+            api,
+            "addCapabilitySetToFQAN",
+            {"setname": args["setname"], "unitname": args["unitname"], "role": role},
+        )
+
+    def _check_capability_set(
+        self: "NewCapabilitySet",
+        api: "FerryAPI",
+        args: Any,
+        role: str,
+        _: Dict[str, Any],
+    ) -> None:
+        response = self._get(api, "getCapabilitySet", {"setname": args["setname"]})
+        # For some reason, the getCapabilitySet API returns a list, so we need to extract the first element
+        set_info = response[0]
+
+        # Verify that the capability set name matches the expected name
+        if set_info["setname"] != args["setname"]:
+            raise ValueError(
+                f"Capability set name {set_info['setname']} does not match expected name {args['setname']}"
+            )
+
+        # Verify that the capability set pattern matches the expected pattern
+        if not self._check_lists_for_same_elts(
+            set_info["patterns"], self.scopes_string_to_list(args["scopes_pattern"])
+        ):
+            raise ValueError(
+                f"Capability set pattern {set_info['patterns']} does not match expected pattern {args['scopes_pattern']}"
+            )
+
+        # Verify that the capability set FQAN and role matches the expected FQAN and role
+        for entry in set_info["roles"]:
+            if entry["role"] == role:
+                if entry["fqan"] != args["fqan"]:
                     raise ValueError(
-                        f"Capability set role does not match expected role {role} or FQAN {args['fqan']} is not found in proper role entry"
+                        f"Capability set role {entry['role']} does not match expected role {role}"
                     )
-            except Exception:  # pylint: disable=broad-except
-                if api.debug_level != DebugLevel.QUIET:
-                    print("Failed to verify capability set creation")
-                raise
-        print(f"Successfully created capability set {args['setname']}.")
+                break  # Good case - role and fqan match
+        else:
+            raise ValueError(
+                f"Capability set role does not match expected role {role} or FQAN {args['fqan']} is not found in proper role entry"
+            )
 
     @staticmethod
     def scopes_string_to_list(
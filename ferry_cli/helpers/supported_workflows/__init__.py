@@ -1,22 +1,46 @@
 # __init__.py
-from typing import Mapping, Type
-
-try:
-    from ferry_cli.helpers.workflows import Workflow
-    from ferry_cli.helpers.supported_workflows.CloneResource import CloneResource
-    from ferry_cli.helpers.supported_workflows.GetFilteredGroupInfo import (
-        GetFilteredGroupInfo,
-    )
-    from ferry_cli.helpers.supported_workflows.NewCapabilitySet import NewCapabilitySet
-except ImportError:
-    from helpers.workflows import Workflow  # type: ignore
-    from helpers.supported_workflows.CloneResource import CloneResource  # type: ignore
-    from helpers.supported_workflows.GetFilteredGroupInfo import GetFilteredGroupInfo  # type: ignore
-    from helpers.supported_workflows.NewCapabilitySet import NewCapabilitySet  # type: ignore
-
-
-SUPPORTED_WORKFLOWS: Mapping[str, Type[Workflow]] = {
-    "cloneResource": CloneResource,
-    "getFilteredGroupInfo": GetFilteredGroupInfo,
-    "newCapabilitySet": NewCapabilitySet,
-}
+import importlib
+from typing import Dict, Iterator, Mapping, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    try:
+        from ferry_cli.helpers.workflows import Workflow
+    except ImportError:
+        from helpers.workflows import Workflow  # type: ignore
+
+
+class _SupportedWorkflows(Mapping[str, Type["Workflow"]]):
+    """Registry of workflow name -> Workflow class.  Each workflow module is only imported the
+    first time its class is looked up, so invocations that don't run a workflow never load them."""
+
+    def __init__(self: "_SupportedWorkflows", modules: Dict[str, str]) -> None:
+        # Maps workflow name to the module (in this package) holding the class of the same name
+        self._modules = modules
+        self._classes: Dict[str, Type["Workflow"]] = {}
+
+    def __getitem__(self: "_SupportedWorkflows", name: str) -> Type["Workflow"]:
+        if name not in self._classes:
+            module_name = self._modules[name]
+            # __name__ is either ferry_cli.helpers.supported_workflows or helpers.supported_workflows,
+            # depending on how we were imported
+            module = importlib.import_module(f"{__name__}.{module_name}")
+            self._classes[name] = getattr(module, module_name)
+        return self._classes[name]
+
+    def __iter__(self: "_SupportedWorkflows") -> Iterator[str]:
+        return iter(self._modules)
+
+    def __len__(self: "_SupportedWorkflows") -> int:
+        return len(self._modules)
+
+
+SUPPORTED_WORKFLOWS: Mapping[str, Type["Workflow"]] = _SupportedWorkflows(
+    {
+        "bulkNewCapabilitySet": "BulkNewCapabilitySet",
+        "cloneResource": "CloneResource",
+        "getCapabilitySetUsers": "GetCapabilitySetUsers",
+        "getFilteredGroupInfo": "GetFilteredGroupInfo",
+        "getUserCapabilitySets": "GetUserCapabilitySets",
+        "newCapabilitySet": "NewCapabilitySet",
+    }
+)
@@ -0,0 +1,72 @@
+"""An HTTPAdapter whose connections all use one prebuilt ssl.SSLContext.
+
+By default, requests passes the session's cert and verify paths down to urllib3 with each request,
+and urllib3 loads them into a new SSL context for each new connection: the proxy's certificate
+chain and key, and the CA directory (usually /etc/grid-security/certificates, with hundreds of
+files).  SSLContextAdapter loads them once, into the context it is given (see AuthCert.ssl_context),
+and every connection it opens shares that context.
+
+This module imports requests, so only import it where requests is needed anyway.
+"""
+import ssl
+from typing import Any, Dict, Tuple
+
+from requests.adapters import HTTPAdapter
+
+__all__ = ["SSLContextAdapter"]
+
+# The per-request TLS settings that the shared context replaces
+_TLS_POOL_KWARGS = ("ca_certs", "ca_cert_dir", "cert_file", "key_file")
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """An HTTPAdapter that verifies servers, and presents its client certificate, with ssl_context.
+
+    The session's cert and verify settings are ignored for HTTPS: ssl_context already holds the
+    certificate and CAs, and always verifies the server.
+    """
+
+    def __init__(
+        self: "SSLContextAdapter", ssl_context: ssl.SSLContext, **kwargs: Any
+    ) -> None:
+        # Set before HTTPAdapter.__init__, which calls init_poolmanager
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(
+        self: "SSLContextAdapter", *args: Any, **pool_kwargs: Any
+    ) -> None:
+        pool_kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **pool_kwargs)
+
+    def proxy_manager_for(self: "SSLContextAdapter", *args: Any, **kwargs: Any) -> Any:
+        kwargs["ssl_context"] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(  # type: ignore[override]
+        self: "SSLContextAdapter", request: Any, verify: Any, cert: Any = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        # requests >= 2.32 picks the connection pool by these.  Without the paths, every request to
+        # a host shares one pool, whose connections use ssl_context.  (HTTPAdapter's annotations
+        # differ between requests versions, so it's called untyped.)
+        adapter: Any = super()
+        host_params, pool_kwargs = adapter.build_connection_pool_key_attributes(
+            request, verify, cert
+        )
+        if host_params.get("scheme") == "https":
+            for key in _TLS_POOL_KWARGS:
+                pool_kwargs.pop(key, None)
+            pool_kwargs["cert_reqs"] = "CERT_REQUIRED"
+        return host_params, pool_kwargs
+
+    def cert_verify(
+        self: "SSLContextAdapter", conn: Any, url: str, verify: Any, cert: Any
+    ) -> None:
+        if not url.lower().startswith("https"):
+            adapter: Any = super()
+            adapter.cert_verify(conn, url, verify, cert)
+            return
+        # Otherwise urllib3 would load these paths into ssl_context again for each new connection
+        conn.cert_reqs = "CERT_REQUIRED"
+        for key in _TLS_POOL_KWARGS:
+            setattr(conn, key, None)
@@ -1,22 +1,140 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 try:
-    from ferry_cli.helpers.api import FerryAPI  # pylint: disable=unused-import
+    from ferry_cli.helpers.api import (  # pylint: disable=unused-import
+        DEFAULT_CONCURRENCY,
+        FerryAPI,
+    )
+    from ferry_cli.helpers.auth import DebugLevel
     from ferry_cli.helpers.customs import FerryParser
 except ImportError:
-    from helpers.api import FerryAPI  # type: ignore # pylint: disable=unused-import
+    from helpers.api import DEFAULT_CONCURRENCY, FerryAPI  # type: ignore # pylint: disable=unused-import
+    from helpers.auth import DebugLevel  # type: ignore
     from helpers.customs import FerryParser  # type: ignore
 
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    try:
+        from ferry_cli.helpers.journal import WorkflowJournal
+    except ImportError:
+        from helpers.journal import WorkflowJournal  # type: ignore
+
+
+class Step:
+    """One step of a workflow (see Workflow.run_steps), usually a single FERRY call or a check of one.
+
+    A step's result is passed, by its name, to the steps that need it.  Steps that don't need each
+    other, directly or through other steps, can run at the same time.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self: "Step",
+        name: str,
+        func: Callable[[Dict[str, Any]], Any],
+        needs: Sequence[str] = (),
+        failure: str = "",
+        dryrun: bool = True,
+        params: Optional[Dict[str, Any]] = None,
+        write: bool = False,
+    ) -> None:
+        """
+        Parameters:
+            name (str): Identifies the step and its result
+            func (Callable[[Dict[str, Any]], Any]): Does the step, given the results of the steps it needs, by name
+            needs (Sequence[str]): The steps that have to finish before this one starts
+            failure (str): Printed (unless quiet) if the step fails
+            dryrun (bool): Whether to run the step in a dry run.  Checks of what a write did should
+                be False, since in a dry run the write isn't made
+            params (Optional[Dict[str, Any]]): The parameters of the FERRY call the step makes, if
+                it makes one, recorded in the journal (see Workflow.journal)
+            write (bool): Whether the step writes to FERRY.  Only writes are journaled: on resume,
+                completed writes are skipped and reads are run again
+        """
+        self.name = name
+        self.func = func
+        self.needs = tuple(needs)
+        self.failure = failure
+        self.dryrun = dryrun
+        self.params = params
+        self.write = write
+
+    def __repr__(self: "Step") -> str:
+        return f"Step({self.name!r}, needs={list(self.needs)!r})"
+
+
+class PlannedCall(NamedTuple):
+    """A write that a workflow's reconcile mode has found it needs to make (see Workflow.plan)"""
+
+    # Unique within the plan, so other calls can name it in needs
+    name: str
+    endpoint: str
+    method: str
+    params: Dict[str, Any]
+    # Calls (by name) that have to be made first, if they are in the plan at all
+    needs: Tuple[str, ...] = ()
+
+    def as_dict(self: "PlannedCall") -> Dict[str, Any]:
+        """The call as --plan outputs it, in the same form as a --batch line"""
+        return {"endpoint": self.endpoint, "method": self.method, "params": self.params}
+
+
+def check_steps(steps: Sequence[Step]) -> None:
+    """Check that step names are unique, and that each step comes after the steps it needs, which
+    also means there are no cycles.
+
+    Raises:
+        ValueError: If they aren't
+    """
+    seen: Set[str] = set()
+    for step in steps:
+        if step.name in seen:
+            raise ValueError(f"Workflow step {step.name!r} is defined more than once")
+        missing = [need for need in step.needs if need not in seen]
+        if missing:
+            raise ValueError(
+                f"Workflow step {step.name!r} needs {', '.join(missing)}, which must be defined before it"
+            )
+        seen.add(step.name)
+
 
 class Workflow(ABC):
     """Abstracted Workflow object that as the baseline for our custom workflows"""
 
+    # pylint: disable=too-many-instance-attributes
+
+    # Whether the workflow writes to FERRY.  Only runs of workflows that do are journaled (see --resume)
+    makes_writes: bool = True
+
     def __init__(self) -> None:
         self.name: str
         self.description: str
         self.method: str
         self.params: List[Dict[str, Any]]
+        # How many steps run_steps runs at once (see --concurrency)
+        self.concurrency: int = DEFAULT_CONCURRENCY
+        # With --plan, reconcile returns the writes it would make instead of making them
+        self.plan_only: bool = False
+        # Where run_steps records completed steps, and finds the steps an earlier attempt at this
+        # run completed (see --resume).  None if the run isn't journaled, as in a dry run
+        self.journal: Optional["WorkflowJournal"] = None
+        # How many items (e.g. rows of a bulk workflow) failed.  The CLI exits with status 1, after
+        # printing the workflow's result, if any did
+        self.failures: int = 0
         self.init_parser()
 
     def init_parser(self) -> None:
@@ -51,3 +169,178 @@ class Workflow(ABC):
                 )
             raise RuntimeError("FERRY did not return a successful response")
         return response["ferry_output"]
+
+    def run_steps(
+        self: "Workflow", api: "FerryAPI", steps: Sequence[Step]
+    ) -> Dict[str, Any]:
+        """Run steps, each as soon as the steps it needs have finished, up to self.concurrency at
+        once.  Every step shares api, and so its session and connection pool.
+
+        In a dry run, steps run one at a time, in the order given, so the calls that would be made
+        are printed in order.  Steps with dryrun=False are skipped, and their results are None.
+
+        With a journal, each completed write step is recorded in it, and write steps that it records
+        as completed (by an earlier attempt at the run) aren't run again: their recorded results are
+        used instead.  Read steps always run, so a resumed run sees FERRY's current state.
+
+        Returns:
+            Each step's result, by name
+
+        Raises:
+            ValueError: If the steps are inconsistent (see check_steps)
+            The first exception raised by a step, once the steps already running have finished.
+            Steps that haven't started by then are not run.
+        """
+        check_steps(steps)
+        results: Dict[str, Any] = {}
+        if self.journal is not None:
+            for step in steps:
+                if not step.write:
+                    continue
+                entry = self.journal.completed(step.name, step.params)
+                if entry is not None:
+                    results[step.name] = entry.result
+            steps = [step for step in steps if step.name not in results]
+        if api.dryrun or self.concurrency <= 1:
+            for step in steps:
+                if api.dryrun and not step.dryrun:
+                    results[step.name] = None
+                else:
+                    results[step.name] = self._run_step(api, step, results)
+            return results
+        self._run_concurrently(api, steps, results)
+        return results
+
+    def _run_concurrently(  # pylint: disable=too-many-locals
+        self: "Workflow",
+        api: "FerryAPI",
+        steps: Sequence[Step],
+        results: Dict[str, Any],
+    ) -> None:
+        # Only workflows need a thread pool, so keep it off the import path
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        # How many of each step's needs haven't finished yet, and the steps waiting on each step
+        remaining = {step.name: len(set(step.needs) - set(results)) for step in steps}
+        dependents: Dict[str, List[Step]] = {}
+        for step in steps:
+            for need in set(step.needs) - set(results):
+                dependents.setdefault(need, []).append(step)
+        ready = [step for step in steps if not remaining[step.name]]
+        running: Dict["Future[Any]", Step] = {}
+        error: Optional[Exception] = None
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="ferry-workflow"
+        ) as executor:
+            while True:
+                if error is None:
+                    for step in ready:
+                        running[
+                            executor.submit(self._run_step, api, step, dict(results))
+                        ] = step
+                    ready = []
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        results[step.name] = future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        if error is None:
+                            error = e
+                        continue
+                    for dependent in dependents.get(step.name, []):
+                        remaining[dependent.name] -= 1
+                        if not remaining[dependent.name]:
+                            ready.append(dependent)
+        if error is not None:
+            raise error
+
+    def _run_step(
+        self: "Workflow", api: "FerryAPI", step: Step, results: Dict[str, Any]
+    ) -> Any:
+        try:
+            result = step.func({need: results[need] for need in step.needs})
+        except Exception:
+            if step.failure and api.debug_level != DebugLevel.QUIET:
+                print(step.failure)
+            raise
+        if step.write and self.journal is not None and not api.dryrun:
+            self.journal.record(step.name, result, step.params)
+        return result
+
+    @classmethod
+    def supports_plan(cls) -> bool:
+        """Whether the workflow can be run with --reconcile and --plan, i.e. it overrides plan"""
+        return cls.plan is not Workflow.plan
+
+    def plan(self: "Workflow", api: "FerryAPI", args: Any) -> List[PlannedCall]:
+        """Read the current state from FERRY, and return the writes needed to reach the state the
+        workflow would create, and no others.  Workflows that support --reconcile and --plan override this.
+
+        Raises:
+            ValueError: If the current state conflicts with args in a way no write in the workflow can fix
+        """
+        raise NotImplementedError(
+            f"The {self.name} workflow does not support --reconcile or --plan"
+        )
+
+    def apply_plan(
+        self: "Workflow", api: "FerryAPI", calls: Sequence[PlannedCall]
+    ) -> None:
+        """Make the planned writes, each once the planned writes it needs have been made"""
+        planned = {call.name for call in calls}
+        self.run_steps(
+            api,
+            [
+                Step(
+                    call.name,
+                    partial(self._make_call, api, call),
+                    needs=[need for need in call.needs if need in planned],
+                    failure=f"Failed to call {call.endpoint}",
+                    params=call.params,
+                    write=True,
+                )
+                for call in calls
+            ],
+        )
+
+    def reconcile(self: "Workflow", api: "FerryAPI", args: Any) -> Any:
+        """Run the workflow in reconcile mode: read the current state once, then make only the writes
+        that are needed (see plan).  A workflow re-run on what it already created makes no writes.
+
+        Returns:
+            With plan_only, the writes that would be made (see PlannedCall.as_dict), without making them
+        """
+        calls = self.plan(api, args)
+        if self.plan_only:
+            return [call.as_dict() for call in calls]
+        if calls:
+            self.apply_plan(api, calls)
+        if api.debug_level != DebugLevel.QUIET and not api.dryrun:
+            print(
+                f"{self.name}: made {len(calls)} write(s)"
+                if calls
+                else f"{self.name}: already up to date, nothing to write"
+            )
+        return None
+
+    def _make_call(
+        self: "Workflow", api: "FerryAPI", call: PlannedCall, _: Dict[str, Any]
+    ) -> Any:
+        return self.verify_output(
+            api,
+            api.call_endpoint(call.endpoint, method=call.method, params=call.params),
+        )
+
+    def read_state(
+        self: "Workflow", api: "FerryAPI", endpoint: str, params: Dict[str, Any]
+    ) -> Any:
+        """For plan: what FERRY currently returns from endpoint, or None if the call was
+        unsuccessful (e.g. because what it looks up doesn't exist yet)"""
+        response = api.call_endpoint(endpoint, params=params, use_cache=False)
+        if not isinstance(response, dict) or response.get("ferry_status") != "success":
+            return None
+        return response.get("ferry_output")
@@ -1,13 +1,14 @@
 import sys
 import argparse
-import json
 import os
 from typing import Optional
 
 try:
     from ferry_cli.config import CONFIG_DIR
+    from ferry_cli.helpers import jsoncodec
 except ImportError:
     from config import CONFIG_DIR  # type: ignore
+    from helpers import jsoncodec  # type: ignore
 
 __title__ = "Ferry CLI"
 __swagger_file_title__ = "Ferry API"
@@ -26,8 +27,8 @@ def get_summary() -> str:
 def print_version(full: bool = False, short: bool = False) -> Optional[str]:
     file_version = None
     if os.path.exists(f"{CONFIG_DIR}/swagger.json"):
-        with open(f"{CONFIG_DIR}/swagger.json", "r") as file:
-            json_file = json.load(file)
+        with open(f"{CONFIG_DIR}/swagger.json", "rb") as file:
+            json_file = jsoncodec.loads(file.read())
             file_version = json_file.get("info", {}).get("version", None)
     if short:
         return __version__
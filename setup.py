@@ -46,6 +46,10 @@ setup(
         "validators>=0.22.0",
         "urllib3>=2.1.0",
     ],
+    extras_require={
+        # Faster decoding and encoding of large responses (see ferry_cli/helpers/jsoncodec.py)
+        "fast-json": ["orjson>=3.8"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3.8+",
         "Operating System :: OS Independent",
@@ -13,3 +13,88 @@ def stash_env(monkeypatch):
             os.environ[env_var] = env_previous
 
     return inner
+
+
+class FakeFerry:
+    """Transport adapter standing in for a FERRY server.  Mount it on a requests session, register
+    responses for endpoints with add(), and inspect the requests it received in .requests"""
+
+    def __init__(self):
+        from requests.adapters import BaseAdapter
+
+        fake = self
+
+        class _Adapter(BaseAdapter):
+            def send(self, request, **kwargs):
+                return fake._send(request, **kwargs)
+
+            def close(self):
+                pass
+
+        self.adapter = _Adapter()
+        self.requests = []
+        self.responses = {}
+
+    def add(self, endpoint, body, status=200, headers=None):
+        """Queue a response for endpoint.  The last queued response for an endpoint is repeated.
+        body may also be a function of the request, returning the body"""
+        self.responses.setdefault(endpoint, []).append((status, body, headers or {}))
+
+    def _send(self, request, **kwargs):
+        import json
+        from urllib.parse import urlsplit
+
+        from requests.models import Response
+
+        self.requests.append(request)
+        endpoint = urlsplit(request.url).path.strip("/")
+        queued = self.responses.get(endpoint)
+        if not queued:
+            status, body, headers = 404, {"ferry_status": "failure"}, {}
+        elif len(queued) > 1:
+            status, body, headers = queued.pop(0)
+        else:
+            status, body, headers = queued[0]
+        if callable(body):
+            body = body(request)
+        if isinstance(body, Exception):
+            raise body
+
+        response = Response()
+        response.status_code = status
+        response._content = (
+            body if isinstance(body, bytes) else json.dumps(body).encode()
+        )
+        # As if the body had been read, so iter_content() (stream=True) serves it in chunks
+        response._content_consumed = True
+        response.headers.update(headers)
+        response.request = request
+        response.url = request.url
+        return response
+
+
+@pytest.fixture
+def fake_ferry():
+    return FakeFerry()
+
+
+@pytest.fixture
+def fake_ferry_api(fake_ferry):
+    """Returns a function that creates a FerryAPI whose session talks to fake_ferry"""
+    from ferry_cli.helpers.api import FerryAPI
+    from ferry_cli.helpers.auth import Auth
+    from ferry_cli.helpers.resilience import RetryPolicy
+
+    class _NoAuth(Auth):
+        def __call__(self, s):
+            return s
+
+    def inner(**kwargs):
+        kwargs.setdefault("authorizer", _NoAuth())
+        # Tests that exercise retries ask for them explicitly
+        kwargs.setdefault("retry_policy", RetryPolicy(retries=0))
+        api = FerryAPI(base_url="https://ferry.example.com/", **kwargs)
+        api.get_session().mount("https://", fake_ferry.adapter)
+        return api
+
+    return inner
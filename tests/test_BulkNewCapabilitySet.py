@@ -0,0 +1,331 @@
+import io
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from ferry_cli.helpers.auth import DebugLevel
+from ferry_cli.helpers.supported_workflows.BulkNewCapabilitySet import (
+    BulkNewCapabilitySet,
+    read_rows,
+    validate_rows,
+)
+
+CSV = """groupname,gid,unitname,fqan,setname,scopes_pattern,mapped_user
+g1,1001,unit,/org/Role=alpha/Capability=NULL,alpha,"storage.read:/alpha,storage.create:/alpha",
+g1,1001,unit,/org/Role=beta/Capability=NULL,beta,storage.read:/beta,beta_user
+
+g2,1002,unit,/org/Role=gamma/Capability=NULL,gamma,storage.read:/gamma,
+"""
+
+
+def _endpoint(request):
+    return urlsplit(request.url).path.strip("/")
+
+
+def _params(request):
+    return {
+        name: values[0]
+        for name, values in parse_qs(urlsplit(request.url).query).items()
+    }
+
+
+@pytest.mark.unit
+def test_read_rows():
+    rows = read_rows(io.StringIO(CSV))
+    # The blank line is skipped, and each row knows its line
+    assert [line for line, _ in rows] == [2, 3, 5]
+    assert rows[0][1]["scopes_pattern"] == "storage.read:/alpha,storage.create:/alpha"
+
+    jsonl = '{"setname": "alpha", "gid": 1001}\n\n{"setname": "beta"}\n'
+    assert read_rows(io.StringIO(jsonl)) == [
+        (1, {"setname": "alpha", "gid": 1001}),
+        (3, {"setname": "beta"}),
+    ]
+    with pytest.raises(
+        ValueError, match=r"line 2: Invalid JSON(.|\n)*line 3: Expected"
+    ):
+        read_rows(io.StringIO('{"setname": "a"}\n{nope\n[1]\n'), "jsonl")
+    with pytest.raises(ValueError, match="line 2: More values than columns"):
+        read_rows(io.StringIO("setname,gid\na,1,extra\n"), "csv")
+    with pytest.raises(ValueError, match="Unknown format xml"):
+        read_rows(io.StringIO(""), "xml")
+
+
+@pytest.mark.unit
+def test_validate_rows():
+    rows = validate_rows(read_rows(io.StringIO(CSV)))
+    assert [row.role for row in rows] == ["alpha", "beta", "gamma"]
+    # Empty optional columns are left out
+    assert "mapped_user" not in rows[0].args
+    assert rows[1].args["mapped_user"] == "beta_user"
+
+    bad = [
+        (2, {"groupname": "g1", "gid": "x", "unitname": "u", "fqan": "/org", "setname": "a", "scopes_pattern": "s1,,s2"}),
+        (3, {"groupname": "g1", "gid": 1, "unitname": "u", "fqan": "/org/Role=r", "setname": "b", "scopes_pattern": "s", "mapped_usr": "me"}),
+        (4, {"groupname": "g2", "gid": 1, "fqan": "/org/Role=s", "setname": "b", "scopes_pattern": "s"}),
+        (5, {"groupname": "g1", "gid": 1, "unitname": "u", "fqan": "/org/Role=r", "setname": "c", "scopes_pattern": "s", "mapped_user": "you"}),
+    ]  # fmt: skip
+    with pytest.raises(ValueError) as error:
+        validate_rows(bad)
+    # Every problem with every row is reported at once
+    assert str(error.value).splitlines()[1:] == [
+        "line 2: gid x is not an integer",
+        "line 2: Can't calculate a role from FQAN /org",
+        "line 2: scopes_pattern s1,,s2 has an empty scope",
+        "line 3: Unknown field(s) mapped_usr",
+        "line 4: Missing unitname",
+        "line 4: Capability set b is also defined on line 3",
+        "line 4: gid 1 is for group g1 on line 3, not g2",
+        "line 5: FQAN /org/Role=r is mapped to group g1 in unit u on line 3, not group g1 in unit u with user you",
+    ]
+
+
+@pytest.fixture
+def bulk_ferry(fake_ferry):
+    """FERRY where g2, the capability set gamma and the FQANs of alpha and gamma already exist, as
+    the rows in CSV describe.  Groups' units and members, and alpha, read back as they're written"""
+
+    def success(output):
+        return {"ferry_status": "success", "ferry_output": output}
+
+    fake_ferry.add(
+        "getAllGroups",
+        success(
+            [
+                {"groupname": "g2", "gid": 1002, "grouptype": "UnixGroup"},
+                {"groupname": "other", "gid": 1001, "grouptype": "WilsonCluster"},
+            ]
+        ),
+    )
+    capability_sets = {
+        setname: {
+            "setname": setname,
+            "patterns": patterns,
+            "roles": [{"role": setname, "fqan": f"/org/Role={setname}/Capability=NULL"}],
+        }
+        for setname, patterns in (
+            ("alpha", ["storage.read:/alpha", "storage.create:/alpha"]),
+            ("gamma", ["storage.read:/gamma"]),
+        )
+    }  # fmt: skip
+
+    def get_capability_set(request):
+        setname = _params(request).get("setname")
+        # Read whole, only gamma exists.  Once alpha is created, it reads back as it was created
+        if setname is None:
+            return success([capability_sets["gamma"]])
+        return success([capability_sets[setname]])
+
+    def get_group_units(request):
+        groupname = _params(request)["groupname"]
+        added = any(
+            _endpoint(made) == "addGroupToUnit"
+            and _params(made)["groupname"] == groupname
+            for made in fake_ferry.requests
+        )
+        return success([{"unitname": "unit"}] if groupname == "g2" or added else [])
+
+    fake_ferry.add("getCapabilitySet", get_capability_set)
+    fake_ferry.add(
+        "getGroupName",
+        lambda request: success(
+            {"groupname": {"1001": "g1", "1002": "g2"}[_params(request)["gid"]]}
+        ),
+    )
+    fake_ferry.add(
+        "getVORoleMapFile",
+        success(
+            [
+                {"fqan": "/org/Role=alpha/Capability=NULL", "unitname": "unit"},
+                {"fqan": "/org/Role=gamma/Capability=NULL", "unitname": "unit"},
+            ]
+        ),
+    )
+    fake_ferry.add("getGroupUnits", get_group_units)
+    fake_ferry.add(
+        "getGroupMembers",
+        lambda request: success(
+            [
+                {"username": _params(made)["username"]}
+                for made in fake_ferry.requests
+                if _endpoint(made) == "addUserToGroup"
+                and _params(made)["groupname"] == _params(request)["groupname"]
+            ]
+        ),
+    )
+    for endpoint in (
+        "createGroup",
+        "addGroupToUnit",
+        "addUserToGroup",
+        "createFQAN",
+        "createCapabilitySet",
+    ):
+        fake_ferry.add(endpoint, success({}))
+    fake_ferry.add(
+        "addCapabilitySetToFQAN",
+        lambda request: (
+            {"ferry_status": "failure", "ferry_error": ["no such FQAN"]}
+            if _params(request)["setname"] == "beta"
+            else success({})
+        ),
+    )
+    return fake_ferry
+
+
+@pytest.mark.unit
+def test_bulk_run(bulk_ferry, fake_ferry_api, tmp_path, capsys):
+    path = tmp_path / "sets.csv"
+    path.write_text(CSV)
+    workflow = BulkNewCapabilitySet()
+    workflow.concurrency = 4
+    report = workflow.run(fake_ferry_api(), {"file": str(path)})
+
+    assert [(entry["setname"], entry["status"]) for entry in report] == [
+        ("alpha", "created"),
+        ("beta", "failed"),
+        ("gamma", "up to date"),
+    ]
+    assert report[1]["error"] == "FERRY returned error(s): no such FQAN"
+    assert workflow.failures == 1
+    out = capsys.readouterr().out
+    assert "1 created, 1 already up to date, 1 failed, of 3 capability sets" in out
+    assert "line 3 (beta): FERRY returned error(s): no such FQAN" in out
+
+    calls = [(_endpoint(request), _params(request)) for request in bulk_ferry.requests]
+    endpoints = [endpoint for endpoint, _ in calls]
+    # The shared state is read once, and each group's units once, however many rows use it
+    assert endpoints.count("getAllGroups") == 1
+    assert calls.count(("getCapabilitySet", {})) == 1
+    assert endpoints.count("getVORoleMapFile") == 1
+    # g1's units are read again to check it was added to its unit, once for both of its rows
+    assert sorted(
+        params["groupname"] for endpoint, params in calls if endpoint == "getGroupUnits"
+    ) == ["g1", "g1", "g2"]
+    # alpha, the only row whose writes all succeeded, is checked as newCapabilitySet checks it
+    assert ("getGroupName", {"gid": "1001"}) in calls
+    assert ("getCapabilitySet", {"setname": "alpha"}) in calls
+    assert not any(params.get("setname") == "gamma" for _, params in calls)
+    # g1 is created and added to its unit once, for both of its rows
+    assert endpoints.count("createGroup") == 1
+    assert endpoints.count("addGroupToUnit") == 1
+    # Only beta's FQAN is missing
+    assert [
+        params["fqan"] for endpoint, params in calls if endpoint == "createFQAN"
+    ] == ["/org/Role=beta/Capability=NULL"]
+    assert (
+        "addUserToGroup",
+        {"groupname": "g1", "username": "beta_user", "grouptype": "UnixGroup"},
+    ) in calls
+    # Nothing is written for gamma
+    assert not any(
+        params.get("setname") == "gamma"
+        for endpoint, params in calls
+        if not endpoint.startswith("get")
+    )
+
+
+@pytest.mark.unit
+def test_bulk_run_checks_writes(bulk_ferry, fake_ferry_api, tmp_path):
+    path = tmp_path / "sets.csv"
+    path.write_text(CSV)
+    # FERRY doesn't show g1 in its unit, though adding it succeeded
+    bulk_ferry.responses["getGroupUnits"] = []
+    bulk_ferry.add(
+        "getGroupUnits",
+        lambda request: {
+            "ferry_status": "success",
+            "ferry_output": (
+                [{"unitname": "unit"}] if _params(request)["groupname"] == "g2" else []
+            ),
+        },
+    )
+    workflow = BulkNewCapabilitySet()
+    workflow.concurrency = 4
+    report = workflow.run(
+        fake_ferry_api(debug_level=DebugLevel.QUIET), {"file": str(path)}
+    )
+
+    assert [(entry["setname"], entry["status"]) for entry in report] == [
+        ("alpha", "failed"),
+        ("beta", "failed"),
+        ("gamma", "up to date"),
+    ]
+    assert report[0]["error"] == "Group g1 does not belong to unit unit"
+    # g1 is checked once, for both of its rows
+    assert [
+        _params(request)["groupname"]
+        for request in bulk_ferry.requests
+        if _endpoint(request) == "getGroupUnits"
+    ].count("g1") == 2
+    # The check fails before g1's capability sets and FQANs are made, as in newCapabilitySet
+    assert sorted(
+        _endpoint(request)
+        for request in bulk_ferry.requests
+        if not _endpoint(request).startswith("get")
+    ) == ["addGroupToUnit", "addUserToGroup", "createGroup"]
+
+
+@pytest.mark.unit
+def test_bulk_run_checks_group_first(bulk_ferry, fake_ferry_api, tmp_path):
+    path = tmp_path / "sets.csv"
+    path.write_text(CSV)
+    # gid 1001 turns out to belong to another group
+    bulk_ferry.responses["getGroupName"] = []
+    bulk_ferry.add(
+        "getGroupName", {"ferry_status": "success", "ferry_output": {"groupname": "x"}}
+    )
+    report = BulkNewCapabilitySet().run(
+        fake_ferry_api(debug_level=DebugLevel.QUIET), {"file": str(path)}
+    )
+    assert [entry["status"] for entry in report] == ["failed", "failed", "up to date"]
+    assert report[0]["error"] == "Group name mismatch"
+    # Nothing is added to the group once its check fails
+    assert [
+        _endpoint(request)
+        for request in bulk_ferry.requests
+        if not _endpoint(request).startswith("get")
+    ] == ["createGroup"]
+
+
+@pytest.mark.unit
+def test_bulk_invalid_rows_write_nothing(bulk_ferry, fake_ferry_api, tmp_path):
+    path = tmp_path / "sets.jsonl"
+    path.write_text(json.dumps({"setname": "alpha"}) + "\n")
+    with pytest.raises(ValueError, match="line 1: Missing groupname"):
+        BulkNewCapabilitySet().run(fake_ferry_api(), {"file": str(path)})
+    assert bulk_ferry.requests == []
+
+
+@pytest.mark.unit
+def test_bulk_no_rows(bulk_ferry, fake_ferry_api, monkeypatch):
+    # e.g. stdin was empty, as it is when the call was forwarded to a daemon
+    monkeypatch.setattr("sys.stdin", io.StringIO(""))
+    with pytest.raises(ValueError, match="No capability sets in stdin"):
+        BulkNewCapabilitySet().run(
+            fake_ferry_api(), {"file": "-", "input_format": "csv"}
+        )
+    assert bulk_ferry.requests == []
+
+
+@pytest.mark.unit
+def test_bulk_plan(bulk_ferry, fake_ferry_api, tmp_path):
+    path = tmp_path / "sets.csv"
+    path.write_text(CSV)
+    workflow = BulkNewCapabilitySet()
+    workflow.plan_only = True
+    plan = workflow.reconcile(
+        fake_ferry_api(debug_level=DebugLevel.QUIET), {"file": str(path)}
+    )
+    assert [call["endpoint"] for call in plan] == [
+        "createGroup",
+        "addGroupToUnit",
+        "createCapabilitySet",
+        "addCapabilitySetToFQAN",
+        # beta's writes, other than the group's, which alpha's already cover
+        "addUserToGroup",
+        "createCapabilitySet",
+        "createFQAN",
+        "addCapabilitySetToFQAN",
+    ]
+    assert all(_endpoint(request).startswith("get") for request in bulk_ferry.requests)
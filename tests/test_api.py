@@ -6,7 +6,7 @@ import json
 import os
 
 from ferry_cli.helpers.api import FerryAPI
-from ferry_cli.helpers.auth import AuthToken
+from ferry_cli.helpers.auth import Auth, AuthToken
 
 TokenGetCommand = "htgettoken"
 tokenDestroyCommand = "htdestroytoken"
@@ -119,6 +119,78 @@ def test_getAllGroups(getEncodedToken, sendToEndpoint):
     assert result["ferry_output"]  # Make sure we got non-empty result
 
 
+class TestSession:
+    @pytest.mark.unit
+    def test_session_reused_and_authorized_once(self, fake_ferry):
+        calls = []
+
+        class CountingAuth(Auth):
+            def __call__(self, s):
+                calls.append(s)
+                return s
+
+        api = FerryAPI("https://ferry.example.com/", CountingAuth())
+        api.get_session().mount("https://", fake_ferry.adapter)
+        fake_ferry.add("getAllGroups", {"ferry_status": "success", "ferry_output": []})
+
+        for _ in range(3):
+            assert api.call_endpoint("getAllGroups")["ferry_status"] == "success"
+        assert len(calls) == 1
+        assert len(fake_ferry.requests) == 3
+
+    @pytest.mark.unit
+    def test_session_created_once_by_concurrent_calls(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        calls = []
+
+        class SlowAuth(Auth):
+            def __call__(self, s):
+                calls.append(s)
+                # Long enough for the other threads to ask for the session meanwhile
+                time.sleep(0.05)
+                return s
+
+        api = FerryAPI("https://ferry.example.com/", SlowAuth())
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            sessions = list(executor.map(lambda _: api.get_session(), range(8)))
+        assert len(calls) == 1
+        assert all(session is sessions[0] for session in sessions)
+
+    @pytest.mark.unit
+    def test_session_pool_settings(self):
+        api = FerryAPI(
+            "https://ferry.example.com/",
+            Auth(),
+            pool_connections=3,
+            pool_maxsize=7,
+            max_retries=2,
+            keep_alive=False,
+        )
+        # Auth() is the abstract base, so don't let it touch the session
+        api.authorizer = lambda s: s
+        session = api.get_session()
+        adapter = session.get_adapter("https://ferry.example.com/")
+        assert adapter._pool_connections == 3
+        assert adapter._pool_maxsize == 7
+        assert adapter.max_retries.total == 2
+        assert session.headers["Connection"] == "close"
+
+    @pytest.mark.unit
+    def test_dryrun_creates_no_session(self):
+        api = FerryAPI("https://ferry.example.com/", Auth(), dryrun=True)
+        assert api.call_endpoint("getAllGroups") is None
+        assert api._session is None
+
+    @pytest.mark.unit
+    def test_close(self, fake_ferry_api):
+        api = fake_ferry_api()
+        session = api.get_session()
+        api.close()
+        assert api._session is None
+        assert api.get_session() is not session
+
+
 # --- test helper functions
 
 
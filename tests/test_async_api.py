@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ferry_cli.helpers.async_api import AsyncFerryAPI
+
+
+def _make_slow(fake_ferry, delay=0.05):
+    """Make fake_ferry take delay seconds per request, and record the most requests it ever had in flight"""
+    state = {"in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+    send = fake_ferry._send
+
+    def _slow_send(request, **kwargs):
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        try:
+            time.sleep(delay)
+            return send(request, **kwargs)
+        finally:
+            with lock:
+                state["in_flight"] -= 1
+
+    fake_ferry._send = _slow_send
+    return state
+
+
+@pytest.mark.unit
+def test_call_endpoint(fake_ferry, fake_ferry_api):
+    fake_ferry.add("getUserInfo", {"ferry_status": "success", "ferry_output": {}})
+    api = AsyncFerryAPI.from_api(fake_ferry_api())
+    result = asyncio.run(
+        api.call_endpoint("getUserInfo", params={"username": "johndoe"})
+    )
+    api.close()
+    assert result["ferry_status"] == "success"
+    assert result["request_url"].endswith("getUserInfo?username=johndoe")
+
+
+@pytest.mark.unit
+def test_gather_endpoints_bounded(fake_ferry, fake_ferry_api):
+    fake_ferry.add("getUserInfo", {"ferry_status": "success"})
+    state = _make_slow(fake_ferry)
+    api = AsyncFerryAPI.from_api(fake_ferry_api(pool_maxsize=3), concurrency=3)
+    calls = [
+        {"endpoint": "getUserInfo", "params": {"username": f"user{i}"}}
+        for i in range(12)
+    ]
+    results = asyncio.run(api.gather_endpoints(calls))
+    api.close()
+
+    # Results come back in the order of the calls
+    assert [r["request_url"].rsplit("=", 1)[1] for r in results] == [
+        f"user{i}" for i in range(12)
+    ]
+    assert 1 < state["max_in_flight"] <= 3
+    # All calls shared one session
+    assert len(fake_ferry.requests) == 12
+
+
+@pytest.mark.unit
+def test_iter_completed_collects_errors(fake_ferry, fake_ferry_api):
+    fake_ferry.add("getUserInfo", {"ferry_status": "success"})
+    fake_ferry.add("getGroupInfo", ValueError("boom"))
+    api = AsyncFerryAPI.from_api(fake_ferry_api(), concurrency=2)
+
+    async def _collect():
+        return [
+            item
+            async for item in api.iter_completed(
+                [{"endpoint": "getUserInfo"}, {"endpoint": "getGroupInfo"}]
+            )
+        ]
+
+    results = sorted(asyncio.run(_collect()), key=lambda item: item[0])
+    api.close()
+    assert results[0][1]["ferry_status"] == "success"
+    assert results[0][2] is None
+    assert results[1][1] is None
+    assert isinstance(results[1][2], ValueError)
+
+
+@pytest.mark.unit
+def test_dryrun(capsys):
+    async def _run():
+        async with AsyncFerryAPI(
+            "https://ferry.example.com/", dryrun=True, concurrency=2
+        ) as api:
+            return await api.gather_endpoints(
+                [{"endpoint": "getUserInfo", "params": {"username": "johndoe"}}]
+            )
+
+    assert asyncio.run(_run()) == [None]
+    assert (
+        "Would call endpoint: https://ferry.example.com/getUserInfo with params\n{'username': 'johndoe'}"
+        in capsys.readouterr().out
+    )
+
+
+@pytest.mark.unit
+def test_pool_grows_to_concurrency():
+    api = AsyncFerryAPI("https://ferry.example.com/", concurrency=32, pool_maxsize=4)
+    assert api.api.pool_maxsize == 32
+    api.close()
+    with pytest.raises(ValueError):
+        AsyncFerryAPI("https://ferry.example.com/", concurrency=0)
@@ -0,0 +1,206 @@
+import io
+import json
+
+import pytest
+
+from ferry_cli.__main__ import FerryCLI
+from ferry_cli.helpers import batch
+from ferry_cli.helpers.async_api import AsyncFerryAPI
+from ferry_cli.helpers.resilience import RetryPolicy
+from ferry_cli.helpers.endpoint_index import (
+    EndpointIndex,
+    EndpointParsers,
+    compile_endpoint_index,
+)
+
+SWAGGER = {
+    "info": {"version": "3.1.0"},
+    "paths": {
+        "/getUserInfo": {
+            "get": {
+                "description": "For a specific user, returns the entity attributes.",
+                "parameters": [
+                    {
+                        "name": "username",
+                        "description": "user for whom the attributes are to be returned",
+                        "type": "string",
+                        "required": True,
+                    },
+                ],
+            }
+        },
+        "/createUser": {"put": {"description": "Creates a user.", "parameters": []}},
+        "/createGroup": {
+            "put": {
+                "description": "Creates a group.",
+                "parameters": [
+                    {
+                        "name": "groupname",
+                        "description": "name of the group",
+                        "type": "string",
+                        "required": True,
+                    },
+                ],
+            }
+        },
+    },
+}
+
+
+@pytest.fixture
+def ferry_cli(tmp_path, fake_ferry_api):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\nbase_url = https://ferry.example.com/\ndev_url = https://ferry.example.com/\n"
+    )
+    cli = FerryCLI(config_path=config_file)
+    cli.endpoints = EndpointParsers(
+        EndpointIndex.from_compiled(compile_endpoint_index(SWAGGER, "fakehash"))
+    )
+    cli.ferry_api = fake_ferry_api(pool_maxsize=4)
+    return cli
+
+
+@pytest.mark.unit
+def test_read_batch():
+    source = io.StringIO(
+        '{"endpoint": "getUserInfo", "params": {"username": "a"}}\n'
+        "\n"
+        '{"endpoint": "getAllGroups"}\n'
+        '{"endpoint": "createGroup", "method": "PUT", "params": {"groupname": "g"}}\n'
+    )
+    assert batch.read_batch(source) == [
+        batch.BatchCall(1, "getUserInfo", {"username": "a"}),
+        batch.BatchCall(3, "getAllGroups", {}),
+        batch.BatchCall(4, "createGroup", {"groupname": "g"}, "PUT"),
+    ]
+
+
+@pytest.mark.unit
+def test_read_batch_reports_all_errors():
+    source = io.StringIO('not json\n{"params": {}}\n{"endpoint": "x", "params": []}\n')
+    with pytest.raises(ValueError) as e:
+        batch.read_batch(source)
+    message = str(e.value)
+    assert "line 1: Invalid JSON" in message
+    assert 'line 2: Missing "endpoint"' in message
+    assert "line 3:" in message
+
+
+@pytest.mark.unit
+def test_params_to_args():
+    assert batch.params_to_args(
+        {"username": "johndoe", "uid": 1234, "status": True, "skip": None}
+    ) == ["--username", "johndoe", "--uid", "1234", "--status", "true"]
+
+
+@pytest.mark.unit
+def test_prepare_batch_checks_every_line(ferry_cli):
+    calls = [
+        batch.BatchCall(1, "getUserInfo", {"username": "a"}),
+        batch.BatchCall(2, "notAnEndpoint", {}),
+        batch.BatchCall(3, "getUserInfo", {}),
+    ]
+    with pytest.raises(ValueError) as e:
+        batch.prepare_batch(
+            calls,
+            ferry_cli.parse_endpoint_params,
+            ferry_cli.safeguards.verify,
+            ferry_cli.endpoints.method,
+        )
+    message = str(e.value)
+    assert "line 2: Error: 'notAnEndpoint' is not a valid endpoint" in message
+    assert "line 3:" in message and "--username" in message
+    assert "line 1" not in message
+
+
+@pytest.mark.unit
+def test_prepare_batch_safeguards(ferry_cli):
+    with pytest.raises(SystemExit):
+        batch.prepare_batch(
+            [batch.BatchCall(1, "createUser", {})],
+            ferry_cli.parse_endpoint_params,
+            ferry_cli.safeguards.verify,
+            ferry_cli.endpoints.method,
+        )
+
+
+@pytest.mark.unit
+def test_prepare_batch_methods(ferry_cli):
+    calls = [
+        batch.BatchCall(1, "getUserInfo", {"username": "a"}),
+        batch.BatchCall(2, "createGroup", {"groupname": "g"}, "put"),
+        batch.BatchCall(3, "createGroup", {"groupname": "g"}, "GET"),
+    ]
+    args = (
+        ferry_cli.parse_endpoint_params,
+        ferry_cli.safeguards.verify,
+        ferry_cli.endpoints.method,
+    )
+    with pytest.raises(ValueError) as e:
+        batch.prepare_batch(calls, *args)
+    assert "line 3: createGroup is called with PUT, not GET" in str(e.value)
+    # Every call gets its endpoint's method, whether or not its line gave one
+    prepared = batch.prepare_batch(calls[:2], *args)
+    assert [call.method for call in prepared] == ["GET", "PUT"]
+
+
+@pytest.mark.unit
+def test_run_batch(fake_ferry, fake_ferry_api):
+    fake_ferry.add("getUserInfo", {"ferry_status": "success"})
+    fake_ferry.add("getGroupInfo", ConnectionError("unreachable"))
+    calls = [
+        batch.BatchCall(1, "getUserInfo", {"username": "a"}),
+        batch.BatchCall(2, "getGroupInfo", {}),
+        batch.BatchCall(4, "getUserInfo", {"username": "b"}),
+    ]
+    out = io.StringIO()
+    api = AsyncFerryAPI.from_api(fake_ferry_api(), concurrency=2)
+    assert batch.run_batch(api, calls, out) == 1
+    api.close()
+
+    records = sorted(
+        (json.loads(line) for line in out.getvalue().splitlines()),
+        key=lambda record: record["line"],
+    )
+    assert [record["line"] for record in records] == [1, 2, 4]
+    assert records[0]["result"]["ferry_status"] == "success"
+    assert records[1] == {
+        "line": 2,
+        "endpoint": "getGroupInfo",
+        "error": "unreachable",
+    }
+    assert records[2]["result"]["request_url"].endswith("username=b")
+
+
+@pytest.mark.unit
+def test_execute_batch(ferry_cli, fake_ferry, tmp_path, capsys):
+    fake_ferry.add("getUserInfo", {"ferry_status": "success"})
+    batch_file = tmp_path / "batch.jsonl"
+    batch_file.write_text(
+        "\n".join(
+            json.dumps({"endpoint": "getUserInfo", "params": {"username": f"u{i}"}})
+            for i in range(10)
+        )
+    )
+    ferry_cli.execute_batch(str(batch_file), concurrency=4)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(record["line"] for record in records) == list(range(1, 11))
+    assert all(record["result"]["ferry_status"] == "success" for record in records)
+    assert len(fake_ferry.requests) == 10
+
+
+@pytest.mark.unit
+def test_writes_sent_with_their_method(ferry_cli, fake_ferry, fake_ferry_api, tmp_path):
+    # Writes are made with their endpoint's method, and so aren't retried
+    ferry_cli.ferry_api = fake_ferry_api(retry_policy=RetryPolicy(retries=2, backoff=0))
+    fake_ferry.add("createGroup", {"ferry_status": "failure"}, status=503)
+    ferry_cli.execute_endpoint("createGroup", ["--groupname", "g1"])
+    assert [request.method for request in fake_ferry.requests] == ["PUT"]
+
+    batch_file = tmp_path / "batch.jsonl"
+    batch_file.write_text(
+        json.dumps({"endpoint": "createGroup", "params": {"groupname": "g2"}})
+    )
+    ferry_cli.execute_batch(str(batch_file), concurrency=1)
+    assert [request.method for request in fake_ferry.requests] == ["PUT", "PUT"]
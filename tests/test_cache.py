@@ -0,0 +1,298 @@
+import json
+import os
+import time
+
+import pytest
+
+from ferry_cli.helpers.cache import ResponseCache
+
+BASE_URL = "https://ferry.example.com/"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(tmp_path / "cache", ttls={"getUserInfo": 60})
+
+
+@pytest.mark.unit
+def test_get_put(cache):
+    params = {"username": "johndoe", "uid": None}
+    assert cache.get(BASE_URL, "getUserInfo", params) is None
+    cache.put(BASE_URL, "getUserInfo", params, {"ferry_output": [1]})
+    # Parameter order doesn't matter
+    assert cache.get(BASE_URL, "getUserInfo", {"uid": None, "username": "johndoe"}) == {
+        "ferry_output": [1]
+    }
+    assert cache.get(BASE_URL, "getUserInfo", {"username": "janedoe"}) is None
+    assert cache.get("https://other.example.com/", "getUserInfo", params) is None
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (1, 3, 1)
+
+
+@pytest.mark.unit
+def test_identities_are_kept_apart(tmp_path):
+    alice = ResponseCache(tmp_path, identity="alice")
+    bob = ResponseCache(tmp_path, identity="bob")
+    alice.put(BASE_URL, "getAllGroups", {}, {"ferry_output": "alice"})
+    assert bob.get(BASE_URL, "getAllGroups", {}) is None
+    assert alice.get(BASE_URL, "getAllGroups", {}) == {"ferry_output": "alice"}
+
+
+@pytest.mark.unit
+def test_ttls(cache, monkeypatch):
+    # Defaults, overrides and config-style lowercased names
+    assert cache.cacheable("getAllGroups")
+    assert cache.cacheable("getUserInfo")
+    assert not cache.cacheable("getGroupMembers")
+    assert (
+        ResponseCache(cache.cache_dir, ttls={"getallgroups": 5}).ttl("getAllGroups")
+        == 5
+    )
+    assert not ResponseCache(cache.cache_dir, ttls={"getAllGroups": 0}).cacheable(
+        "getAllGroups"
+    )
+
+    cache.put(BASE_URL, "getUserInfo", {}, {"ferry_output": []})
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get(BASE_URL, "getUserInfo", {}) is None
+    # Expired entries are removed
+    assert not list(cache._scan())
+
+
+@pytest.mark.unit
+def test_lru_eviction(tmp_path):
+    entry_size = len(
+        json.dumps(
+            {
+                "stored": time.time(),
+                "endpoint": "getUserInfo",
+                "params": {"username": "user0"},
+                "response": {"ferry_output": "x" * 1000},
+            }
+        )
+    )
+    # Room for three entries
+    cache = ResponseCache(
+        tmp_path,
+        ttls={"getUserInfo": 60},
+        max_size_mb=(entry_size * 3.5) / (1024 * 1024),
+    )
+    for i in range(3):
+        cache.put(
+            BASE_URL,
+            "getUserInfo",
+            {"username": f"user{i}"},
+            {"ferry_output": "x" * 1000},
+        )
+    # Make sure user0 is the most recently used, so user1 is evicted next
+    paths = {
+        i: cache._entry_path(BASE_URL, "getUserInfo", {"username": f"user{i}"})
+        for i in range(3)
+    }
+    for i, age in ((0, 1), (1, 3), (2, 2)):
+        stamp = time.time() - age
+        os.utime(paths[i], (stamp, stamp))
+
+    cache.put(
+        BASE_URL, "getUserInfo", {"username": "user3"}, {"ferry_output": "x" * 1000}
+    )
+    assert cache.stats.evictions == 1
+    assert not paths[1].exists()
+    assert paths[0].exists() and paths[2].exists()
+
+
+class TestFerryAPICache:
+    @pytest.fixture
+    def api(self, fake_ferry_api, cache):
+        return fake_ferry_api(cache=cache)
+
+    @pytest.mark.unit
+    def test_get_served_from_cache(self, api, fake_ferry):
+        fake_ferry.add("getAllGroups", {"ferry_status": "success", "ferry_output": [1]})
+        first = api.call_endpoint("getAllGroups")
+        second = api.call_endpoint("getAllGroups")
+        assert first == second
+        assert len(fake_ferry.requests) == 1
+
+    @pytest.mark.unit
+    def test_refresh_and_use_cache(self, api, fake_ferry):
+        fake_ferry.add("getAllGroups", {"ferry_status": "success", "ferry_output": [1]})
+        fake_ferry.add("getAllGroups", {"ferry_status": "success", "ferry_output": [2]})
+        api.call_endpoint("getAllGroups")
+
+        assert api.call_endpoint("getAllGroups", use_cache=False)["ferry_output"] == [2]
+        # use_cache=False neither reads nor stores
+        assert api.call_endpoint("getAllGroups")["ferry_output"] == [1]
+
+        api.refresh_cache = True
+        assert api.call_endpoint("getAllGroups")["ferry_output"] == [2]
+        api.refresh_cache = False
+        assert api.call_endpoint("getAllGroups")["ferry_output"] == [2]
+        assert len(fake_ferry.requests) == 3
+
+    @pytest.mark.unit
+    def test_failures_and_writes_not_cached(self, api, fake_ferry):
+        fake_ferry.add("getAllGroups", {"ferry_status": "failure"}, status=500)
+        fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+        fake_ferry.add("createGroup", {"ferry_status": "success"})
+        api.call_endpoint("getAllGroups")
+        api.call_endpoint("getAllGroups")
+        api.call_endpoint("createGroup", method="put")
+        api.call_endpoint("createGroup", method="put")
+        assert len(fake_ferry.requests) == 4
+        assert api.cache.stats.stores == 1
+
+    @pytest.mark.unit
+    def test_uncached_endpoints(self, api, fake_ferry):
+        fake_ferry.add("getGroupMembers", {"ferry_status": "success"})
+        api.call_endpoint("getGroupMembers")
+        api.call_endpoint("getGroupMembers")
+        assert len(fake_ferry.requests) == 2
+        assert api.cache.stats.misses == 0
+
+
+@pytest.mark.unit
+def test_invalidate(tmp_path):
+    cache = ResponseCache(tmp_path, default_ttl=60)
+    cache.put(BASE_URL, "getAllGroups", {}, {"ferry_output": []})
+    cache.put(BASE_URL, "getGroupMembers", {"groupname": "g1"}, {"ferry_output": []})
+    cache.put(BASE_URL, "getGroupMembers", {"groupname": "g2"}, {"ferry_output": []})
+    cache.put(BASE_URL, "getUserInfo", {"username": "u1"}, {"ferry_output": []})
+
+    cache.invalidate(
+        {"groupname": "g1", "username": "u2"}, ["getAllGroups", "getGroupMembers"]
+    )
+    assert cache.get(BASE_URL, "getAllGroups", {}) is None
+    assert cache.get(BASE_URL, "getGroupMembers", {"groupname": "g1"}) is None
+    assert cache.get(BASE_URL, "getGroupMembers", {"groupname": "g2"}) is not None
+    # Not related to the write
+    assert cache.get(BASE_URL, "getUserInfo", {"username": "u1"}) is not None
+    assert cache.stats.invalidations == 2
+
+    # Unknown writes clear everything
+    cache.invalidate({"groupname": "g1"}, None)
+    assert not list(cache._scan())
+
+
+class TestFerryAPIInvalidation:
+    @pytest.fixture
+    def api(self, fake_ferry, fake_ferry_api, tmp_path):
+        from ferry_cli.helpers.endpoint_index import EndpointIndex
+
+        fake_ferry.add("getGroupMembers", {"ferry_status": "success"})
+        fake_ferry.add("getUserInfo", {"ferry_status": "success"})
+        fake_ferry.add("addUserToGroup", {"ferry_status": "success"})
+        fake_ferry.add("unknownWrite", {"ferry_status": "success"})
+        api = fake_ferry_api(cache=ResponseCache(tmp_path, default_ttl=60))
+        api.endpoint_index = EndpointIndex.from_compiled(
+            {
+                "endpoints": {
+                    "addUserToGroup": {
+                        "method": "PUT",
+                        "invalidates": ["getGroupMembers"],
+                    }
+                }
+            }
+        )
+        return api
+
+    def _fill(self, api):
+        api.call_endpoint("getGroupMembers", params={"groupname": "g1"})
+        api.call_endpoint("getUserInfo", params={"username": "u1"})
+
+    @pytest.mark.unit
+    def test_write_invalidates_related_reads(self, api, fake_ferry):
+        self._fill(api)
+        api.call_endpoint(
+            "addUserToGroup", method="put", params={"groupname": "g1", "username": "u1"}
+        )
+        self._fill(api)
+        # Only getGroupMembers was fetched again
+        assert [r.url.split("?")[0].rsplit("/", 1)[1] for r in fake_ferry.requests] == [
+            "getGroupMembers",
+            "getUserInfo",
+            "addUserToGroup",
+            "getGroupMembers",
+        ]
+
+    @pytest.mark.unit
+    def test_unknown_write_clears_cache(self, api, fake_ferry):
+        self._fill(api)
+        api.call_endpoint("unknownWrite", method="post")
+        self._fill(api)
+        assert len(fake_ferry.requests) == 5
+
+    @pytest.mark.unit
+    def test_bypassed_cache_still_invalidated(self, api, fake_ferry):
+        self._fill(api)
+        api.bypass_cache = True
+        api.call_endpoint(
+            "addUserToGroup", method="put", params={"groupname": "g1", "username": "u1"}
+        )
+        api.bypass_cache = False
+        self._fill(api)
+        assert len(fake_ferry.requests) == 4
+
+    @pytest.mark.unit
+    def test_failed_write_invalidates(self, api, fake_ferry):
+        self._fill(api)
+        fake_ferry.responses["addUserToGroup"] = [(0, ConnectionError("reset"), {})]
+        with pytest.raises(ConnectionError):
+            api.call_endpoint(
+                "addUserToGroup", method="put", params={"groupname": "g1"}
+            )
+        self._fill(api)
+        assert len(fake_ferry.requests) == 4
+
+
+@pytest.mark.unit
+def test_cli_write_invalidates(fake_ferry, fake_ferry_api, tmp_path):
+    # -e calls are made with their endpoint's method, so writes invalidate cached reads
+    from ferry_cli.__main__ import FerryCLI
+    from ferry_cli.helpers.endpoint_index import (
+        EndpointIndex,
+        EndpointParsers,
+        compile_endpoint_index,
+    )
+
+    def endpoint(method, tag, param):
+        return {
+            method: {
+                "description": f"{tag} endpoint",
+                "tags": [tag],
+                "parameters": [{"name": param, "description": param, "required": True}],
+            }
+        }
+
+    swagger = {
+        "paths": {
+            "/getGroupMembers": endpoint("get", "Groups", "groupname"),
+            "/getUserInfo": endpoint("get", "Users", "username"),
+            "/createGroup": endpoint("put", "Groups", "groupname"),
+        }
+    }
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(f"[api]\nbase_url = {BASE_URL}\ndev_url = {BASE_URL}\n")
+    cli = FerryCLI(config_path=config_file)
+    index = EndpointIndex.from_compiled(compile_endpoint_index(swagger, "fakehash"))
+    cli.endpoints = EndpointParsers(index)
+    cli.ferry_api = fake_ferry_api(cache=ResponseCache(tmp_path, default_ttl=60))
+    cli.ferry_api.endpoint_index = index
+    for name in ("getGroupMembers", "getUserInfo", "createGroup"):
+        fake_ferry.add(name, {"ferry_status": "success"})
+
+    def fill():
+        cli.execute_endpoint("getGroupMembers", ["--groupname", "g1"])
+        cli.execute_endpoint("getUserInfo", ["--username", "u1"])
+
+    fill()
+    cli.execute_endpoint("createGroup", ["--groupname", "g1"])
+    fill()
+    assert [
+        (r.method, r.url.split("?")[0].rsplit("/", 1)[1]) for r in fake_ferry.requests
+    ] == [
+        ("GET", "getGroupMembers"),
+        ("GET", "getUserInfo"),
+        ("PUT", "createGroup"),
+        ("GET", "getGroupMembers"),
+    ]
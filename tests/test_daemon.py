@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from ferry_cli import daemon
+from ferry_cli.config import config
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "daemon.sock")
+    monkeypatch.setenv(daemon.SOCKET_ENV, path)
+    # The client and daemon share a configuration unless a test changes it
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.delenv(daemon.NO_DAEMON_ENV, raising=False)
+    return path
+
+
+@pytest.fixture
+def running_daemon(socket_path):
+    def handler(argv):
+        print(f"argv: {sys.argv[1:]}")
+        print(f"token: {os.environ.get('BEARER_TOKEN')}")
+        print(f"cwd: {os.getcwd()}")
+        if "--fail" in argv:
+            sys.exit(3)
+
+    thread = threading.Thread(target=daemon.serve, args=(handler, socket_path))
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+    yield socket_path
+    daemon._send(socket_path, {"command": "stop"})
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+@pytest.mark.unit
+def test_forward_no_daemon(socket_path):
+    assert daemon.forward(["-e", "getAllGroups"]) is None
+
+
+@pytest.mark.unit
+def test_forward_disabled(running_daemon, monkeypatch):
+    monkeypatch.setenv(daemon.NO_DAEMON_ENV, "1")
+    assert daemon.forward(["-e", "getAllGroups"]) is None
+
+
+@pytest.mark.unit
+def test_forward_round_trip(running_daemon, monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("BEARER_TOKEN", "clienttoken")
+    monkeypatch.chdir(tmp_path)
+    assert daemon.forward(["-e", "getAllGroups"]) == 0
+    out = capsys.readouterr().out
+    assert "argv: ['-e', 'getAllGroups']" in out
+    assert "token: clienttoken" in out
+    assert f"cwd: {tmp_path}" in out
+
+    assert daemon.forward(["--fail"]) == 3
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("variable", ["XDG_CONFIG_HOME", "XDG_CACHE_HOME"])
+def test_forward_refused_with_other_config(
+    running_daemon, monkeypatch, tmp_path, capsys, variable
+):
+    # e.g. a client using a development configuration, while the daemon uses production's
+    monkeypatch.setenv(variable, str(tmp_path / "other"))
+    assert daemon.forward(["-e", "getAllGroups"]) is None
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.unit
+def test_run_request_restores_process_state(monkeypatch):
+    monkeypatch.setenv("BEARER_TOKEN", "daemontoken")
+    argv = sys.argv
+    cwd = os.getcwd()
+
+    def handler(_):
+        print(os.environ["BEARER_TOKEN"])
+        raise ValueError("boom")
+
+    output = []
+    exit_code = daemon.run_request(
+        handler,
+        {"argv": ["-e", "x"], "env": {"BEARER_TOKEN": "clienttoken"}},
+        lambda stream, data: output.append((stream, data)),
+    )
+    assert exit_code == 1
+    assert output == [
+        ("stdout", "clienttoken\n"),
+        ("stdout", "An error occurred while using the FERRY CLI: boom\n"),
+    ]
+    assert sys.argv is argv
+    assert os.getcwd() == cwd
+    assert os.environ["BEARER_TOKEN"] == "daemontoken"
+
+
+@pytest.mark.unit
+def test_output_from_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def handler(_):
+        def work(i):
+            for j in range(200):
+                # One write per line: print writes the end of the line separately
+                sys.stdout.write(f"thread {i} line {j}\n")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(8)))
+
+    output = []
+    # Switch threads often, so that unsynchronized writes would interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        daemon.run_request(
+            handler, {"argv": []}, lambda stream, data: output.append(data)
+        )
+    finally:
+        sys.setswitchinterval(interval)
+    # Every line arrives once, whole
+    lines = "".join(output).splitlines()
+    assert sorted(lines) == sorted(
+        f"thread {i} line {j}" for i in range(8) for j in range(200)
+    )
+
+
+@pytest.mark.unit
+def test_output_is_streamed(socket_path):
+    # The handler only finishes once the client has seen its first line
+    seen_first_line = threading.Event()
+
+    def handler(_):
+        print("first")
+        sys.stdout.write("partial")
+        sys.stdout.flush()
+        print("to stderr", file=sys.stderr)
+        assert seen_first_line.wait(timeout=5)
+        print("last")
+
+    thread = threading.Thread(target=daemon.serve, args=(handler, socket_path))
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+
+    output = []
+
+    def on_output(stream, data):
+        output.append((stream, data))
+        if data == "first\n":
+            seen_first_line.set()
+
+    try:
+        response = daemon._send(
+            socket_path,
+            {"argv": [], **daemon._identity(config.get_configfile_path())},
+            on_output,
+        )
+    finally:
+        daemon._send(socket_path, {"command": "stop"})
+        thread.join(timeout=5)
+    assert response == {"exit_code": 0}
+    assert output == [
+        ("stdout", "first\n"),
+        ("stdout", "partial"),
+        ("stderr", "to stderr\n"),
+        ("stdout", "last\n"),
+    ]
+
+
+@pytest.mark.unit
+def test_serve_refuses_second_daemon(running_daemon):
+    with pytest.raises(RuntimeError):
+        daemon.serve(lambda _: None, running_daemon)
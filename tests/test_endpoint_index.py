@@ -0,0 +1,213 @@
+import json
+import os
+
+import pytest
+
+from ferry_cli.helpers import endpoint_index
+from ferry_cli.helpers.customs import FerryParser
+
+SWAGGER = {
+    "info": {"version": "3.1.0"},
+    "paths": {
+        "/getUserInfo": {
+            "get": {
+                "description": "For a specific user, returns the entity attributes.",
+                "tags": ["Users"],
+                "parameters": [
+                    {
+                        "name": "username",
+                        "description": "user for whom the attributes are to be returned",
+                        "type": "string",
+                        "required": True,
+                    },
+                    {
+                        "name": "uid",
+                        "description": "uid for whom the attributes are to be returned",
+                        "type": "integer",
+                    },
+                ],
+            }
+        },
+        "/createGroup": {
+            "put": {
+                "description": "Creates a new group.",
+                "tags": ["Groups"],
+                "parameters": [],
+            }
+        },
+    },
+}
+
+
+@pytest.fixture
+def swagger_dir(tmp_path):
+    (tmp_path / endpoint_index.SWAGGER_FILENAME).write_text(json.dumps(SWAGGER))
+    return str(tmp_path)
+
+
+@pytest.mark.unit
+def test_compile_endpoint_index():
+    index = endpoint_index.compile_endpoint_index(SWAGGER, "fakehash")
+    assert index["swagger_hash"] == "fakehash"
+    assert index["swagger_version"] == "3.1.0"
+    assert set(index["endpoints"]) == {"getUserInfo", "createGroup"}
+
+    entry = index["endpoints"]["getUserInfo"]
+    assert entry["method"] == "GET"
+    assert entry["tags"] == ["Users"]
+    assert entry["description"] == FerryParser.parse_description(
+        "getUserInfo", "GET", SWAGGER["paths"]["/getUserInfo"]["get"]["description"]
+    )
+    assert [param["name"] for param in entry["parameters"]] == ["username", "uid"]
+    assert entry["parameters"][1]["help"] == FerryParser.parse_description(
+        name="",
+        description="uid for whom the attributes are to be returned",
+        method="integer: optional",
+    )
+    assert index["endpoints"]["createGroup"]["method"] == "PUT"
+
+
+@pytest.mark.unit
+def test_load_endpoint_index_builds_missing_index(swagger_dir):
+    index_file = os.path.join(swagger_dir, endpoint_index.INDEX_FILENAME)
+    assert not os.path.exists(index_file)
+    index = endpoint_index.load_endpoint_index(swagger_dir)
+    assert os.path.exists(index_file)
+    assert "getUserInfo" in index
+    assert index.swagger_version == "3.1.0"
+
+
+@pytest.mark.unit
+def test_load_endpoint_index_uses_stored_index(swagger_dir, monkeypatch):
+    endpoint_index.load_endpoint_index(swagger_dir)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("Index should not have been recompiled")
+
+    monkeypatch.setattr(endpoint_index, "compile_endpoint_index", _fail)
+    index = endpoint_index.load_endpoint_index(swagger_dir)
+    assert sorted(index) == ["createGroup", "getUserInfo"]
+    # Entries are read from disk on demand
+    assert index["createGroup"]["method"] == "PUT"
+    assert index["getUserInfo"]["parameters"][0]["name"] == "username"
+
+
+@pytest.mark.unit
+def test_load_endpoint_index_rebuilds_stale_index(swagger_dir):
+    endpoint_index.load_endpoint_index(swagger_dir)
+
+    new_swagger = dict(SWAGGER)
+    new_swagger["paths"] = {
+        "/getAllGroups": {"get": {"description": "Returns all groups."}}
+    }
+    with open(os.path.join(swagger_dir, endpoint_index.SWAGGER_FILENAME), "w") as f:
+        json.dump(new_swagger, f)
+
+    index = endpoint_index.load_endpoint_index(swagger_dir)
+    assert list(index) == ["getAllGroups"]
+
+
+@pytest.mark.unit
+def test_load_endpoint_index_touched_but_unchanged(swagger_dir, monkeypatch):
+    endpoint_index.load_endpoint_index(swagger_dir)
+    swagger_file = os.path.join(swagger_dir, endpoint_index.SWAGGER_FILENAME)
+    stat = os.stat(swagger_file)
+    os.utime(swagger_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("Index should not have been recompiled")
+
+    # Same content hash, so the stored index is still valid
+    monkeypatch.setattr(endpoint_index, "compile_endpoint_index", _fail)
+    index = endpoint_index.load_endpoint_index(swagger_dir)
+    assert index["getUserInfo"]["method"] == "GET"
+
+    # The refreshed stat stamp was stored, so the next load is served from the stored index
+    monkeypatch.setattr(endpoint_index, "hash_swagger", _fail)
+    endpoint_index.load_endpoint_index(swagger_dir)
+
+
+@pytest.mark.unit
+def test_iter_entries(swagger_dir):
+    endpoint_index.load_endpoint_index(swagger_dir)
+    index = endpoint_index.load_endpoint_index(swagger_dir)
+    entries = dict(index.iter_entries())
+    assert entries == endpoint_index.compile_endpoint_index(SWAGGER, "")["endpoints"]
+
+
+@pytest.mark.unit
+def test_load_endpoint_index_no_swagger(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        endpoint_index.load_endpoint_index(str(tmp_path))
+
+
+class TestEndpointParsers:
+    @pytest.fixture
+    def endpoints(self):
+        return endpoint_index.EndpointParsers(
+            endpoint_index.EndpointIndex.from_compiled(
+                endpoint_index.compile_endpoint_index(SWAGGER, "fakehash")
+            )
+        )
+
+    @pytest.mark.unit
+    def test_parsers_built_on_demand(self, endpoints):
+        assert len(endpoints) == 2
+        assert "getUserInfo" in endpoints
+        assert "notAnEndpoint" not in endpoints
+        assert endpoints.built == []
+
+        parser = endpoints["getUserInfo"]
+        assert endpoints.built == ["getUserInfo"]
+        assert endpoints["getUserInfo"] is parser
+        args, _ = parser.parse_known_args(["--username", "johndoe"])
+        assert vars(args) == {"username": "johndoe", "uid": None}
+
+    @pytest.mark.unit
+    def test_missing_endpoint(self, endpoints):
+        with pytest.raises(KeyError):
+            endpoints["notAnEndpoint"]
+
+    @pytest.mark.unit
+    def test_metadata_does_not_build_parsers(self, endpoints):
+        assert endpoints.method("createGroup") == "PUT"
+        assert endpoints.description("createGroup").startswith("createGroup")
+        assert dict(endpoints.descriptions())["createGroup"].startswith("createGroup")
+        assert endpoints.built == []
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("endpoint", ["getUserInfo", "createGroup"])
+    def test_format_help_matches_parser(self, endpoints, endpoint):
+        expected = endpoint_index.EndpointParsers(endpoints.index)[
+            endpoint
+        ].format_help()
+        assert endpoints.format_help(endpoint) == expected
+        # Only the endpoint asked about has its parser built
+        assert endpoints.built == [endpoint]
+
+
+@pytest.mark.unit
+def test_related_reads():
+    def _entry(method, tags, params):
+        return {
+            "method": method,
+            "tags": tags,
+            "parameters": [{"name": name} for name in params],
+        }
+
+    endpoints = {
+        "getAllGroups": _entry("GET", ["Groups"], []),
+        "getGroupMembers": _entry("GET", ["Groups"], ["groupname"]),
+        "getUserInfo": _entry("GET", ["Users"], ["username"]),
+        "getAllComputeResources": _entry("GET", ["Resources"], []),
+        "addUserToGroup": _entry("PUT", ["Users"], ["username", "groupname"]),
+        "createResource": _entry("PUT", ["Resources"], ["resourcename"]),
+    }
+    assert endpoint_index.related_reads(endpoints) == {
+        "addUserToGroup": ["getGroupMembers", "getUserInfo"],
+        "createResource": ["getAllComputeResources"],
+    }
+
+    compiled = endpoint_index.compile_endpoint_index(SWAGGER, "fakehash")
+    assert compiled["endpoints"]["createGroup"]["invalidates"] == []
+    assert "invalidates" not in compiled["endpoints"]["getUserInfo"]
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay off the cold-start path, since they're only needed when we actually make
+# HTTP calls, prompt for a config file, or run a workflow
+LAZY_MODULES = (
+    "requests",
+    "urllib3",
+    "validators",
+    "socket",
+    "ferry_cli.helpers.cache",
+    "ferry_cli.helpers.journal",
+    "ferry_cli.helpers.output",
+    "ferry_cli.helpers.ratelimit",
+    "ferry_cli.helpers.records",
+    "ferry_cli.helpers.resilience",
+    "ferry_cli.helpers.snapshot",
+    "ferry_cli.helpers.workflows",
+    "ferry_cli.helpers.supported_workflows.BulkNewCapabilitySet",
+    "ferry_cli.helpers.supported_workflows.CloneResource",
+    "ferry_cli.helpers.supported_workflows.GetFilteredGroupInfo",
+    "ferry_cli.helpers.supported_workflows.NewCapabilitySet",
+)
+
+# Cumulative import time budget for ferry_cli.__main__, in milliseconds.  Generous enough to
+# absorb noisy CI machines; override with FERRY_CLI_IMPORT_BUDGET_MS
+IMPORT_BUDGET_MS = float(os.getenv("FERRY_CLI_IMPORT_BUDGET_MS", "100"))
+
+
+def _importtime(args, env=None) -> Dict[str, int]:
+    """Run python -X importtime with args, and return {module: cumulative microseconds}"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+
+@pytest.mark.unit
+def test_import_main_skips_heavy_modules():
+    imports = _importtime(["-c", "import ferry_cli.__main__"])
+    assert "ferry_cli.__main__" in imports
+    for module in LAZY_MODULES:
+        assert module not in imports, f"{module} is imported at startup"
+
+
+@pytest.mark.unit
+def test_import_main_within_budget():
+    # Best of a few runs, so that one slow filesystem access doesn't fail the test
+    best = min(
+        _importtime(["-c", "import ferry_cli.__main__"])["ferry_cli.__main__"]
+        for _ in range(3)
+    )
+    assert (
+        best / 1000 <= IMPORT_BUDGET_MS
+    ), f"Importing ferry_cli.__main__ took {best / 1000:.1f}ms (budget {IMPORT_BUDGET_MS}ms)"
+
+
+@pytest.mark.unit
+def test_version_skips_heavy_modules(tmp_path):
+    config_dir = tmp_path / "ferry_cli"
+    config_dir.mkdir()
+    (config_dir / "config.ini").write_text(
+        "[api]\nbase_url = https://example.com/\ndev_url = https://example.com/\n"
+    )
+    env = dict(os.environ, XDG_CONFIG_HOME=str(tmp_path))
+
+    imports = _importtime(
+        [os.path.join(REPO_ROOT, "bin", "ferry-cli"), "--version"], env
+    )
+    assert imports
+    for module in LAZY_MODULES:
+        assert module not in imports, f"{module} is imported by ferry-cli --version"
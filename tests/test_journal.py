@@ -0,0 +1,88 @@
+import os
+import time
+
+import pytest
+
+from ferry_cli.helpers.journal import JournalError, WorkflowJournal, digest
+
+SERVER = "https://ferry.example.com/"
+ARGS = {"clone": "old", "new_resource": "new", "unitname": "unit"}
+
+
+@pytest.mark.unit
+def test_digest_ignores_key_order():
+    assert digest({"a": 1, "b": [1, 2]}) == digest({"b": [1, 2], "a": 1})
+    assert digest({"a": 1}) != digest({"a": 2})
+
+
+@pytest.mark.unit
+def test_record_and_resume(tmp_path):
+    journal = WorkflowJournal.create(tmp_path, "cloneResource", ARGS, SERVER)
+    assert journal.path == tmp_path / f"{journal.run_id}.jsonl"
+    journal.record("resources", {"old": {"resourcename": "old"}})
+    journal.record("setUserAccess", {}, {"username": "user1"})
+    journal.close()
+    # A line cut off when the run stopped is ignored
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"step": "setUserAccess", "params": {"userna')
+
+    resumed = WorkflowJournal.resume(
+        tmp_path, journal.run_id, "cloneResource", dict(ARGS), SERVER
+    )
+    assert resumed.resumed == 2
+    assert resumed.completed("resources").result == {"old": {"resourcename": "old"}}
+    assert resumed.completed("setUserAccess", {"username": "user1"}) is not None
+    # The same step with other parameters hasn't been done
+    assert resumed.completed("setUserAccess", {"username": "user2"}) is None
+    resumed.close(finished=True)
+
+    with pytest.raises(JournalError, match="already finished"):
+        WorkflowJournal.resume(tmp_path, journal.run_id, "cloneResource", ARGS, SERVER)
+
+
+@pytest.mark.unit
+def test_resume_checks_run(tmp_path):
+    journal = WorkflowJournal.create(tmp_path, "cloneResource", ARGS, SERVER)
+    journal.close()
+    with pytest.raises(JournalError, match="no journal"):
+        WorkflowJournal.resume(tmp_path, "nosuchrun", "cloneResource", ARGS, SERVER)
+    with pytest.raises(JournalError, match="cloneResource workflow"):
+        WorkflowJournal.resume(tmp_path, journal.run_id, "newCapabilitySet", ARGS)
+    with pytest.raises(JournalError, match=r"different arguments \(new_resource\)"):
+        WorkflowJournal.resume(
+            tmp_path,
+            journal.run_id,
+            "cloneResource",
+            {**ARGS, "new_resource": "other"},
+            SERVER,
+        )
+    with pytest.raises(JournalError, match="was against"):
+        WorkflowJournal.resume(
+            tmp_path, journal.run_id, "cloneResource", ARGS, "https://other/"
+        )
+
+
+@pytest.mark.unit
+def test_corrupt_entry_is_redone(tmp_path):
+    journal = WorkflowJournal.create(tmp_path, "cloneResource", ARGS, SERVER)
+    journal.record("resources", [1, 2, 3])
+    journal.close()
+    text = journal.path.read_text()
+    journal.path.write_text(text.replace("[1,2,3]", "[1,2]"))
+    resumed = WorkflowJournal.resume(
+        tmp_path, journal.run_id, "cloneResource", ARGS, SERVER
+    )
+    assert resumed.completed("resources") is None
+    resumed.close()
+
+
+@pytest.mark.unit
+def test_old_journals_pruned(tmp_path):
+    old = WorkflowJournal.create(tmp_path, "cloneResource", ARGS, SERVER)
+    old.close()
+    a_while_ago = time.time() - 31 * 86400
+    os.utime(old.path, (a_while_ago, a_while_ago))
+    new = WorkflowJournal.create(tmp_path, "cloneResource", ARGS, SERVER)
+    new.close()
+    assert not old.path.exists()
+    assert new.path.exists()
@@ -0,0 +1,78 @@
+import io
+import json
+
+import pytest
+
+from ferry_cli.helpers import jsoncodec
+from ferry_cli.helpers.output import write_json
+
+DOCUMENT = {
+    "ferry_status": "success",
+    "ferry_output": [{"username": "café", "uid": 1, "groups": None, "rate": 1.5}],
+}
+
+
+@pytest.fixture(autouse=True)
+def default_codec():
+    jsoncodec.configure()
+    yield
+    jsoncodec.configure()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("backend", jsoncodec.BACKENDS)
+def test_loads_matches_stdlib(backend):
+    jsoncodec.configure(backend)
+    cases = [
+        json.dumps(DOCUMENT),
+        json.dumps(DOCUMENT).encode(),
+        # Beyond what fast backends handle, so the standard library takes over
+        "[123456789012345678901234567890]",
+        b'{"a": [1, -9223372036854775809, 2]}',
+        '{"value": NaN}',
+    ]
+    for case in cases:
+        assert json.dumps(jsoncodec.loads(case)) == json.dumps(json.loads(case))
+    with pytest.raises(ValueError):
+        jsoncodec.loads("{not json")
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("backend", jsoncodec.BACKENDS)
+def test_dumps_compact(backend):
+    jsoncodec.configure(backend)
+    assert json.loads(jsoncodec.dumps_compact(DOCUMENT)) == DOCUMENT
+    # Values JSON can't represent are converted with str()
+    assert json.loads(jsoncodec.dumps_compact({"value": {1, 2}})) == {
+        "value": str({1, 2})
+    }
+
+
+@pytest.mark.unit
+def test_compatible_output():
+    # Compatibility mode (the default) always matches json.dumps, whichever backend is used
+    stream = io.StringIO()
+    write_json(DOCUMENT, stream)
+    assert stream.getvalue() == json.dumps(DOCUMENT, indent=4)
+
+
+@pytest.mark.unit
+def test_fast_output():
+    pytest.importorskip("orjson")
+    jsoncodec.configure("orjson", compatible=False)
+    assert jsoncodec.backend_name() == "orjson"
+    stream = io.StringIO()
+    write_json(DOCUMENT, stream)
+    assert stream.getvalue() != json.dumps(DOCUMENT, indent=4)
+    assert json.loads(stream.getvalue()) == DOCUMENT
+
+
+@pytest.mark.unit
+def test_configure(monkeypatch):
+    with pytest.raises(ValueError):
+        jsoncodec.configure("simdjson")
+
+    # A backend that isn't installed falls back to the standard library
+    monkeypatch.setitem(__import__("sys").modules, "ujson", None)
+    jsoncodec.configure("ujson")
+    assert jsoncodec.backend_name() == "stdlib"
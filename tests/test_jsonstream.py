@@ -0,0 +1,132 @@
+import io
+import json
+
+import pytest
+
+from ferry_cli.helpers.jsonstream import StreamedResponse, parse_response
+from ferry_cli.helpers.output import write_output
+from ferry_cli.helpers.records import Condition, filter_response
+
+RESPONSE = {
+    "ferry_status": "success",
+    "ferry_error": [],
+    "ferry_output": [
+        {"username": "café", "uid": 12345678901234567890, "rate": 1.5e-3},
+        {"username": "bob", "uid": 2, "groups": ["g1", {"nested": [1, 2]}]},
+        {"username": "", "uid": None, "status": True},
+    ],
+    "ferry_count": 3,
+}
+
+
+def chunked(document, size):
+    data = document.encode() if isinstance(document, str) else document
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("size", [1, 7, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_streamed_records(size, indent):
+    response = parse_response(chunked(json.dumps(RESPONSE, indent=indent), size))
+    assert isinstance(response, StreamedResponse)
+    assert response["ferry_status"] == "success"
+    # Keys after ferry_output are only known once the records are read
+    assert response.tail == {}
+    assert list(response["ferry_output"]) == RESPONSE["ferry_output"]
+    assert response.tail == {"ferry_count": 3}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "document",
+    [
+        '[1, 2, {"a": "b"}]',
+        '{"ferry_status": "success", "ferry_output": {"username": "bob"}}',
+        '{"ferry_status": "failure", "ferry_error": ["oops"]}',
+        "{}",
+        '"text"',
+    ],
+)
+def test_not_streamed(document):
+    closed = []
+    response = parse_response(chunked(document, 3), on_close=lambda: closed.append(1))
+    assert not isinstance(response, StreamedResponse)
+    assert response == json.loads(document)
+    assert closed == [1]
+
+
+@pytest.mark.unit
+def test_extra_and_close():
+    closed = []
+    response = parse_response(
+        chunked(json.dumps(RESPONSE), 5),
+        on_close=lambda: closed.append(1),
+        extra={"request_url": "https://ferry.example.com/getAllUsers"},
+    )
+    assert closed == []
+    next(response["ferry_output"])
+    # Stopping early releases the response too
+    response["ferry_output"].close()
+    assert closed == [1]
+
+    response = parse_response(
+        chunked('{"ferry_output": []}', 4),
+        extra={"request_url": "https://ferry.example.com/getAllUsers"},
+    )
+    assert list(response["ferry_output"]) == []
+    assert response.tail == {"request_url": "https://ferry.example.com/getAllUsers"}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "document",
+    [
+        '{"ferry_output": [1, 2',
+        '{"ferry_output": [1 2]}',
+        '{"ferry_output": [1], "a": }',
+        '{"ferry_output": [1]} extra',
+        '{"ferry_status" "success"}',
+    ],
+)
+def test_invalid(document):
+    with pytest.raises(json.JSONDecodeError):
+        response = parse_response(chunked(document, 2))
+        list(response["ferry_output"])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("output_format", ["json", "json-compact", "ndjson", "csv"])
+def test_streamed_output(output_format):
+    # Writing a streamed response gives exactly what writing the parsed response does
+    expected = io.StringIO()
+    write_output(RESPONSE, expected, output_format)
+    actual = io.StringIO()
+    write_output(
+        parse_response(chunked(json.dumps(RESPONSE), 16)), actual, output_format
+    )
+    assert actual.getvalue() == expected.getvalue()
+
+
+@pytest.mark.unit
+def test_streamed_filter():
+    response = parse_response(chunked(json.dumps(RESPONSE), 16))
+    filtered = filter_response(response, ["username"], [Condition("uid > 1")])
+    stream = io.StringIO()
+    write_output(filtered, stream)
+    assert json.loads(stream.getvalue()) == {
+        "ferry_status": "success",
+        "ferry_error": [],
+        "ferry_output": [{"username": "café"}, {"username": "bob"}],
+        "ferry_count": 3,
+    }
+
+
+@pytest.mark.unit
+def test_call_endpoint_stream(fake_ferry, fake_ferry_api):
+    fake_ferry.add("getAllUsers", RESPONSE)
+    api = fake_ferry_api()
+    response = api.call_endpoint("getAllUsers", stream=True)
+    assert isinstance(response, StreamedResponse)
+    assert list(response["ferry_output"]) == RESPONSE["ferry_output"]
+    assert response.tail["request_url"] == "https://ferry.example.com/getAllUsers"
@@ -302,3 +302,170 @@ def test_handle_no_args_configfile_does_not_exist(
 
     assert pytest_wrapped_e.type == SystemExit
     assert pytest_wrapped_e.value.code == 0
+
+
+@pytest.mark.unit
+def test_api_options_from_config(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+        "pool_maxsize = 20\n"
+        "max_retries = 3\n"
+        "keep_alive = False\n"
+    )
+    cli = FerryCLI(config_path=config_file)
+    assert cli.api_options == {
+        "pool_maxsize": 20,
+        "max_retries": 3,
+        "keep_alive": False,
+    }
+    api = cli.make_ferry_api()
+    assert api.pool_maxsize == 20
+    assert api.pool_connections == 10
+    assert api.max_retries == 3
+    assert api.keep_alive is False
+
+
+@pytest.mark.unit
+def test_cache_options_from_config(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+        "[cache]\n"
+        f"directory = {tmp_path / 'cache'}\n"
+        "max_size_mb = 5\n"
+        "[cache-ttl]\n"
+        "getGroupMembers = 30\n"
+        "getAllGroups = 0\n"
+    )
+    cli = FerryCLI(config_path=config_file)
+    cache = cli.get_response_cache()
+    assert cache.cache_dir == tmp_path / "cache"
+    assert cache.max_bytes == 5 * 1024 * 1024
+    assert cache.ttl("getGroupMembers") == 30
+    assert not cache.cacheable("getAllGroups")
+    assert cache.cacheable("getAllComputeResources")
+    assert cli.get_response_cache() is cache
+
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+        "[cache]\n"
+        "enabled = False\n"
+    )
+    assert FerryCLI(config_path=config_file).get_response_cache() is None
+
+
+@pytest.mark.unit
+def test_retry_options_from_config(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+        "[retry]\n"
+        "retries = 5\n"
+        "read_timeout = 30\n"
+        "failure_threshold = 0\n"
+    )
+    api = FerryCLI(config_path=config_file).make_ferry_api()
+    assert api.retry_policy.retries == 5
+    assert api.retry_policy.timeout == (10.0, 30.0)
+    assert api.circuit_breaker.failure_threshold == 0
+    assert api.circuit_breaker.reset_timeout == 30.0
+
+
+@pytest.mark.unit
+def test_preflight_options_from_config(tmp_path, monkeypatch):
+    from ferry_cli.helpers import auth
+
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+        "[authorization]\n"
+        "fail_minutes = 30\n"
+    )
+    monkeypatch.setattr(auth, "_validity_cache", {})
+    monkeypatch.setattr(auth.time, "time", lambda: 1000.0)
+    monkeypatch.setenv("BEARER_TOKEN", "a.eyJleHAiOiAyMDAwfQ.b")  # {"exp": 2000}
+    cli = FerryCLI(config_path=config_file, authorizer=auth.AuthToken())
+    assert cli.preflight_options == {"fail_minutes": 30.0}
+    with pytest.raises(auth.CredentialError, match="at least 30 minutes"):
+        cli.run(auth.DebugLevel.QUIET, False, ["-e", "getAllGroups"])
+
+    cli.preflight_options["preflight_check"] = False
+    cli._check_credentials(auth.DebugLevel.QUIET)
+
+
+@pytest.mark.unit
+def test_plan_needs_a_workflow_that_plans(tmp_path, monkeypatch, capsys):
+    from ferry_cli.helpers import auth
+
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\nbase_url = https://example.com/\ndev_url = https://dev.example.com/\n"
+    )
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("BEARER_TOKEN", "token")
+    cli = FerryCLI(config_path=config_file, authorizer=auth.AuthToken())
+    for args, message in (
+        (
+            ["-w", "getFilteredGroupInfo", "--plan"],
+            "The getFilteredGroupInfo workflow does not support --reconcile or --plan",
+        ),
+        (
+            ["-e", "getAllGroups", "--reconcile"],
+            "--reconcile and --plan can only be used with -w/--workflow",
+        ),
+    ):
+        with pytest.raises(SystemExit) as exit_info:
+            cli.run(auth.DebugLevel.QUIET, False, args)
+        assert exit_info.value.code == 2
+        assert message in capsys.readouterr().err
+
+
+@pytest.mark.unit
+def test_resume_needs_a_workflow_that_writes(tmp_path, monkeypatch):
+    from ferry_cli.helpers import auth
+
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\nbase_url = https://example.com/\ndev_url = https://dev.example.com/\n"
+    )
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("BEARER_TOKEN", "token")
+    cli = FerryCLI(config_path=config_file, authorizer=auth.AuthToken())
+    with pytest.raises(
+        ValueError, match="getFilteredGroupInfo workflow, which makes no writes"
+    ):
+        cli.run(
+            auth.DebugLevel.QUIET,
+            False,
+            ["-w", "getFilteredGroupInfo", "--resume", "run", "--groupname", "g"],
+        )
+    # Runs of workflows that only read aren't journaled
+    assert not (tmp_path / "cache" / "ferry_cli" / "journal").exists()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "args, reads_stdin",
+    [
+        (["--batch", "-"], True),
+        (["--batch=-"], True),
+        (["-w", "bulkNewCapabilitySet", "--file", "-"], True),
+        (["-w", "bulkNewCapabilitySet", "--file=-"], True),
+        (["-w", "bulkNewCapabilitySet", "--file", "sets.csv"], False),
+        (["-e", "getAllGroups", "-"], False),
+    ],
+)
+def test_reads_stdin(args, reads_stdin):
+    # Invocations that read stdin aren't forwarded to a daemon, which can't see it
+    assert _main._reads_stdin(args) is reads_stdin
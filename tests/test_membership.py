@@ -0,0 +1,243 @@
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from ferry_cli.helpers.membership import (
+    CAPABILITY_SET,
+    GROUP,
+    UNIT,
+    USER,
+    MembershipGraphBuilder,
+    fqan_unit,
+    load_membership_graph,
+)
+from ferry_cli.helpers.supported_workflows import SUPPORTED_WORKFLOWS
+
+
+@pytest.fixture
+def graph():
+    builder = MembershipGraphBuilder()
+    for user, group in [
+        ("alice", "g1"),
+        ("alice", "g2"),
+        ("bob", "g2"),
+        ("alice", "g1"),
+    ]:
+        builder.link(USER, user, GROUP, group)
+    builder.link(GROUP, "g1", UNIT, "nova")
+    builder.link(GROUP, "g2", UNIT, "dune")
+    builder.link(UNIT, "nova", CAPABILITY_SET, "cs1")
+    builder.link(CAPABILITY_SET, "cs2", UNIT, "dune")
+    builder.link(UNIT, "nova", CAPABILITY_SET, "cs2")
+    builder.add(CAPABILITY_SET, "unused")
+    return builder.build()
+
+
+@pytest.mark.unit
+def test_forward(graph):
+    assert list(graph.reachable(USER, "alice", CAPABILITY_SET)) == [
+        {"username": "alice", "setname": "cs1", "groups": ["g1"], "units": ["nova"]},
+        {
+            "username": "alice",
+            "setname": "cs2",
+            "groups": ["g1", "g2"],
+            "units": ["dune", "nova"],
+        },
+    ]
+    assert list(graph.reachable(USER, "bob", UNIT)) == [
+        {"username": "bob", "unitname": "dune", "groups": ["g2"]}
+    ]
+    assert list(graph.reachable(GROUP, "g1", UNIT)) == [
+        {"groupname": "g1", "unitname": "nova"}
+    ]
+
+
+@pytest.mark.unit
+def test_reverse(graph):
+    assert list(graph.reachable(CAPABILITY_SET, "cs2", USER)) == [
+        {
+            "setname": "cs2",
+            "username": "alice",
+            "units": ["dune", "nova"],
+            "groups": ["g1", "g2"],
+        },
+        {"setname": "cs2", "username": "bob", "units": ["dune"], "groups": ["g2"]},
+    ]
+    assert list(graph.reachable(CAPABILITY_SET, "unused", USER)) == []
+    assert list(graph.reachable(USER, "nobody", CAPABILITY_SET)) == []
+    assert (USER, "nobody") not in graph
+    with pytest.raises(ValueError):
+        list(graph.reachable(USER, "alice", USER))
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "fqan, unit",
+    [
+        ("/fermilab/Role=Analysis/Capability=NULL", "fermilab"),
+        ("/fermilab/nova/Role=Production", "nova"),
+        ("", None),
+    ],
+)
+def test_fqan_unit(fqan, unit):
+    assert fqan_unit(fqan) == unit
+
+
+def _by_group(responses):
+    def body(request):
+        groupname = parse_qs(urlsplit(request.url).query)["groupname"][0]
+        if groupname not in responses:
+            return {"ferry_status": "failure", "ferry_error": ["no such group"]}
+        return {"ferry_status": "success", "ferry_output": responses[groupname]}
+
+    return body
+
+
+@pytest.mark.unit
+def test_load_and_workflows(fake_ferry, fake_ferry_api, capsys):
+    fake_ferry.add(
+        "getAllGroups",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {"groupname": "g1"},
+                {"groupname": "g2"},
+                {"groupname": "g3"},
+            ],
+        },
+    )
+    fake_ferry.add(
+        "getCapabilitySet",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {
+                    "setname": "cs1",
+                    "roles": [
+                        {"role": "analysis", "fqan": "/fermilab/nova/Role=Analysis"}
+                    ],
+                },
+                {
+                    "setname": "cs2",
+                    "roles": [{"role": "production", "unitname": "dune"}],
+                },
+            ],
+        },
+    )
+    fake_ferry.add(
+        "getGroupMembers",
+        _by_group(
+            {
+                "g1": [{"username": "alice"}],
+                "g2": [{"username": "bob"}, {"username": "alice"}],
+            }
+        ),
+    )
+    fake_ferry.add(
+        "getGroupUnits",
+        _by_group(
+            {"g1": [{"unitname": "nova"}], "g2": [{"unitname": "dune"}], "g3": []}
+        ),
+    )
+    api = fake_ferry_api()
+    graph = load_membership_graph(api, concurrency=4)
+    assert graph.names(GROUP) == ["g1", "g2", "g3"]
+    assert [r["setname"] for r in graph.reachable(USER, "alice", CAPABILITY_SET)] == [
+        "cs1",
+        "cs2",
+    ]
+    # getAllGroups, getCapabilitySet, then two calls per group
+    assert len(fake_ferry.requests) == 8
+
+    workflow = SUPPORTED_WORKFLOWS["getCapabilitySetUsers"]()
+    result = workflow.run(api, {"setname": "cs2, missing"})
+    assert [r["username"] for r in result] == ["alice", "bob"]
+    assert "missing was not found" in capsys.readouterr().out
+
+    workflow = SUPPORTED_WORKFLOWS["getUserCapabilitySets"]()
+    result = workflow.run(api, {"username": "bob"})
+    assert result == [
+        {"username": "bob", "setname": "cs2", "groups": ["g2"], "units": ["dune"]}
+    ]
+
+
+@pytest.mark.unit
+def test_failed_group_calls_reported(fake_ferry, fake_ferry_api, capsys):
+    import requests
+
+    from ferry_cli.helpers.auth import DebugLevel
+
+    fake_ferry.add(
+        "getAllGroups",
+        {"ferry_status": "success", "ferry_output": [{"groupname": "g1"}, {"groupname": "g2"}]},
+    )  # fmt: skip
+    fake_ferry.add("getCapabilitySet", {"ferry_status": "success", "ferry_output": []})
+    members = _by_group({"g1": [{"username": "alice"}], "g2": []})
+    fake_ferry.add(
+        "getGroupMembers",
+        lambda request: (
+            requests.ConnectionError("reset")
+            if "g2" in request.url
+            else members(request)
+        ),
+    )
+    fake_ferry.add("getGroupUnits", _by_group({"g1": [], "g2": []}))
+    api = fake_ferry_api(debug_level=DebugLevel.DEBUG)
+    graph = load_membership_graph(api, concurrency=4)
+    # The other group's responses are still used
+    assert (USER, "alice") in graph
+    assert graph.failed_groups == {"g2": "getGroupMembers failed: reset"}
+    out = capsys.readouterr().out
+    assert "Couldn't fetch the members or units of 1 group(s)" in out
+    assert "  g2: getGroupMembers failed: reset" in out
+    assert "from 6 calls" in out
+
+    workflow = SUPPORTED_WORKFLOWS["getUserCapabilitySets"]()
+    workflow.run(fake_ferry_api(debug_level=DebugLevel.QUIET), {"username": "alice"})
+    assert workflow.failures == 1
+
+
+@pytest.mark.unit
+def test_calls_counted_with_snapshot(fake_ferry, fake_ferry_api, capsys):
+    from ferry_cli.helpers.auth import DebugLevel
+
+    class FreshSnapshot:
+        def is_fresh(self, name):
+            return True
+
+        def query(self, name):
+            return [{"groupname": "g1"}] if name == "groups" else []
+
+    fake_ferry.add("getGroupMembers", _by_group({"g1": []}))
+    fake_ferry.add("getGroupUnits", _by_group({"g1": []}))
+    api = fake_ferry_api(debug_level=DebugLevel.DEBUG)
+    api.snapshot = FreshSnapshot()
+    load_membership_graph(api)
+    # Groups and capability sets come from the snapshot, so only the group's two calls are made
+    assert len(fake_ferry.requests) == 2
+    assert "from 2 calls" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+def test_dryrun(fake_ferry_api, capsys):
+    api = fake_ferry_api(dryrun=True)
+    assert (
+        SUPPORTED_WORKFLOWS["getUserCapabilitySets"]().run(api, {"username": "x"}) == []
+    )
+    assert "getAllGroups" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("name", ["getCapabilitySetUsers", "getUserCapabilitySets"])
+def test_workflow_concurrency(name, monkeypatch, fake_ferry_api):
+    workflow = SUPPORTED_WORKFLOWS[name]()
+    workflow.concurrency = 3
+    seen = []
+    monkeypatch.setattr(
+        sys.modules[type(workflow).__module__],
+        "load_membership_graph",
+        lambda api, concurrency: seen.append(concurrency),
+    )
+    workflow.run(fake_ferry_api(), {"username": "x", "setname": "x"})
+    assert seen == [3]
@@ -0,0 +1,187 @@
+import io
+import json
+import os
+import tracemalloc
+
+import pytest
+
+from ferry_cli.__main__ import FerryCLI
+from ferry_cli.helpers.auth import DebugLevel
+from ferry_cli.helpers import output
+from ferry_cli.helpers.output import (
+    atomic_output,
+    response_records,
+    write_compact_json,
+    write_json,
+    write_output,
+)
+
+RESPONSE = {
+    "ferry_status": "success",
+    "ferry_error": [],
+    "ferry_output": [
+        {"username": f"user{i}", "uid": i, "status": i % 2 == 0, "groups": None}
+        for i in range(3000)
+    ],
+    "unicode": "café ☃",
+    "nested": {"empty": {}, "list": [[], [1.5, -2]]},
+}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "obj", [RESPONSE, [], {}, "a string", 42, None, [{"a": [1, {"b": None}]}]]
+)
+def test_write_json_matches_dumps(obj):
+    stream = io.StringIO()
+    write_json(obj, stream)
+    assert stream.getvalue() == json.dumps(obj, indent=4)
+
+
+@pytest.mark.unit
+def test_write_json_memory():
+    class _NullStream:
+        def write(self, data):
+            pass
+
+    size = len(json.dumps(RESPONSE, indent=4))
+    tracemalloc.start()
+    try:
+        write_json(RESPONSE, _NullStream())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < size / 4
+
+
+@pytest.mark.unit
+def test_atomic_output(tmp_path):
+    path = tmp_path / "out.json"
+    path.write_text("old")
+    os.chmod(path, 0o640)
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(str(path)) as f:
+            f.write("partial")
+            raise RuntimeError("failed")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["out.json"]
+
+    with atomic_output(str(path)) as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ["out.json"]
+
+
+@pytest.mark.unit
+def test_handle_output(tmp_path, capsys):
+    cli = FerryCLI()
+    capsys.readouterr()
+    cli.handle_output(RESPONSE)
+    assert capsys.readouterr().out == json.dumps(RESPONSE, indent=4) + "\n"
+
+    cli.handle_output(RESPONSE, debug_level=DebugLevel.QUIET)
+    assert capsys.readouterr().out == ""
+
+    output_file = tmp_path / "results" / "out.json"
+    cli.handle_output(RESPONSE, str(output_file), DebugLevel.DEBUG)
+    assert output_file.read_text() == json.dumps(RESPONSE, indent=4)
+    assert capsys.readouterr().out == f"Output file: {output_file}\n"
+
+
+USERS = {
+    "ferry_status": "success",
+    "ferry_error": [],
+    "ferry_output": [
+        {"username": "alice", "uid": 1, "banned": False, "groups": ["g1", "g2"]},
+        {"username": "bob, jr", "uid": 2, "banned": True, "groups": None},
+        {"uid": 3, "extra": "dropped"},
+    ],
+}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "obj", [USERS, RESPONSE, [], {}, {1: "int key"}, "text", [[1, [2, {"a": None}]]]]
+)
+def test_write_compact_json(obj):
+    stream = io.StringIO()
+    write_compact_json(obj, stream)
+    assert stream.getvalue() == json.dumps(obj, separators=(",", ":"))
+
+
+@pytest.mark.unit
+def test_response_records(capsys):
+    assert list(response_records(USERS)) == USERS["ferry_output"]
+    assert list(response_records({"ferry_output": {"gid": 5}})) == [{"gid": 5}]
+    assert list(response_records([1, 2])) == [1, 2]
+    assert list(response_records({"ferry_output": None})) == []
+
+    failed = {"ferry_status": "failure", "ferry_error": ["no such user"]}
+    assert list(response_records(failed)) == []
+    assert "FERRY error: no such user" in capsys.readouterr().err
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "output_format, columns, expected",
+    [
+        (
+            "ndjson",
+            None,
+            '{"username":"alice","uid":1,"banned":false,"groups":["g1","g2"]}\n'
+            '{"username":"bob, jr","uid":2,"banned":true,"groups":null}\n'
+            '{"uid":3,"extra":"dropped"}\n',
+        ),
+        (
+            "csv",
+            None,
+            "username,uid,banned,groups\n"
+            'alice,1,false,"[""g1"",""g2""]"\n'
+            '"bob, jr",2,true,\n'
+            ",3,,\n",
+        ),
+        (
+            "tsv",
+            ["uid", "username"],
+            "uid\tusername\n1\talice\n2\tbob, jr\n3\t\n",
+        ),
+        ("json-compact", None, json.dumps(USERS, separators=(",", ":")) + "\n"),
+    ],
+)
+def test_write_output_formats(output_format, columns, expected):
+    stream = io.StringIO()
+    write_output(USERS, stream, output_format, columns)
+    assert stream.getvalue() == expected
+
+
+@pytest.mark.unit
+def test_write_output_batches(monkeypatch):
+    monkeypatch.setattr(output, "RECORD_BATCH", 2)
+    records = [{"n": i} for i in range(5)]
+    stream = io.StringIO()
+    write_output(records, stream, "csv")
+    assert stream.getvalue() == "n\n0\n1\n2\n3\n4\n"
+    stream = io.StringIO()
+    write_output(records, stream, "ndjson")
+    assert stream.getvalue().splitlines() == [
+        json.dumps(r, separators=(",", ":")) for r in records
+    ]
+
+    stream = io.StringIO()
+    write_output([], stream, "csv", ["a", "b"])
+    assert stream.getvalue() == "a,b\n"
+
+
+@pytest.mark.unit
+def test_handle_output_format(tmp_path, capsys):
+    cli = FerryCLI()
+    capsys.readouterr()
+    cli.handle_output(USERS, "", DebugLevel.DEBUG, "tsv", ["username"])
+    # csv quotes a lone empty field, so the row isn't mistaken for a blank line
+    assert capsys.readouterr().out == 'username\nalice\nbob, jr\n""\n'
+
+    output_file = tmp_path / "out.ndjson"
+    cli.handle_output(USERS, str(output_file), output_format="ndjson")
+    assert len(output_file.read_text().splitlines()) == 3
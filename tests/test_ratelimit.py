@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+from ferry_cli.__main__ import FerryCLI
+from ferry_cli.helpers import ratelimit
+from ferry_cli.helpers.auth import DebugLevel
+from ferry_cli.helpers.ratelimit import READ, WRITE, RateLimiter, request_class
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake clock, which sleeping advances.  Returns the list of sleeps"""
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+    monkeypatch.setattr(ratelimit.time, "sleep", sleep)
+    return sleeps
+
+
+@pytest.mark.unit
+def test_request_class():
+    assert request_class("get") == READ
+    assert request_class("GET") == READ
+    assert request_class("put") == WRITE
+    assert request_class("post") == WRITE
+
+
+@pytest.mark.unit
+def test_burst_then_rate(clock):
+    limiter = RateLimiter({READ: (2, 3)})
+    for _ in range(3):
+        assert limiter.acquire(READ) == 0
+    assert not clock
+    assert limiter.acquire(READ) == pytest.approx(0.5)
+    assert limiter.acquire(READ) == pytest.approx(0.5)
+    assert clock == [pytest.approx(0.5), pytest.approx(0.5)]
+
+
+@pytest.mark.unit
+def test_classes_limited_separately(clock):
+    limiter = RateLimiter({WRITE: (1, 1), READ: (0, 1)})
+    assert limiter.acquire(WRITE) == 0
+    # Reads have no limit, so never wait, even while writes do
+    for _ in range(10):
+        assert limiter.acquire(READ) == 0
+    assert limiter.acquire(WRITE) == pytest.approx(1)
+
+
+@pytest.mark.unit
+def test_shared_between_processes(clock, tmp_path):
+    # Two limiters with the same state file stand in for two ferry-cli processes
+    state_file = str(tmp_path / "ratelimit.json")
+    first = RateLimiter({WRITE: (1, 2)}, state_file)
+    second = RateLimiter({WRITE: (1, 2)}, state_file)
+    assert first.acquire(WRITE) == 0
+    assert second.acquire(WRITE) == 0
+    assert first.acquire(WRITE) == pytest.approx(1)
+    assert second.acquire(WRITE) == pytest.approx(1)
+
+
+@pytest.mark.unit
+def test_corrupt_state_file(clock, tmp_path):
+    state_file = tmp_path / "ratelimit.json"
+    state_file.write_text("not json")
+    limiter = RateLimiter({READ: (1, 1)}, str(state_file))
+    assert limiter.acquire(READ) == 0
+    assert limiter.acquire(READ) == pytest.approx(1)
+
+
+@pytest.mark.unit
+def test_shared_between_threads(tmp_path):
+    limiter = RateLimiter({READ: (50, 5)}, str(tmp_path / "ratelimit.json"))
+    waits = []
+
+    def worker():
+        for _ in range(5):
+            waits.append(limiter.acquire(READ))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The burst covers the first 5 calls; the other 15 had to wait for tokens at 50 per second
+    assert len(waits) == 20
+    assert time.monotonic() - start >= 15 / 50 * 0.9
+
+
+@pytest.mark.unit
+def test_ferry_api_rate_limited(fake_ferry_api, fake_ferry):
+    taken = []
+
+    class _Limiter:
+        def acquire(self, kind):
+            taken.append(kind)
+            return 0.0
+
+    fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+    fake_ferry.add("createGroup", {"ferry_status": "success"})
+    api = fake_ferry_api(rate_limiter=_Limiter())
+    api.call_endpoint("getAllGroups")
+    api.call_endpoint("createGroup", method="put")
+    assert taken == [READ, WRITE]
+
+
+@pytest.mark.unit
+def test_cli_writes_limited_as_writes(fake_ferry_api, fake_ferry, tmp_path):
+    from ferry_cli.helpers.endpoint_index import (
+        EndpointIndex,
+        EndpointParsers,
+        compile_endpoint_index,
+    )
+
+    taken = []
+
+    class _Limiter:
+        def acquire(self, kind):
+            taken.append(kind)
+            return 0.0
+
+    swagger = {
+        "paths": {
+            "/getAllGroups": {"get": {"description": "Lists groups."}},
+            "/createGroup": {"put": {"description": "Creates a group."}},
+        }
+    }
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\nbase_url = https://example.com/\ndev_url = https://example.com/\n"
+    )
+    cli = FerryCLI(config_path=config_file)
+    cli.endpoints = EndpointParsers(
+        EndpointIndex.from_compiled(compile_endpoint_index(swagger, "fakehash"))
+    )
+    cli.ferry_api = fake_ferry_api(rate_limiter=_Limiter())
+    fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+    fake_ferry.add("createGroup", {"ferry_status": "success"})
+
+    cli.execute_endpoint("getAllGroups", [])
+    cli.execute_endpoint("createGroup", [])
+    assert taken == [READ, WRITE]
+
+    batch_file = tmp_path / "batch.jsonl"
+    batch_file.write_text('{"endpoint": "createGroup"}\n')
+    cli.execute_batch(str(batch_file), concurrency=1, debug_level=DebugLevel.QUIET)
+    assert taken == [READ, WRITE, WRITE]
+
+
+@pytest.mark.unit
+def test_rate_limit_options_from_config(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com:8443/\n"
+        "dev_url = https://dev.example.com/\n"
+        "[rate-limit]\n"
+        "write_rate = 2\n"
+        "write_burst = 4\n"
+    )
+    cli = FerryCLI(config_path=config_file)
+    api = cli.make_ferry_api()
+    limiter = api.rate_limiter
+    assert limiter.limits == {WRITE: (2.0, 4.0)}
+    assert limiter.state_file == str(
+        tmp_path / "ferry_cli" / "ratelimit-example.com_8443.json"
+    )
+    # Every FerryAPI made by this FerryCLI shares the limiter
+    assert cli.make_ferry_api().rate_limiter is limiter
+
+    config_file.write_text(
+        "[api]\n"
+        "base_url = https://example.com/\n"
+        "dev_url = https://dev.example.com/\n"
+    )
+    assert FerryCLI(config_path=config_file).make_ferry_api().rate_limiter is None
@@ -0,0 +1,122 @@
+import io
+import json
+
+import pytest
+
+from ferry_cli.helpers.output import write_output
+from ferry_cli.helpers.records import (
+    Condition,
+    filter_response,
+    parse_select,
+    select_fields,
+    where,
+)
+
+USERS = [
+    {"username": "alice", "uid": 10, "status": True, "groups": ["g1", "g2"]},
+    {"username": "bob", "uid": 2, "status": False, "groups": []},
+    {"username": "1234", "uid": None, "status": True},
+]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("username == alice", ["alice"]),
+        ("username = 'alice'", []),
+        ('username == "alice"', ["alice"]),
+        ("username == 1234", ["1234"]),
+        ("username != alice", ["bob", "1234"]),
+        ("status == true", ["alice", "1234"]),
+        ("uid == null", ["1234"]),
+        ("uid > 5", ["alice"]),
+        ("uid<=10", ["alice", "bob"]),
+        ("username >= b", ["bob"]),
+        ("groups ~ g2", ["alice"]),
+        ("username !~ o", ["alice", "1234"]),
+        ("missing == x", []),
+        ("missing != x", []),
+    ],
+)
+def test_condition(expression, expected):
+    condition = Condition(expression)
+    assert [user["username"] for user in USERS if condition(user)] == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("expression", ["username", "== alice", "", "a b c"])
+def test_invalid_condition(expression):
+    with pytest.raises(ValueError):
+        Condition(expression)
+
+
+@pytest.mark.unit
+def test_parse_select():
+    assert parse_select("username, uid,") == ["username", "uid"]
+    with pytest.raises(ValueError):
+        parse_select(" , ")
+
+
+@pytest.mark.unit
+def test_lazy():
+    seen = []
+
+    def records():
+        for user in USERS:
+            seen.append(user["username"])
+            yield user
+
+    selected = select_fields(
+        where(records(), [Condition("status == true")]), ["username"]
+    )
+    assert seen == []
+    assert next(selected) == {"username": "alice"}
+    assert seen == ["alice"]
+    assert list(selected) == [{"username": "1234"}]
+
+
+@pytest.mark.unit
+def test_filter_response():
+    response = {"ferry_status": "success", "ferry_error": [], "ferry_output": USERS}
+    filtered = filter_response(
+        response, ["uid", "username"], [Condition("status == true")]
+    )
+    assert filtered["ferry_status"] == "success"
+    assert list(filtered["ferry_output"]) == [
+        {"uid": 10, "username": "alice"},
+        {"uid": None, "username": "1234"},
+    ]
+    # The response itself is left alone
+    assert response["ferry_output"] is USERS
+
+    single = {"ferry_status": "success", "ferry_output": USERS[0]}
+    assert filter_response(single, ["uid"])["ferry_output"] == {"uid": 10}
+    assert filter_response(single, None, [Condition("uid < 5")])["ferry_output"] is None
+
+    assert list(filter_response(USERS, ["username"], None)) == [
+        {"username": "alice"},
+        {"username": "bob"},
+        {"username": "1234"},
+    ]
+    assert filter_response(response) is response
+    failed = {"ferry_status": "failure", "ferry_error": ["oops"]}
+    assert filter_response(failed, ["uid"]) is failed
+
+
+@pytest.mark.unit
+def test_filtered_output():
+    response = {"ferry_status": "success", "ferry_output": USERS}
+    stream = io.StringIO()
+    write_output(filter_response(response, ["username"]), stream)
+    assert json.loads(stream.getvalue())["ferry_output"] == [
+        {"username": "alice"},
+        {"username": "bob"},
+        {"username": "1234"},
+    ]
+
+    stream = io.StringIO()
+    write_output(
+        filter_response(response, None, [Condition("uid >= 2")]), stream, "csv", ["uid"]
+    )
+    assert stream.getvalue() == "uid\n10\n2\n"
@@ -0,0 +1,191 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from ferry_cli.helpers import resilience
+from ferry_cli.helpers.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record sleeps instead of sleeping"""
+    recorded = []
+    monkeypatch.setattr(time, "sleep", recorded.append)
+    return recorded
+
+
+@pytest.mark.unit
+def test_retry_policy():
+    policy = RetryPolicy(retries=2, backoff=1, max_backoff=3)
+    assert policy.retryable("get", 1)
+    assert policy.retryable("GET", 2)
+    assert not policy.retryable("get", 3)
+    assert not policy.retryable("put", 1)
+
+    for attempt, ceiling in ((1, 1), (2, 2), (3, 3), (10, 3)):
+        assert all(0 <= policy.delay(attempt) <= ceiling for _ in range(50))
+
+    assert policy.delay(1, 503, "2") == 2
+    assert policy.delay(1, 429, "100") == 3
+    # Retry-After is only honoured for 429 and 503
+    assert policy.delay(1, 500, "2") <= 1
+
+
+@pytest.mark.unit
+def test_parse_retry_after():
+    assert parse_retry_after("5") == 5
+    assert parse_retry_after("-1") == 0
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after("soon") is None
+
+
+@pytest.mark.unit
+def test_circuit_breaker(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # After reset_timeout, one trial call is let through
+    now[0] += 10
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # A failed trial opens the breaker again straight away
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now[0] += 10
+    breaker.before_call()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_call()
+
+    # A trial released without success or failure lets the next call be the trial
+    breaker.record_failure()
+    breaker.record_failure()
+    now[0] += 10
+    assert breaker.before_call()
+    breaker.release_trial()
+    assert breaker.before_call()
+    assert breaker.is_open
+
+
+@pytest.mark.unit
+def test_circuit_breaker_disabled():
+    breaker = CircuitBreaker(failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    breaker.before_call()
+
+
+class TestFerryAPIRetries:
+    @pytest.fixture
+    def api(self, fake_ferry_api):
+        return fake_ferry_api(
+            retry_policy=RetryPolicy(retries=2, backoff=1),
+            circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60),
+        )
+
+    @pytest.mark.unit
+    def test_get_retried(self, api, fake_ferry, sleeps):
+        fake_ferry.add("getAllGroups", {}, status=503, headers={"Retry-After": "2"})
+        fake_ferry.add("getAllGroups", requests.ConnectionError("reset"))
+        fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+        assert api.call_endpoint("getAllGroups")["ferry_status"] == "success"
+        assert len(fake_ferry.requests) == 3
+        assert sleeps[0] == 2
+        assert 0 <= sleeps[1] <= 2
+
+    @pytest.mark.unit
+    def test_retries_exhausted(self, api, fake_ferry, sleeps):
+        fake_ferry.add("getAllGroups", {"ferry_status": "failure"}, status=500)
+        assert api.call_endpoint("getAllGroups")["ferry_status"] == "failure"
+        assert len(fake_ferry.requests) == 3
+        assert len(sleeps) == 2
+
+    @pytest.mark.unit
+    def test_writes_not_retried(self, api, fake_ferry, sleeps):
+        fake_ferry.add("createGroup", {"ferry_status": "failure"}, status=503)
+        api.call_endpoint("createGroup", method="put")
+        assert len(fake_ferry.requests) == 1
+        assert not sleeps
+
+    @pytest.mark.unit
+    def test_timeout_passed(self, api, fake_ferry):
+        fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+        seen = []
+        send = fake_ferry._send
+
+        def _send(request, **kwargs):
+            seen.append(kwargs.get("timeout"))
+            return send(request, **kwargs)
+
+        fake_ferry._send = _send
+        api.call_endpoint("getAllGroups")
+        assert seen == [(10.0, 120.0)]
+
+    @pytest.mark.unit
+    def test_circuit_breaker_fails_fast(self, api, fake_ferry, sleeps):
+        fake_ferry.add("getAllGroups", {"ferry_status": "failure"}, status=502)
+        api.call_endpoint("getAllGroups")
+        assert len(fake_ferry.requests) == 3
+        with pytest.raises(CircuitOpenError):
+            api.call_endpoint("getAllGroups")
+        assert len(fake_ferry.requests) == 3
+
+    @pytest.mark.unit
+    def test_trial_raising_other_error(self, api, fake_ferry, sleeps, monkeypatch):
+        from ferry_cli.helpers import resilience
+
+        now = [1000.0]
+        monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+        fake_ferry.add("getAllGroups", {"ferry_status": "failure"}, status=502)
+        api.call_endpoint("getAllGroups")
+        assert api.circuit_breaker.is_open
+
+        # The trial fails with an error that isn't a connection failure or timeout
+        now[0] += 60
+        fake_ferry.responses["getAllGroups"] = []
+        fake_ferry.add(
+            "getAllGroups", requests.exceptions.ChunkedEncodingError("cut off")
+        )
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            api.call_endpoint("getAllGroups")
+        # The breaker still lets a trial through, rather than failing fast for good
+        fake_ferry.responses["getAllGroups"] = []
+        fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+        assert api.call_endpoint("getAllGroups")["ferry_status"] == "success"
+        assert not api.circuit_breaker.is_open
+
+    @pytest.mark.unit
+    def test_debug_output(self, fake_ferry_api, fake_ferry, sleeps, capsys):
+        from ferry_cli.helpers.auth import DebugLevel
+
+        api = fake_ferry_api(
+            retry_policy=RetryPolicy(retries=1), debug_level=DebugLevel.DEBUG
+        )
+        fake_ferry.add("getAllGroups", {}, status=429, headers={"Retry-After": "1"})
+        fake_ferry.add("getAllGroups", {"ferry_status": "success"})
+        api.call_endpoint("getAllGroups")
+        assert (
+            "getAllGroups failed (HTTP 429) on attempt 1 of 2; retrying in 1.00s"
+            in capsys.readouterr().out
+        )
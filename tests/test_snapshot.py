@@ -0,0 +1,111 @@
+import pytest
+
+from ferry_cli.helpers.endpoint_index import EndpointIndex
+from ferry_cli.helpers.records import Condition
+from ferry_cli.helpers.snapshot import Snapshot, SnapshotError
+from ferry_cli.helpers.supported_workflows.GetFilteredGroupInfo import (
+    GetFilteredGroupInfo,
+)
+
+GROUPS = [
+    {"groupname": "g1", "gid": 1001, "grouptype": "UnixGroup"},
+    {"groupname": "1234", "gid": 1234, "grouptype": "UnixGroup"},
+    {"groupname": "wilson", "gid": 12345678901234567890, "grouptype": None},
+    {"groupname": "g1", "gid": 1002, "grouptype": "BatchSuperusers", "extra": [1]},
+]
+
+
+@pytest.fixture
+def synced(tmp_path, fake_ferry, fake_ferry_api):
+    fake_ferry.add("getAllGroups", {"ferry_status": "success", "ferry_output": GROUPS})
+    api = fake_ferry_api()
+    snapshot = Snapshot(tmp_path / "snapshot.sqlite3", identity="me")
+    api.snapshot = snapshot
+    assert snapshot.sync(api, "groups") == len(GROUPS)
+    return api, snapshot
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "conditions, expected",
+    [
+        ([], [1001, 1234, 12345678901234567890, 1002]),
+        (["groupname == g1"], [1001, 1002]),
+        (["groupname == 1234"], [1234]),
+        (["gid == 12345678901234567890"], [12345678901234567890]),
+        (["grouptype == null"], [12345678901234567890]),
+        (["groupname == g1", "grouptype ~ Batch"], [1002]),
+        (["extra == [1]"], [1002]),
+        (["gid > 1100"], [1234, 12345678901234567890]),
+        (["groupname == nothing"], []),
+    ],
+)
+def test_query(synced, conditions, expected):
+    _, snapshot = synced
+    records = snapshot.query("groups", [Condition(c) for c in conditions])
+    assert [record["gid"] for record in records] == expected
+
+
+@pytest.mark.unit
+def test_query_uses_index(synced):
+    _, snapshot = synced
+    plan = (
+        snapshot._connect()
+        .execute(
+            'EXPLAIN QUERY PLAN SELECT data FROM "groups" WHERE "groupname" IN (?)',
+            ["g1"],
+        )
+        .fetchall()
+    )
+    assert "groups_groupname" in str(plan)
+
+
+@pytest.mark.unit
+def test_freshness(synced, tmp_path):
+    api, snapshot = synced
+    assert snapshot.is_fresh("groups")
+    assert not snapshot.is_fresh("users")
+    assert snapshot.status()[0]["records"] == len(GROUPS)
+
+    # Snapshots synced with other credentials aren't trusted
+    assert not Snapshot(snapshot.path, identity="someone else").is_fresh("groups")
+    assert not Snapshot(snapshot.path, max_age=0, identity="me").is_fresh("groups")
+
+    # A write that may change groups makes the snapshot stale
+    api.endpoint_index = EndpointIndex(
+        {"createGroup": {"invalidates": ["getAllGroups"]}}
+    )
+    api.call_endpoint("createGroup", method="PUT", params={"groupname": "g2"})
+    assert not snapshot.is_fresh("groups")
+    assert snapshot.status()[0]["stale"]
+
+
+@pytest.mark.unit
+def test_failed_sync_keeps_snapshot(synced, fake_ferry):
+    api, snapshot = synced
+    fake_ferry.add("getAllGroups", {"ferry_status": "failure", "ferry_error": ["no"]})
+    fake_ferry.responses["getAllGroups"].pop(0)
+    with pytest.raises(SnapshotError, match="no"):
+        snapshot.sync(api, "groups")
+    assert len(list(snapshot.query("groups"))) == len(GROUPS)
+
+
+@pytest.mark.unit
+def test_errors(tmp_path):
+    snapshot = Snapshot(tmp_path / "snapshot.sqlite3")
+    with pytest.raises(SnapshotError):
+        snapshot.query("groups")
+    with pytest.raises(SnapshotError):
+        snapshot.collection("widgets")
+    assert snapshot.status() == []
+    assert not snapshot.path.exists()
+
+
+@pytest.mark.unit
+def test_workflow_uses_snapshot(synced, fake_ferry, capsys):
+    api, _ = synced
+    calls = len(fake_ferry.requests)
+    result = GetFilteredGroupInfo().run(api, {"groupname": "g1"})
+    assert [group["gid"] for group in result] == [1001, 1002]
+    assert len(fake_ferry.requests) == calls
+    assert "local snapshot" in capsys.readouterr().out
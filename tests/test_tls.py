@@ -0,0 +1,135 @@
+import http.server
+import json
+import shutil
+import ssl
+import subprocess
+import threading
+
+import pytest
+from urllib3.util.ssl_ import create_urllib3_context
+
+from ferry_cli.helpers import auth
+from ferry_cli.helpers.api import FerryAPI
+from ferry_cli.helpers.resilience import RetryPolicy
+from ferry_cli.helpers.tls import SSLContextAdapter
+
+
+def _openssl(*args, cwd):
+    subprocess.run(["openssl", *args], cwd=cwd, check=True, capture_output=True)
+
+
+@pytest.fixture
+def pki(tmp_path):
+    """A CA directory (hashed, as /etc/grid-security/certificates is), and a server certificate and
+    client proxy signed by the CA"""
+    if shutil.which("openssl") is None:
+        pytest.skip("needs the openssl command")
+    _openssl(
+        "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=Test CA",
+        "-keyout", "ca.key", "-out", "ca.pem", cwd=tmp_path,
+    )  # fmt: skip
+    (tmp_path / "san.cnf").write_text("subjectAltName=DNS:localhost,IP:127.0.0.1\n")
+    for name in ("server", "client"):
+        _openssl(
+            "req", "-newkey", "rsa:2048", "-nodes", "-subj", f"/CN={name}",
+            "-keyout", f"{name}.key", "-out", f"{name}.csr", cwd=tmp_path,
+        )  # fmt: skip
+        _openssl(
+            "x509", "-req", "-in", f"{name}.csr", "-CA", "ca.pem", "-CAkey", "ca.key",
+            "-CAcreateserial", "-days", "1", "-extfile", "san.cnf", "-out", f"{name}.pem",
+            cwd=tmp_path,
+        )  # fmt: skip
+    proxy = tmp_path / "x509up"
+    proxy.write_text(
+        (tmp_path / "client.pem").read_text() + (tmp_path / "client.key").read_text()
+    )
+    ca_dir = tmp_path / "certificates"
+    ca_dir.mkdir()
+    ca_hash = subprocess.run(
+        ["openssl", "x509", "-hash", "-noout", "-in", str(tmp_path / "ca.pem")],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    shutil.copy(tmp_path / "ca.pem", ca_dir / f"{ca_hash}.0")
+    return tmp_path, str(proxy), str(ca_dir)
+
+
+@pytest.fixture
+def mtls_server(pki):
+    """An HTTPS server that requires a client certificate signed by the test CA"""
+    tmp_path, _, _ = pki
+    clients = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            clients.append(self.connection.getpeercert()["subject"])
+            body = json.dumps({"ferry_status": "success", "ferry_output": []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(cafile=str(tmp_path / "ca.pem"))
+    context.load_cert_chain(str(tmp_path / "server.pem"), str(tmp_path / "server.key"))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"https://localhost:{server.server_address[1]}/", clients
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+def test_ssl_context_cached(pki, monkeypatch):
+    monkeypatch.setattr(auth, "_ssl_context_cache", {})
+    _, proxy, ca_dir = pki
+    authorizer = auth.AuthCert(cert_path=proxy, ca_path=ca_dir)
+    context = authorizer.ssl_context()
+    assert isinstance(context, ssl.SSLContext)
+    assert auth.AuthCert(cert_path=proxy, ca_path=ca_dir).ssl_context() is context
+    # Servers are verified as requests would verify them with the same paths
+    defaults = create_urllib3_context()
+    assert context.verify_flags == defaults.verify_flags
+    assert context.verify_mode == ssl.CERT_REQUIRED
+
+    # An unusable proxy falls back to the session's cert and verify settings
+    bad = pki[0] / "bad"
+    bad.write_text("not a certificate\n")
+    assert auth.AuthCert(cert_path=str(bad), ca_path=ca_dir).ssl_context() is None
+
+
+@pytest.mark.unit
+def test_cert_auth_with_shared_context(pki, mtls_server, monkeypatch):
+    monkeypatch.setattr(auth, "_ssl_context_cache", {})
+    _, proxy, ca_dir = pki
+    base_url, clients = mtls_server
+    api = FerryAPI(
+        base_url=base_url,
+        authorizer=auth.AuthCert(cert_path=proxy, ca_path=ca_dir),
+        debug_level=auth.DebugLevel.QUIET,
+        keep_alive=False,  # A new connection (and handshake) for each call
+        retry_policy=RetryPolicy(retries=0),
+    )
+    for _ in range(3):
+        assert api.call_endpoint("ping", use_cache=False)["ferry_status"] == "success"
+    assert len(clients) == 3
+    assert ((("commonName", "client"),),) in clients
+
+    adapter = api.get_session().get_adapter(base_url)
+    assert isinstance(adapter, SSLContextAdapter)
+    # Every connection used the shared context, rather than loading the paths again
+    pools = list(adapter.poolmanager.pools._container.values())
+    assert len(pools) == 1
+    assert pools[0].conn_kw["ssl_context"] is adapter.ssl_context
+    assert pools[0].cert_file is None and pools[0].ca_cert_dir is None
+    api.close()
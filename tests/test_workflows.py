@@ -0,0 +1,601 @@
+import threading
+import time
+
+import pytest
+
+from ferry_cli.helpers.api import FerryAPI
+from ferry_cli.helpers.auth import Auth, DebugLevel
+from ferry_cli.helpers.supported_workflows.NewCapabilitySet import NewCapabilitySet
+from ferry_cli.helpers.workflows import Step, Workflow, check_steps
+
+
+class _Steps(Workflow):
+    def __init__(self):
+        self.name = "steps"
+        self.method = "GET"
+        self.description = "Runs steps"
+        self.params = []
+        super().__init__()
+
+    def run(self, api, args):
+        return self.run_steps(api, args)
+
+
+def _step(name, log, needs=(), delay=0.05, result=None, **kwargs):
+    def func(inputs):
+        log.append(("start", name, sorted(inputs)))
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        log.append(("end", name))
+        return name if result is None else result
+
+    return Step(name, func, needs, **kwargs)
+
+
+@pytest.mark.unit
+def test_check_steps():
+    check_steps([Step("a", print), Step("b", print, ["a"])])
+    with pytest.raises(ValueError, match="more than once"):
+        check_steps([Step("a", print), Step("a", print)])
+    with pytest.raises(ValueError, match="needs b"):
+        check_steps([Step("a", print, ["b"]), Step("b", print)])
+
+
+@pytest.mark.unit
+def test_independent_steps_run_concurrently(fake_ferry_api):
+    log = []
+    steps = [
+        _step("a", log),
+        _step("b", log),
+        _step("c", log, needs=["a"]),
+        _step("d", log, needs=["b", "c"]),
+    ]
+    results = _Steps().run(fake_ferry_api(), steps)
+    assert results == {"a": "a", "b": "b", "c": "c", "d": "d"}
+    # a and b start together, and each later step as soon as what it needs has finished
+    assert {entry[:2] for entry in log[:2]} == {("start", "a"), ("start", "b")}
+    assert ("start", "d", ["b", "c"]) in log
+    assert log.index(("start", "c", ["a"])) > log.index(("end", "a"))
+
+
+@pytest.mark.unit
+def test_failed_step_stops_later_steps(fake_ferry_api, capsys):
+    log = []
+    steps = [
+        _step("a", log, result=ValueError("a failed"), failure="Failed to do a"),
+        _step("b", log, delay=0.1),
+        _step("c", log, needs=["a"]),
+        _step("d", log, needs=["b"]),
+    ]
+    with pytest.raises(ValueError, match="a failed"):
+        _Steps().run(fake_ferry_api(), steps)
+    # b was already running, so it finishes, but nothing else starts
+    assert ("end", "b") in log
+    assert {entry[1] for entry in log} == {"a", "b"}
+    assert "Failed to do a" in capsys.readouterr().out
+
+    api = fake_ferry_api(debug_level=DebugLevel.QUIET)
+    with pytest.raises(ValueError):
+        _Steps().run(api, steps[:1])
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.unit
+def test_dryrun_runs_steps_in_order():
+    log = []
+    api = FerryAPI(base_url="https://example.com/", authorizer=Auth(), dryrun=True)
+    steps = [
+        _step("b", log, delay=0),
+        _step("check b", log, needs=["b"], delay=0, dryrun=False),
+        _step("a", log, delay=0),
+        _step("c", log, needs=["check b", "a"], delay=0),
+    ]
+    results = _Steps().run(api, steps)
+    assert [entry[1] for entry in log if entry[0] == "start"] == ["b", "a", "c"]
+    assert results["check b"] is None
+
+
+@pytest.mark.unit
+def test_NewCapabilitySet_concurrent(fake_ferry, fake_ferry_api):
+    def put(request):
+        time.sleep(0.05)
+        return {"ferry_status": "success", "ferry_output": {}}
+
+    for endpoint in (
+        "createGroup",
+        "addGroupToUnit",
+        "addUserToGroup",
+        "createFQAN",
+        "createCapabilitySet",
+        "addCapabilitySetToFQAN",
+    ):
+        fake_ferry.add(endpoint, put)
+    fake_ferry.add(
+        "getGroupName",
+        {"ferry_status": "success", "ferry_output": {"groupname": "testgroup"}},
+    )
+    fake_ferry.add(
+        "getGroupUnits",
+        {"ferry_status": "success", "ferry_output": [{"unitname": "testunit"}]},
+    )
+    fake_ferry.add(
+        "getGroupMembers",
+        {"ferry_status": "success", "ferry_output": [{"username": "testuser"}]},
+    )
+    fake_ferry.add(
+        "getCapabilitySet",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {
+                    "setname": "testset",
+                    "patterns": ["scope2", "scope1"],
+                    "roles": [
+                        {"role": "myrole", "fqan": "/org/Role=myrole/Capability=NULL"}
+                    ],
+                }
+            ],
+        },
+    )
+    args = {
+        "groupname": "testgroup",
+        "gid": 1234,
+        "unitname": "testunit",
+        "fqan": "/org/Role=myrole/Capability=NULL",
+        "setname": "testset",
+        "scopes_pattern": "scope1,scope2",
+        "mapped_user": "testuser",
+    }
+    NewCapabilitySet().run(fake_ferry_api(), args)
+    endpoints = [request.path_url.split("?")[0] for request in fake_ferry.requests]
+    assert sorted(endpoints) == sorted(
+        [
+            "/createGroup",
+            "/getGroupName",
+            "/addGroupToUnit",
+            "/getGroupUnits",
+            "/addUserToGroup",
+            "/getGroupMembers",
+            "/createFQAN",
+            "/createCapabilitySet",
+            "/addCapabilitySetToFQAN",
+            "/getCapabilitySet",
+        ]
+    )
+    # Each write comes after the checks of what it builds on
+    assert endpoints.index("/addGroupToUnit") > endpoints.index("/getGroupName")
+    assert endpoints.index("/createFQAN") > endpoints.index("/getGroupUnits")
+    assert endpoints.index("/createFQAN") > endpoints.index("/getGroupMembers")
+    assert endpoints.index("/createCapabilitySet") > endpoints.index("/getGroupUnits")
+    assert endpoints.index("/createCapabilitySet") > endpoints.index("/getGroupMembers")
+
+    # A failed check stops the workflow before the writes that build on it
+    fake_ferry.requests.clear()
+    fake_ferry.responses["getGroupUnits"] = []
+    fake_ferry.add(
+        "getGroupUnits",
+        {"ferry_status": "success", "ferry_output": [{"unitname": "otherunit"}]},
+    )
+    with pytest.raises(ValueError, match="does not belong to unit"):
+        NewCapabilitySet().run(fake_ferry_api(), args)
+    endpoints = [request.path_url.split("?")[0] for request in fake_ferry.requests]
+    assert "/createFQAN" not in endpoints
+    assert "/createCapabilitySet" not in endpoints
+    assert "/addCapabilitySetToFQAN" not in endpoints
+
+
+@pytest.mark.unit
+def test_CloneResource_user_access(fake_ferry, fake_ferry_api, capsys):
+    from urllib.parse import parse_qs, urlsplit
+
+    from ferry_cli.helpers.supported_workflows.CloneResource import CloneResource
+
+    users = [
+        {"username": f"user{i}", "shell": "/bin/bash", "status": True}
+        for i in range(40)
+    ]
+    fake_ferry.add(
+        "getAllComputeResources",
+        {
+            "ferry_status": "success",
+            "ferry_output": [{"resourcename": "old", "unitname": "unit"}],
+        },
+    )
+    fake_ferry.add(
+        "createComputeResource", {"ferry_status": "success", "ferry_output": {}}
+    )
+    fake_ferry.add(
+        "getUserGroupsForComputeResource",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {"resourcename": "old", "users": users[:30]},
+                {"resourcename": "other", "users": [{"username": "outsider"}]},
+                {"resourcename": "old", "users": users[30:]},
+            ],
+        },
+    )
+    state = {"in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+
+    def set_access(request):
+        username = parse_qs(urlsplit(request.url).query)["username"][0]
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        time.sleep(0.01)
+        with lock:
+            state["in_flight"] -= 1
+        if username in ("user3", "user17"):
+            return {
+                "ferry_status": "failure",
+                "ferry_error": [f"no such user {username}"],
+            }
+        return {"ferry_status": "success", "ferry_output": {}}
+
+    fake_ferry.add("setUserAccessToComputeResource", set_access)
+
+    workflow = CloneResource()
+    workflow.concurrency = 4
+    args = {"clone": "old", "new_resource": "new", "unitname": "unit"}
+    with pytest.raises(
+        RuntimeError, match="for 2 of 40 users: user(3|17), user(3|17)$"
+    ):
+        workflow.run(fake_ferry_api(), args)
+
+    updates = [
+        parse_qs(urlsplit(request.url).query)
+        for request in fake_ferry.requests
+        if "setUserAccessToComputeResource" in request.url
+    ]
+    # Every user was updated, even after failures, without their status
+    assert sorted(update["username"][0] for update in updates) == sorted(
+        user["username"] for user in users
+    )
+    assert all(update["resourcename"] == ["new"] for update in updates)
+    assert not any("status" in update for update in updates)
+    assert 1 < state["max_in_flight"] <= 4
+
+    out = capsys.readouterr().out
+    assert "Updated access for 40 of 40 users (2 failed)" in out
+    assert "Updated access to new for 38 of 40 users" in out
+    assert "Failed to update access for user17: no such user user17" in out
+
+    # Without failures the workflow succeeds as before
+    fake_ferry.responses["setUserAccessToComputeResource"] = []
+    fake_ferry.add(
+        "setUserAccessToComputeResource",
+        {"ferry_status": "success", "ferry_output": {}},
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        workflow.run(fake_ferry_api(), args)
+    assert exit_info.value.code == 0
+
+
+def _capability_set_state(fake_ferry, units, members, capability_sets, fqans=()):
+    fake_ferry.add(
+        "getGroupName",
+        {"ferry_status": "success", "ferry_output": {"groupname": "testgroup"}},
+    )
+    fake_ferry.add("getGroupUnits", {"ferry_status": "success", "ferry_output": units})
+    fake_ferry.add(
+        "getGroupMembers", {"ferry_status": "success", "ferry_output": members}
+    )
+    fake_ferry.add(
+        "getCapabilitySet",
+        {"ferry_status": "success", "ferry_output": capability_sets},
+    )
+    fake_ferry.add(
+        "getVORoleMapFile",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {"fqan": fqan, "unitname": "testunit", "mapped_uname": "testuser"}
+                for fqan in fqans
+            ],
+        },
+    )
+
+
+_CAPABILITY_SET_ARGS = {
+    "groupname": "testgroup",
+    "gid": 1234,
+    "unitname": "testunit",
+    "fqan": "/org/Role=myrole/Capability=NULL",
+    "setname": "testset",
+    "scopes_pattern": "scope1,scope2",
+    "mapped_user": "testuser",
+}
+
+
+@pytest.mark.unit
+def test_NewCapabilitySet_reconcile_converged(fake_ferry, fake_ferry_api, capsys):
+    _capability_set_state(
+        fake_ferry,
+        [{"unitname": "testunit"}],
+        [{"username": "testuser"}],
+        [
+            {
+                "setname": "testset",
+                "patterns": ["scope2", "scope1"],
+                "roles": [
+                    {"role": "myrole", "fqan": "/org/Role=myrole/Capability=NULL"}
+                ],
+            }
+        ],
+        ["/org/Role=myrole/Capability=NULL"],
+    )
+    assert NewCapabilitySet().reconcile(fake_ferry_api(), _CAPABILITY_SET_ARGS) is None
+    # Only reads, one of each
+    endpoints = [request.path_url.split("?")[0] for request in fake_ferry.requests]
+    assert sorted(endpoints) == [
+        "/getCapabilitySet",
+        "/getGroupMembers",
+        "/getGroupName",
+        "/getGroupUnits",
+        "/getVORoleMapFile",
+    ]
+    assert "already up to date" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+def test_NewCapabilitySet_plan_partial(fake_ferry, fake_ferry_api):
+    # The group exists in the unit, but the user, the FQAN and the capability set are missing
+    _capability_set_state(
+        fake_ferry,
+        [{"unitname": "testunit"}],
+        [{"username": "someoneelse"}],
+        [],
+    )
+    workflow = NewCapabilitySet()
+    workflow.plan_only = True
+    plan = workflow.reconcile(fake_ferry_api(), _CAPABILITY_SET_ARGS)
+    assert [call["endpoint"] for call in plan] == [
+        "addUserToGroup",
+        "createCapabilitySet",
+        "createFQAN",
+        "addCapabilitySetToFQAN",
+    ]
+    assert all(
+        not request.path_url.startswith(("/add", "/create"))
+        for request in fake_ferry.requests
+    )
+
+    # Applying the plan makes exactly those writes
+    for endpoint in ("addUserToGroup", "createCapabilitySet", "createFQAN"):
+        fake_ferry.add(endpoint, {"ferry_status": "success", "ferry_output": {}})
+    fake_ferry.add(
+        "addCapabilitySetToFQAN", {"ferry_status": "success", "ferry_output": {}}
+    )
+    fake_ferry.requests.clear()
+    workflow.plan_only = False
+    workflow.reconcile(fake_ferry_api(), _CAPABILITY_SET_ARGS)
+    writes = [
+        request.path_url.split("?")[0]
+        for request in fake_ferry.requests
+        if not request.path_url.startswith("/get")
+    ]
+    assert sorted(writes) == sorted("/" + call["endpoint"] for call in plan)
+    assert writes.index("/addCapabilitySetToFQAN") > writes.index("/createFQAN")
+
+    # State that the workflow can't fix is an error, rather than being overwritten
+    fake_ferry.responses["getCapabilitySet"] = []
+    fake_ferry.add(
+        "getCapabilitySet",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {"setname": "testset", "patterns": ["other"], "roles": []}
+            ],
+        },
+    )
+    with pytest.raises(ValueError):
+        workflow.plan(fake_ferry_api(), _CAPABILITY_SET_ARGS)
+
+
+@pytest.mark.unit
+def test_NewCapabilitySet_plan_existing_fqan(fake_ferry, fake_ferry_api):
+    # The FQAN was created, e.g. by a run that stopped before linking it to the capability set
+    _capability_set_state(
+        fake_ferry,
+        [{"unitname": "testunit"}],
+        [{"username": "testuser"}],
+        [{"setname": "testset", "patterns": ["scope1", "scope2"], "roles": []}],
+        ["/org/Role=otherrole/Capability=NULL", "/org/Role=myrole/Capability=NULL"],
+    )
+    plan = NewCapabilitySet().plan(fake_ferry_api(), _CAPABILITY_SET_ARGS)
+    assert [call.endpoint for call in plan] == ["addCapabilitySetToFQAN"]
+
+    # If the FQANs can't be read, the FQAN is created to be sure
+    fake_ferry.responses["getVORoleMapFile"] = []
+    fake_ferry.add("getVORoleMapFile", {"ferry_status": "failure"}, status=500)
+    plan = NewCapabilitySet().plan(fake_ferry_api(), _CAPABILITY_SET_ARGS)
+    assert [call.endpoint for call in plan] == ["createFQAN", "addCapabilitySetToFQAN"]
+
+
+@pytest.mark.unit
+def test_CloneResource_reconcile(fake_ferry, fake_ferry_api, capsys):
+    from urllib.parse import parse_qs, urlsplit
+
+    from ferry_cli.helpers.supported_workflows.CloneResource import CloneResource
+
+    fake_ferry.add(
+        "getAllComputeResources",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {"resourcename": "old", "unitname": "unit", "shell": "/bin/bash"},
+                {"resourcename": "new", "unitname": "unit", "shell": "/bin/bash"},
+            ],
+        },
+    )
+    fake_ferry.add(
+        "getUserGroupsForComputeResource",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {
+                    "resourcename": "old",
+                    "users": [
+                        {"username": "user1", "shell": "/bin/bash", "status": True},
+                        {"username": "user2", "shell": "/bin/bash", "status": True},
+                    ],
+                },
+                {
+                    "resourcename": "new",
+                    "users": [
+                        {"username": "user1", "shell": "/bin/bash", "status": False}
+                    ],
+                },
+            ],
+        },
+    )
+    fake_ferry.add(
+        "setUserAccessToComputeResource",
+        {"ferry_status": "success", "ferry_output": {}},
+    )
+    args = {"clone": "old", "new_resource": "new", "unitname": "unit"}
+    workflow = CloneResource()
+    workflow.plan_only = True
+    assert workflow.reconcile(fake_ferry_api(), args) == [
+        {
+            "endpoint": "setUserAccessToComputeResource",
+            "method": "PUT",
+            "params": {
+                "username": "user2",
+                "shell": "/bin/bash",
+                "resourcename": "new",
+            },
+        }
+    ]
+
+    workflow.plan_only = False
+    workflow.reconcile(fake_ferry_api(), args)
+    writes = [
+        parse_qs(urlsplit(request.url).query)
+        for request in fake_ferry.requests
+        if "setUserAccessToComputeResource" in request.url
+    ]
+    # The resource already matches, and user1 already has the same access
+    assert [write["username"] for write in writes] == [["user2"]]
+    assert not any(
+        endpoint in request.url
+        for request in fake_ferry.requests
+        for endpoint in ("createComputeResource", "setComputeResourceInfo")
+    )
+    assert "cloneResource: made 1 write(s)" in capsys.readouterr().out
+
+
+def _run_id(journal_dir):
+    (path,) = journal_dir.glob("*.jsonl")
+    return path.stem
+
+
+@pytest.mark.unit
+def test_resume_skips_completed_steps(fake_ferry_api, tmp_path):
+    from ferry_cli.helpers.journal import WorkflowJournal
+
+    log = []
+    steps = [
+        _step("a", log, delay=0, result={"from": "a"}, write=True),
+        # A read, so it isn't journaled
+        _step("b", log, delay=0),
+        _step(
+            "c",
+            log,
+            needs=["a"],
+            delay=0,
+            result=RuntimeError("network blip"),
+            write=True,
+        ),
+        _step("d", log, needs=["b", "c"], delay=0, write=True),
+    ]
+    workflow = _Steps()
+    workflow.journal = WorkflowJournal.create(tmp_path, "steps", {})
+    with pytest.raises(RuntimeError):
+        workflow.run(fake_ferry_api(debug_level=DebugLevel.QUIET), steps)
+    workflow.journal.close()
+
+    log.clear()
+    steps[2] = _step("c", log, needs=["a"], delay=0, write=True)
+    workflow = _Steps()
+    workflow.journal = WorkflowJournal.resume(tmp_path, _run_id(tmp_path), "steps", {})
+    assert workflow.journal.resumed == 1
+    results = workflow.run(fake_ferry_api(), steps)
+    # Only the completed write is skipped: the read runs again, and c gets a's recorded result
+    assert sorted(entry[1] for entry in log if entry[0] == "start") == ["b", "c", "d"]
+    assert results == {"a": {"from": "a"}, "b": "b", "c": "c", "d": "d"}
+
+
+@pytest.mark.unit
+def test_CloneResource_resume(fake_ferry, fake_ferry_api, tmp_path):
+    from urllib.parse import parse_qs, urlsplit
+
+    from ferry_cli.helpers.journal import WorkflowJournal
+    from ferry_cli.helpers.supported_workflows.CloneResource import CloneResource
+
+    fake_ferry.add(
+        "getAllComputeResources",
+        {
+            "ferry_status": "success",
+            "ferry_output": [{"resourcename": "old", "unitname": "unit"}],
+        },
+    )
+    fake_ferry.add(
+        "createComputeResource", {"ferry_status": "success", "ferry_output": {}}
+    )
+    fake_ferry.add(
+        "getUserGroupsForComputeResource",
+        {
+            "ferry_status": "success",
+            "ferry_output": [
+                {
+                    "resourcename": "old",
+                    "users": [{"username": f"user{i}"} for i in range(5)],
+                }
+            ],
+        },
+    )
+
+    def set_access(request):
+        if "user3" in request.url:
+            return {"ferry_status": "failure", "ferry_error": ["token expired"]}
+        return {"ferry_status": "success", "ferry_output": {}}
+
+    fake_ferry.add("setUserAccessToComputeResource", set_access)
+    args = {"clone": "old", "new_resource": "new", "unitname": "unit"}
+    api = fake_ferry_api(debug_level=DebugLevel.QUIET)
+    workflow = CloneResource()
+    workflow.journal = WorkflowJournal.create(tmp_path, workflow.name, args)
+    with pytest.raises(RuntimeError, match="user3"):
+        workflow.run(api, args)
+    workflow.journal.close()
+
+    fake_ferry.requests.clear()
+    fake_ferry.responses["setUserAccessToComputeResource"] = []
+    fake_ferry.add(
+        "setUserAccessToComputeResource",
+        {"ferry_status": "success", "ferry_output": {}},
+    )
+    workflow = CloneResource()
+    workflow.journal = WorkflowJournal.resume(
+        tmp_path, _run_id(tmp_path), workflow.name, args
+    )
+    with pytest.raises(SystemExit):
+        workflow.run(api, args)
+    # The resources and user groups are read again, but the resource isn't created again, and
+    # only the failed update is retried
+    assert sorted(
+        request.path_url.split("?")[0] for request in fake_ferry.requests
+    ) == [
+        "/getAllComputeResources",
+        "/getUserGroupsForComputeResource",
+        "/setUserAccessToComputeResource",
+    ]
+    (update,) = [
+        request
+        for request in fake_ferry.requests
+        if "setUserAccessToComputeResource" in request.url
+    ]
+    assert parse_qs(urlsplit(update.url).query)["username"] == ["user3"]